@@ -16,7 +16,23 @@ class BufferedWindow(wx.Window):
     update_view() method, which will cause render(gc) to be called on the next
     idle event.
 
+    Dragging the mouse with the left button down pans the view: the offset
+    accumulates the panning, and the part of it not yet drawn is handed to
+    scroll_bitmap() on the next idle event, so that the derived classes can
+    shift the current drawing rather than redraw it all.
+
+    The mouse wheel zooms the view around the mouse position. The current
+    frame is scaled and cropped right away by preview_bitmap(), and the full
+    render is only requested once the wheel has been idle for zoom_delay
+    milliseconds. Panning during that time also goes through the preview.
+
     """
+    # View scale factor for each notch of the mouse wheel
+    zoom_step = 1.25
+
+    # Wait this long after the last wheel event before the full render
+    zoom_delay = 250
+
     def __init__(self, *args, **kwargs):
         super().__init__( *args, **kwargs)
 
@@ -24,6 +40,13 @@ class BufferedWindow(wx.Window):
         self.Bind(wx.EVT_PAINT, self.on_paint)       
         self.Bind(wx.EVT_IDLE, self.on_idle)
         self.Bind(wx.EVT_SIZE, self.on_size)
+        self.Bind(wx.EVT_LEFT_DOWN, self.on_left_down)
+        self.Bind(wx.EVT_LEFT_UP, self.on_left_up)
+        self.Bind(wx.EVT_MOTION, self.on_motion)
+        self.Bind(wx.EVT_MOUSE_CAPTURE_LOST, self.on_capture_lost)
+        self.Bind(wx.EVT_MOUSEWHEEL, self.on_wheel)
+        self.zoom_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_zoom_timer, self.zoom_timer)
 
         # Initialize the bitmap with the right size. Note that ClientSize has
         # type 'wx.Size', not tuple, this breaks pillow code so we fix it.
@@ -33,6 +56,16 @@ class BufferedWindow(wx.Window):
         self.redraw_needed = False
         self.layering = False
 
+        # Panning, in pixels: total offset, and part not drawn yet
+        self.offset = 0, 0
+        self.scroll = 0, 0
+        self.drag_pos = None  # Last mouse position while dragging
+
+        # Zooming: view scale, and (scale, translation) from the frame last
+        # rendered to the view while the full render is pending, or None
+        self.zoom = 1.0
+        self.preview = None
+
     def on_paint(self, _):
         """Copy the bitmap to the screen"""
         dc = wx.BufferedPaintDC(self, self.bitmap)
@@ -45,15 +78,124 @@ class BufferedWindow(wx.Window):
             self.size = sz
             self.update_view()
 
+    def on_left_down(self, e):
+        """Start panning."""
+        self.drag_pos = e.GetPosition()
+        if not self.HasCapture():
+            self.CaptureMouse()
+
+    def on_motion(self, e):
+        """Pan the view by the distance the mouse moved since last time."""
+        if self.drag_pos is None or not e.LeftIsDown():
+            return
+        pos = e.GetPosition()
+        self.scroll_view(pos.x - self.drag_pos.x, pos.y - self.drag_pos.y)
+        self.drag_pos = pos
+
+    def on_left_up(self, _):
+        """Stop panning."""
+        self.drag_pos = None
+        if self.HasCapture():
+            self.ReleaseMouse()
+
+    def on_capture_lost(self, _):
+        self.drag_pos = None
+
+    def on_wheel(self, e):
+        """Zoom in or out around the mouse position."""
+        notches = e.GetWheelRotation()/e.GetWheelDelta()
+        pos = e.GetPosition()
+        self.zoom_view(self.zoom_step**notches, (pos.x, pos.y))
+
+    def on_zoom_timer(self, _):
+        """The wheel has settled, time for the full render."""
+        self.update_view()
+
     def on_idle(self, _):
         """Rebuild the bitmap, update drawing, if needed."""
+        dx, dy = self.scroll
         if self.redraw_needed:
-            # render_bitmap is implemented in the derived classes
-            self.bitmap = self.render_bitmap(self.layering)
-            self.redraw_needed = False
-            self.Refresh()
+            # render_bitmap is implemented in the derived classes. Pending
+            # panning or zooming means the layers are out of date, too.
+            layering = self.layering and dx == 0 and dy == 0 and \
+                       self.preview is None
+            self.bitmap = self.render_bitmap(layering)
+            self.preview = None
+            self.zoom_timer.Stop()
+        elif dx != 0 or dy != 0:
+            # So is scroll_bitmap, it only draws what the panning exposed
+            self.bitmap = self.scroll_bitmap(dx, dy)
+        else:
+            return
+        self.redraw_needed = False
+        self.scroll = 0, 0
+        self.Refresh()
+
+    def frame_to_bitmap(self, pixels):
+        """Hand an (h, w, 4) RGBA frame over to wx.
+
+        The array is passed to wx through the buffer protocol, without an
+        intermediate bytes copy, and the current bitmap is reused when its
+        size hasn't changed.
+        """
+        h, w = pixels.shape[:2]
+        if self.bitmap.GetSize() == wx.Size(w, h) and \
+           self.bitmap.GetDepth() == 32:
+            self.bitmap.CopyFromBuffer(pixels, wx.BitmapBufferFormat_RGBA)
+            return self.bitmap
+        return wx.Bitmap.FromBufferRGBA(w, h, pixels)
 
     def update_view(self, layering=False):
         """Outside world's interface to request a redraw."""
         self.redraw_needed = True
         self.layering = layering
+
+    def scroll_view(self, dx, dy):
+        """Outside world's interface to pan the view by (dx, dy) pixels."""
+        self.offset = self.offset[0] + dx, self.offset[1] + dy
+        if self.preview is None:
+            self.scroll = self.scroll[0] + dx, self.scroll[1] + dy
+            return
+
+        # A zoom is pending, the frame doesn't match the view anyway
+        scale, (tx, ty) = self.preview
+        self.preview = scale, (tx + dx, ty + dy)
+        self.show_preview()
+
+    def zoom_view(self, factor, center):
+        """Outside world's interface to zoom the view around center.
+
+        The view is scaled by factor, center being a window position that
+        stays in place. The full render is deferred, see zoom_delay.
+        """
+        cx, cy = center
+        ox, oy = self.offset
+        self.zoom *= factor
+        self.offset = factor*(ox - cx) + cx, factor*(oy - cy) + cy
+
+        # The frame last rendered lags behind the panning not drawn yet
+        scale, (tx, ty) = self.preview or (1.0, self.scroll)
+        self.scroll = 0, 0
+        self.preview = factor*scale, (factor*(tx - cx) + cx,
+                                      factor*(ty - cy) + cy)
+        self.show_preview()
+
+    def show_preview(self):
+        """Show the preview now, and (re)start the wait for the full render."""
+        bitmap = self.preview_bitmap(*self.preview)
+        if bitmap is not None:
+            self.bitmap = bitmap
+            self.Refresh()
+        self.zoom_timer.StartOnce(self.zoom_delay)
+
+    def scroll_bitmap(self, dx, dy):
+        """Update the bitmap after panning, by default redraw it all."""
+        return self.render_bitmap()
+
+    def preview_bitmap(self, scale, translate):
+        """Approximation of the bitmap after zooming, None if there's none.
+
+        The view is the frame last rendered, scaled by scale then translated
+        by translate.
+        """
+        return None
@@ -0,0 +1,152 @@
+# mapv/clip.py - viewport clipping
+
+"""Clipping geometry to a rectangle, in a vectorized way.
+
+This runs between the transformation to window coordinates and the
+rasterizer, so that only visible geometry reaches it: segments are clipped
+with the Cohen-Sutherland algorithm, all of them at once, and rings (polygon
+outlines) with the Sutherland-Hodgman algorithm, all of the ring's vertices at
+once for each side of the rectangle.
+
+Rectangles are given as (xmin, ymin, xmax, ymax), in window coordinates this
+is (left, upper, right, lower).
+
+"""
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Cohen-Sutherland outcodes
+LEFT = 1
+RIGHT = 2
+BELOW = 4  # y < ymin
+ABOVE = 8  # y > ymax
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def outcodes(x, y, rect):
+    """Cohen-Sutherland outcodes of points, 0 for the points inside rect."""
+    xmin, ymin, xmax, ymax = rect
+    return ((x < xmin)*LEFT | (x > xmax)*RIGHT |
+            (y < ymin)*BELOW | (y > ymax)*ABOVE).astype(np.uint8)
+
+def box_inside(box, rect):
+    """True if box is entirely inside rect."""
+    return (box[0] >= rect[0] and box[1] >= rect[1] and
+            box[2] <= rect[2] and box[3] <= rect[3])
+
+def box_outside(box, rect):
+    """True if box doesn't intersect rect."""
+    return (box[2] < rect[0] or box[3] < rect[1] or
+            box[0] > rect[2] or box[1] > rect[3])
+
+#-------------------------------------------------------------------------------
+# Segments
+#-------------------------------------------------------------------------------
+
+def clip_segments(segs, rect):
+    """Clip an (n, 4) array of x0, y0, x1, y1 segments to rect.
+
+    Segments entirely outside are dropped, the others are shortened to their
+    visible part. Each round moves one outside endpoint of every segment onto
+    the rectangle side given by its outcode, at most four rounds are needed.
+    """
+    segs = np.array(segs, dtype=np.float64).reshape(-1, 4)
+    c0 = outcodes(segs[:, 0], segs[:, 1], rect)
+    c1 = outcodes(segs[:, 2], segs[:, 3], rect)
+    keep = (c0 & c1) == 0
+    segs, c0, c1 = segs[keep], c0[keep], c1[keep]
+
+    while True:
+        out = (c0 | c1) != 0
+        if not out.any():
+            return segs
+
+        # Move endpoint 0 if it's outside, else endpoint 1
+        first = c0 != 0
+        code = np.where(first, c0, c1)[out]
+        s = segs[out]
+        x0, y0, x1, y1 = s.T
+        x, y = _intersect(x0, y0, x1, y1, code, rect)
+        idx = np.nonzero(out)[0]
+        f = first[out]
+        segs[idx[f], 0], segs[idx[f], 1] = x[f], y[f]
+        segs[idx[~f], 2], segs[idx[~f], 3] = x[~f], y[~f]
+        c0[idx[f]] = outcodes(x[f], y[f], rect)
+        c1[idx[~f]] = outcodes(x[~f], y[~f], rect)
+
+        # Segments that only grazed a corner are now entirely outside
+        keep = (c0 & c1) == 0
+        segs, c0, c1 = segs[keep], c0[keep], c1[keep]
+
+def _intersect(x0, y0, x1, y1, code, rect):
+    """Intersection of segments with the rectangle side given by code."""
+    xmin, ymin, xmax, ymax = rect
+    dx = x1 - x0
+    dy = y1 - y0
+    x = np.empty_like(x0)
+    y = np.empty_like(y0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # One side per segment, in the same order as Cohen-Sutherland
+        for bit, side in ((ABOVE, ymax), (BELOW, ymin)):
+            m = (code & bit) != 0
+            y[m] = side
+            x[m] = x0[m] + dx[m]*(side - y0[m])/dy[m]
+            code = np.where(m, 0, code)
+        for bit, side in ((RIGHT, xmax), (LEFT, xmin)):
+            m = (code & bit) != 0
+            x[m] = side
+            y[m] = y0[m] + dy[m]*(side - x0[m])/dx[m]
+            code = np.where(m, 0, code)
+    return x, y
+
+#-------------------------------------------------------------------------------
+# Rings
+#-------------------------------------------------------------------------------
+
+def clip_ring(xy, rect):
+    """Clip a ring, an (n, 2) array of vertices, to rect.
+
+    The ring is implicitly closed, the result is a possibly empty (m, 2)
+    array of vertices. It is clipped against one side of the rectangle at a
+    time: a vertex is kept if it's inside, preceded by the intersection of the
+    incoming edge with the side if that edge crosses it.
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    xmin, ymin, xmax, ymax = rect
+    for axis, bound, greater in ((0, xmin, True), (0, xmax, False),
+                                 (1, ymin, True), (1, ymax, False)):
+        if len(xy) == 0:
+            break
+        v = xy[:, axis]
+        inside = v >= bound if greater else v <= bound
+        if inside.all():
+            continue
+
+        prev = np.roll(xy, 1, axis=0)
+        cross = inside != np.roll(inside, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (bound - prev[:, axis])/(v - prev[:, axis])
+            inter = prev + t[:, None]*(xy - prev)
+        inter[:, axis] = bound
+
+        # Each vertex emits an intersection (if crossing), then itself (if
+        # inside)
+        counts = cross.astype(np.int64) + inside
+        pos = np.cumsum(counts) - counts
+        out = np.empty((int(counts.sum()), 2))
+        out[pos[cross]] = inter[cross]
+        out[(pos + cross)[inside]] = xy[inside]
+        xy = out
+    return xy
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    print('This module is not meant to be executed directly.')
@@ -0,0 +1,93 @@
+# mapv/clip_t.py
+
+import unittest
+
+import numpy as np
+
+from clip import clip_segments, clip_ring
+
+#-------------------------------------------------------------------------------
+# I want stdout to be unbuffered, always
+#-------------------------------------------------------------------------------
+
+class Unbuffered(object):
+    def __init__(self, stream):
+        self.stream = stream
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+import sys
+sys.stdout = Unbuffered(sys.stdout)
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+rect = (0, 0, 10, 10)
+
+#-------------------------------------------------------------------------------
+# Segments
+#-------------------------------------------------------------------------------
+
+class Segments(unittest.TestCase):
+
+    def test_01_inside(self):
+        segs = [[1, 1, 9, 9], [2, 5, 3, 5]]
+        np.testing.assert_allclose(segs, clip_segments(segs, rect))
+
+    def test_02_outside(self):
+        segs = [[-5, -5, -1, 20], [11, 0, 15, 10], [-3, 2, 2, -3]]
+        self.assertEqual((0, 4), clip_segments(segs, rect).shape)
+
+    def test_03_crossing(self):
+        segs = [[-10, 5, 20, 5]]
+        np.testing.assert_allclose([[0, 5, 10, 5]], clip_segments(segs, rect))
+
+    def test_04_one_endpoint_inside(self):
+        segs = [[5, 5, 5, 25], [5, 5, -5, -5]]
+        np.testing.assert_allclose([[5, 5, 5, 10], [5, 5, 0, 0]],
+                                   clip_segments(segs, rect))
+
+    def test_05_diagonal_two_sides(self):
+        segs = [[-5, 5, 5, 15]]
+        np.testing.assert_allclose([[0, 10, 0, 10]],
+                                   clip_segments(segs, rect), atol=1e-12)
+
+    def test_06_empty(self):
+        self.assertEqual((0, 4), clip_segments(np.empty((0, 4)), rect).shape)
+
+#-------------------------------------------------------------------------------
+# Rings
+#-------------------------------------------------------------------------------
+
+class Rings(unittest.TestCase):
+
+    def test_01_inside(self):
+        ring = [[1, 1], [9, 1], [5, 8]]
+        np.testing.assert_allclose(ring, clip_ring(ring, rect))
+
+    def test_02_outside(self):
+        ring = [[11, 11], [19, 11], [15, 18]]
+        self.assertEqual(0, len(clip_ring(ring, rect)))
+
+    def test_03_overlapping_square(self):
+        ring = [[5, 5], [15, 5], [15, 15], [5, 15]]
+        y = clip_ring(ring, rect)
+        self.assertEqual({(5, 5), (10, 5), (10, 10), (5, 10)},
+                         {tuple(p) for p in y})
+
+    def test_04_rect_inside_ring(self):
+        ring = [[-5, -5], [15, -5], [15, 15], [-5, 15]]
+        y = clip_ring(ring, rect)
+        self.assertEqual({(0, 0), (10, 0), (10, 10), (0, 10)},
+                         {tuple(p) for p in y})
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,241 @@
+# mapv/compose.py - frame compositing with NumPy
+
+"""Layer compositing.
+
+A frame is an opaque RGBA buffer, white by default, over which the visible
+layers are stacked. Layers are kept as premultiplied RGBA arrays, so that
+stacking a layer is a single in-place "over" operation on the frame. The
+frame and its scratch buffer are allocated once per window size and reused on
+every redraw, and the frame itself is what gets copied into the wx.Bitmap.
+When the view is panned, the frame is shifted in place and only the strips it
+exposes need to be rendered again. When it's zoomed, the frame is resampled as
+a preview until the real render is done.
+
+"""
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def premultiply(im):
+    """Convert an RGBA Pillow image to a premultiplied (h, w, 4) uint8 array.
+
+    Also return the bounding box of the non-transparent pixels, as a (left,
+    upper, right, lower) tuple, or None if the image is fully transparent, so
+    that compositing can skip the empty parts of the layer.
+    """
+    bbox = im.getchannel('A').getbbox()
+    arr = np.array(im, dtype=np.uint8)
+    if bbox is None:
+        return arr, None
+
+    # rgb = round(rgb*a/255), computed on the non-transparent part only
+    left, upper, right, lower = bbox
+    sub = arr[upper:lower, left:right]
+    tmp = sub[..., :3]*sub[..., 3:4].astype(np.uint16)
+    tmp += 127
+    tmp //= 255
+    sub[..., :3] = tmp
+    return arr, bbox
+
+def over(dst, src, scratch, bbox):
+    """Composite premultiplied src over dst, in place, inside bbox only.
+
+    Both arrays are (h, w, 4) premultiplied RGBA, and dst is opaque: only its
+    color channels are updated. Argument scratch is a (h, w, 3) uint16 array
+    for the intermediate products.
+    """
+    left, upper, right, lower = bbox
+    dst = dst[upper:lower, left:right, :3]
+    tmp = scratch[upper:lower, left:right]
+    src = src[upper:lower, left:right]
+
+    # dst = src + dst*(255 - a)/255, with 16-bit intermediate values
+    np.multiply(dst, 255 - src[..., 3:4], out=tmp, dtype=np.uint16)
+    tmp += 127
+    tmp //= 255
+    tmp += src[..., :3]
+    np.copyto(dst, tmp, casting='unsafe')
+
+def layer_over(dst, src):
+    """Composite premultiplied src over premultiplied dst, in place.
+
+    Unlike over(), dst may be transparent, as a layer is: its alpha is updated
+    too. Both arrays are (h, w, 4) and have the same shape.
+    """
+    # dst = src + dst*(255 - a)/255, on the four channels
+    tmp = dst*(255 - src[..., 3:4]).astype(np.uint16)
+    tmp += 127
+    tmp //= 255
+    tmp += src
+    np.copyto(dst, tmp, casting='unsafe')
+
+def paint(dst, cov, color):
+    """Paint a solid color over dst, through the coverage mask cov.
+
+    Argument dst is a (h, w, 4) premultiplied RGBA array, cov is a (h, w)
+    uint8 array, and color an RGB or RGBA tuple. Only the covered pixels are
+    touched; their coordinates are returned as a (ys, xs) couple of arrays so
+    that the caller can reset the mask and track the painted area.
+    """
+    ys, xs = np.nonzero(cov)
+    if len(ys) == 0:
+        return ys, xs
+    r, g, b = color[:3]
+    a = color[3] if len(color) > 3 else 255
+
+    # Source alpha scaled to 255*255, then dst = src + dst*(1 - alpha)
+    alpha = cov[ys, xs].astype(np.uint32)*a
+    px = dst[ys, xs].astype(np.uint32)*(65025 - alpha)[:, None]
+    px += alpha[:, None]*np.array([r, g, b, 255], dtype=np.uint32)
+    px += 32512
+    px //= 65025
+    dst[ys, xs] = px
+    return ys, xs
+
+def shift(arr, dx, dy):
+    """Move the contents of an (h, w, ...) array by (dx, dy) pixels, in place.
+
+    The part of the array that is left uncovered keeps stale contents, it's
+    given by exposed().
+    """
+    h, w = arr.shape[:2]
+    src = arr[max(-dy, 0):h - max(dy, 0), max(-dx, 0):w - max(dx, 0)]
+    arr[max(dy, 0):h + min(dy, 0), max(dx, 0):w + min(dx, 0)] = src
+
+def exposed(size, dx, dy):
+    """Rectangles uncovered by shifting a frame of size by (dx, dy).
+
+    Return a list of at most two non-overlapping (left, upper, right, lower)
+    rectangles: a vertical strip for dx, and a horizontal one for dy.
+    """
+    w, h = size
+    rects = []
+    left, right = 0, w
+    if dx > 0:
+        rects.append((0, 0, dx, h))
+        left = dx
+    elif dx < 0:
+        rects.append((w + dx, 0, w, h))
+        right = w + dx
+    if dy > 0:
+        rects.append((left, 0, right, dy))
+    elif dy < 0:
+        rects.append((left, h + dy, right, h))
+    return [r for r in rects if r[0] < r[2] and r[1] < r[3]]
+
+def resample(dst, src, scale, translate, fill=(255, 255, 255, 255)):
+    """Scale and translate src into dst, with nearest neighbour sampling.
+
+    The dst pixel at (x, y) comes from src at ((x - tx)/scale, (y - ty)/scale),
+    the pixels that fall outside src are filled with fill. The source indexes
+    are computed once per row and once per column, and the covered part of
+    dst is a single rectangle, gathered in one go.
+    """
+    h, w = dst.shape[:2]
+    sh, sw = src.shape[:2]
+    tx, ty = translate
+    xs = np.floor((np.arange(w) + 0.5 - tx)/scale).astype(np.int64)
+    ys = np.floor((np.arange(h) + 0.5 - ty)/scale).astype(np.int64)
+    cols = np.nonzero((xs >= 0) & (xs < sw))[0]
+    rows = np.nonzero((ys >= 0) & (ys < sh))[0]
+
+    dst[...] = fill
+    if len(cols) > 0 and len(rows) > 0:
+        x0, x1 = cols[0], cols[-1] + 1
+        y0, y1 = rows[0], rows[-1] + 1
+        dst[y0:y1, x0:x1] = src[np.ix_(ys[y0:y1], xs[x0:x1])]
+
+#-------------------------------------------------------------------------------
+# FrameBuffer
+#-------------------------------------------------------------------------------
+
+class FrameBuffer:
+    """Preallocated buffers for building the frame shown in the window.
+
+    The pixels array has shape (h, w, 4) and is always opaque; the scratch
+    array holds the 16-bit intermediate products of the over operation, and
+    the coverage array is the mask the line rasterizer draws into, it is kept
+    all zeroes between two uses. The zoomed array holds the zoom preview.
+    """
+    def __init__(self):
+        self.size = None
+        self.pixels = None
+        self.scratch = None
+        self.coverage = None
+        self.zoomed = None
+
+    def resize(self, size):
+        """Reallocate the buffers, only if the window size has changed."""
+        if size == self.size:
+            return
+        w, h = size
+        self.size = size
+        self.pixels = np.empty((h, w, 4), dtype=np.uint8)
+        self.scratch = np.empty((h, w, 3), dtype=np.uint16)
+        self.coverage = np.zeros((h, w), dtype=np.uint8)
+        self.zoomed = np.empty((h, w, 4), dtype=np.uint8)
+
+    def clear(self, color=(255, 255, 255), rect=None):
+        """Fill the frame, or only rect, with an opaque background color."""
+        pixels = self.pixels
+        if rect is not None:
+            left, upper, right, lower = rect
+            pixels = pixels[upper:lower, left:right]
+        pixels[..., :3] = color
+        pixels[..., 3] = 255
+
+    def blit(self, im, rect=None):
+        """Copy an opaque image into the frame, or into its rect part.
+
+        The image has the size of the frame, or that of rect.
+        """
+        pixels = self.pixels
+        if rect is not None:
+            left, upper, right, lower = rect
+            pixels = pixels[upper:lower, left:right]
+        pixels[...] = np.asarray(im)
+
+    def scroll(self, dx, dy):
+        """Shift the frame by (dx, dy) pixels, return the exposed rectangles.
+
+        The exposed rectangles hold stale pixels, to be redrawn by the caller.
+        """
+        shift(self.pixels, dx, dy)
+        return exposed(self.size, dx, dy)
+
+    def zoom(self, scale, translate):
+        """Resample the frame into the zoomed array, see resample()."""
+        resample(self.zoomed, self.pixels, scale, translate)
+        return self.zoomed
+
+    def over(self, src, bbox=None):
+        """Composite a premultiplied layer over the frame, in place.
+
+        Only the part of the frame covered by bbox is touched, a bbox of None
+        means the whole frame.
+        """
+        if bbox is None:
+            w, h = self.size
+            bbox = 0, 0, w, h
+        over(self.pixels, src, self.scratch, bbox)
+
+    def paint(self, dst, color):
+        """Paint the coverage mask onto dst with color, then reset the mask.
+
+        Return the bounding box of the painted pixels, or None.
+        """
+        ys, xs = paint(dst, self.coverage, color)
+        if len(ys) == 0:
+            return None
+        self.coverage[ys, xs] = 0
+        return (int(xs.min()), int(ys.min()), int(xs.max()) + 1,
+                int(ys.max()) + 1)
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    print('This module is not meant to be executed directly.')
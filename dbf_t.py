@@ -0,0 +1,134 @@
+# mapv/dbf_t.py
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from shp.dbf import DbfFile
+
+#-------------------------------------------------------------------------------
+# I want stdout to be unbuffered, always
+#-------------------------------------------------------------------------------
+
+class Unbuffered(object):
+    def __init__(self, stream):
+        self.stream = stream
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+import sys
+sys.stdout = Unbuffered(sys.stdout)
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Name, type, length, decimals
+fields = [('ID', 'N', 6, 0), ('LENGTH', 'N', 8, 2), ('NAME', 'C', 12, 0),
+          ('BUILT', 'D', 8, 0), ('OPEN', 'L', 1, 0)]
+
+rows = [
+    ['1', '12.50', 'Rue Neuve', '20190315', 'T'],
+    ['2', '', 'Gare', '20200230', 'F'],
+    ['3', '7', 'Château', '', '?'],
+    ['40', '**', '', '19991231', 'y'],
+]
+
+#-------------------------------------------------------------------------------
+# Helper functions
+#-------------------------------------------------------------------------------
+
+def write_dbf(filepath, fields, rows, encoding='latin-1', deleted=(),
+              cut=0):
+    """Write a .dbf file, rows are lists of str, the rows in deleted are
+    marked deleted, and the last cut bytes are left out.
+    """
+    rec_len = 1 + sum(f[2] for f in fields)
+    hdr_len = 32 + 32*len(fields) + 1
+    s = struct.pack('<4BIHH20x', 3, 124, 1, 1, len(rows), hdr_len, rec_len)
+    for name, type_, length, decimals in fields:
+        s += struct.pack('<11sc4xBB14x', name.encode(), type_.encode(),
+                         length, decimals)
+    s += b'\r'
+    for i, row in enumerate(rows):
+        s += b'*' if i in deleted else b' '
+        for (_, type_, length, _), v in zip(fields, row):
+            v = v.encode(encoding)
+            s += v.rjust(length) if type_ in 'NF' else v.ljust(length)
+    s += b'\x1a'
+    with open(filepath, 'wb') as f:
+        f.write(s[:len(s) - cut])
+
+#-------------------------------------------------------------------------------
+# Columns
+#-------------------------------------------------------------------------------
+
+class Columns(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.dir, 'roads.dbf')
+        write_dbf(self.filepath, fields, rows, deleted=(1,))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_01_header(self):
+        dbf = DbfFile.build(self.filepath)
+        self.assertEqual(4, len(dbf))
+        self.assertEqual(['ID', 'LENGTH', 'NAME', 'BUILT', 'OPEN'], dbf.names)
+        self.assertEqual([False, True, False, False], dbf.deleted.tolist())
+
+    def test_02_numbers(self):
+        dbf = DbfFile.build(self.filepath)
+        self.assertEqual(np.int64, dbf['ID'].dtype)
+        self.assertEqual([1, 2, 3, 40], dbf['ID'].tolist())
+        np.testing.assert_array_equal([12.5, np.nan, 7, np.nan],
+                                      dbf['LENGTH'])
+
+    def test_03_blank_integers(self):
+        write_dbf(self.filepath, fields[:1], [['1'], [''], ['3']])
+        np.testing.assert_array_equal([1, np.nan, 3],
+                                      DbfFile.build(self.filepath)['ID'])
+
+    def test_04_characters(self):
+        dbf = DbfFile.build(self.filepath)
+        self.assertEqual(['Rue Neuve', 'Gare', 'Château', ''],
+                         dbf['NAME'].tolist())
+
+    def test_05_encoding(self):
+        write_dbf(self.filepath, fields, rows, encoding='utf-8')
+        with open(os.path.join(self.dir, 'roads.cpg'), 'w') as f:
+            f.write('UTF-8\n')
+        self.assertEqual('Château', DbfFile.build(self.filepath)['NAME'][2])
+
+    def test_06_dates(self):
+        built = DbfFile.build(self.filepath)['BUILT']
+        self.assertEqual(np.datetime64('2019-03-15'), built[0])
+        self.assertTrue(np.isnat(built[1]))  # February 30th
+        self.assertTrue(np.isnat(built[2]))
+        self.assertEqual(np.datetime64('1999-12-31'), built[3])
+
+    def test_07_logical(self):
+        self.assertEqual([True, False, False, True],
+                         DbfFile.build(self.filepath)['OPEN'].tolist())
+
+    def test_08_cut_short(self):
+        write_dbf(self.filepath, fields, rows, cut=10)
+        dbf = DbfFile.build(self.filepath)
+        self.assertEqual(3, len(dbf))
+        self.assertEqual([1, 2, 3], dbf['ID'].tolist())
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
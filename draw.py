@@ -1,10 +1,19 @@
 # mapv/draw.py - map viewer drawing code
 
+import weakref
+
+import numpy as np
 import wx
 
 from bitmaps import nbr_brush
 from bufwin import BufferedWindow
+from clip import box_inside, box_outside, clip_ring
+from compose import FrameBuffer, layer_over, over, paint, premultiply, shift
 from PIL import Image, ImageDraw, ImageFont, ImageColor
+from pbf.osm_areas import area_classes
+from raster import LineBatch, PolygonBatch, rasterize_polygons
+from spatial import ranges
+from tiles import TileRenderer, box_intersection, box_union
 from style import get_style
 
 #-------------------------------------------------------------------------------
@@ -23,6 +32,22 @@ class Unbuffered(object):
 import sys
 sys.stdout = Unbuffered(sys.stdout)
          
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Fill colors of the OSM areas, by class, see pbf/osm_areas.py
+area_colors = {
+    'water': '#aad3df',
+    'green': '#cdebb0',
+    'building': '#d9d0c9',
+    'other': '#ece8e0',
+}
+
+# Order the classes of areas are filled in, each one over the previous ones:
+# the generic class first, so that it doesn't hide what lies inside its areas
+area_fill_order = ('other', 'green', 'water', 'building')
+
 #-------------------------------------------------------------------------------
 # DrawingLayer
 #-------------------------------------------------------------------------------
@@ -31,7 +56,53 @@ class DrawingLayer:
     def __init__(self, code):
         self.code = code
         self.visible = False
-        self.image = None
+        self.pixels = None  # premultiplied RGBA array
+        self.bbox = None  # non-transparent part of pixels
+        self.size = None  # window size when pixels were rendered
+
+    def set_image(self, im, rect=None):
+        """Set the layer's pixels, or only their rect part, from an image."""
+        pixels, bbox = premultiply(im)
+        if rect is None:
+            self.pixels, self.bbox = pixels, bbox
+            self.size = im.size
+            return
+        left, upper, right, lower = rect
+        self.pixels[upper:lower, left:right] = pixels
+        if bbox is not None:
+            self.add_box((left + bbox[0], upper + bbox[1],
+                          left + bbox[2], upper + bbox[3]))
+
+    def scroll(self, dx, dy):
+        """Shift the layer's pixels after panning, see FrameBuffer.scroll()."""
+        shift(self.pixels, dx, dy)
+        if self.bbox is not None:
+            left, upper, right, lower = self.bbox
+            self.bbox = box_intersection((left + dx, upper + dy,
+                                          right + dx, lower + dy),
+                                         (0, 0) + self.size)
+
+    def over(self, im, rect=None):
+        """Composite an RGBA image over the layer's pixels, or over their
+        rect part, the image having the size of rect.
+        """
+        src, bbox = premultiply(im)
+        if bbox is None:
+            return
+        left, upper = (0, 0) if rect is None else rect[:2]
+        l, u, r, lo = bbox
+        layer_over(self.pixels[upper + u:upper + lo, left + l:left + r],
+                   src[u:lo, l:r])
+        self.add_box((left + l, upper + u, left + r, upper + lo))
+
+    def add_box(self, box):
+        """Extend the non-transparent part with box (None is empty)."""
+        self.bbox = box_union(self.bbox, box)
+
+    def reset(self):
+        self.pixels = None
+        self.bbox = None
+        self.size = None
 
 #-------------------------------------------------------------------------------
 # DrawingArea
@@ -44,6 +115,20 @@ class DrawingArea(BufferedWindow):
         # State we need to keep around
         self.model = None  # The view needs the model to be able to draw it
         self.t = None  # Transformation is (x_win, y_win)
+        self.t_array = None  # Vectorized transformation, see xy_win
+        self.view_rect = None  # Part of the window being drawn, None is all
+        self.frame = FrameBuffer()  # Reused from one redraw to the next
+        self.antialias = False  # Anti-aliasing of rasterized lines
+        self.tiles = TileRenderer()  # Lines are rasterized tile by tile
+
+        # Line batches grouped by compiled style, for each open file. They
+        # only depend on the file contents, so they're computed once.
+        self.prepared = weakref.WeakKeyDictionary()
+        self.prepared_areas = weakref.WeakKeyDictionary()
+
+        # Drawing layers of the layers of a shapefile model, keyed by
+        # model_shp.ShpLayer, with the style they're drawn in
+        self.shp_layers = weakref.WeakKeyDictionary()
 
         self.layers = [
             DrawingLayer('HY'),
@@ -57,17 +142,57 @@ class DrawingArea(BufferedWindow):
 
     def clear(self):
         self.model = None
+        self.offset = 0, 0
+        self.zoom = 1.0
         for layer in self.layers:
             layer.visible = False
-            layer.image = None
+            layer.reset()
+        self.shp_layers.clear()
 
     def check_layer(self, code, state):
-        """User has checked/unchecked the 'code' layer box."""
+        """User has checked/unchecked the 'code' layer box.
+
+        With a shapefile model, code is the name of one of its layers.
+        """
+        if self.model is not None and self.model.kind == 'Shapefile':
+            self.model.set_visible(code, state)
+            return
         for layer in self.layers:
             if layer.code == code:
                 layer.visible = state
                 return
 
+    def style_layer(self, code, color=None, width=None):
+        """User has changed the color and/or the line width of the 'code'
+        layer, the name of a layer of a shapefile model.
+        """
+        if self.model is not None and self.model.kind == 'Shapefile':
+            self.model.set_style(code, color, width)
+
+    def drawing_layers(self):
+        """The layers composited into the frame, each with its own pixels: the
+        DLG-3 categories, or the layers of a shapefile model.
+        """
+        if self.model is None or self.model.kind != 'Shapefile':
+            return self.layers
+
+        layers = []
+        for shp_layer in self.model.layers:
+            style, layer = self.shp_layers.get(shp_layer, (None, None))
+            if layer is None or style != shp_layer.style:
+                # New layer, or its style has changed: it's drawn again
+                layer = DrawingLayer(shp_layer.name)
+                self.shp_layers[shp_layer] = shp_layer.style, layer
+            layer.visible = shp_layer.visible
+            layers.append(layer)
+        return layers
+
+    def render_layer(self, layer, rect=None):
+        if self.model.kind == 'Shapefile':
+            self.render_shp_layer(layer, rect)
+        else:
+            self.render_dlg_layer(layer, rect)
+
     def render_bitmap(self, layering=False):
         """Recreate the bitmap to be displayed.
 
@@ -77,116 +202,259 @@ class DrawingArea(BufferedWindow):
         visibility of some layer has been toggled, which requires only the
         compositing to be redone. We check for for this exception so we can
         avoid the redrawing overhead.
+
+        The frame buffer is reused across redraws, and only the visible layers
+        are composited into it, each one restricted to its non-transparent
+        part.
         """
-        w, h = self.size
+        self.frame.resize(self.size)
         if self.model is None:
-            im = self.render_layer_zero()
-            return wx.Bitmap.FromBufferRGBA(w, h, im.tobytes())
-        elif self.model.kind != 'Dlg3':
-            im = self.render()
-            return wx.Bitmap.FromBufferRGBA(w, h, im.tobytes())
+            self.frame.clear()
+            return self.frame_to_bitmap(self.frame.pixels)
+        elif self.model.kind not in ('Dlg3', 'Shapefile'):
+            self.render()
+            return self.frame_to_bitmap(self.frame.pixels)
         
-        im = self.render_layer_zero()
-        for layer in self.layers:
+        self.frame.clear()
+        for layer in self.drawing_layers():
             if layer.visible:
-                if layer.image is None:
+                if layer.pixels is None:
                     # The user checked some layername's box for the first time,
                     # we need to get that layer's data and draw it.
-                    self.model.open_files_category(layer.code)
-                    layer.image = self.render_dlg_layer(layer.code)
+                    if self.model.kind == 'Dlg3':
+                        self.model.open_files_category(layer.code)
+                    self.render_layer(layer)
 
-                elif not layering:
+                elif not layering or layer.size != self.size:
                     # We're not just toggling layer visibility, the model or
                     # window size have actually changed, so the bitmap needs ot
                     # be redrawn.
+                    self.render_layer(layer)
 
-                    # We could distinguish redrawing on the same size (keep im
-                    # and d objects) and changing sizes (im and d need to be
-                    # recreated), not sure if it's worth it.
-                    layer.image = self.render_dlg_layer(layer.code)
-                im = Image.alpha_composite(im, layer.image)
-        
-        return wx.Bitmap.FromBufferRGBA(w, h, im.tobytes())
+                if layer.bbox is not None:
+                    self.frame.over(layer.pixels, layer.bbox)
 
-    def render_layer_zero(self):
-        im = Image.new('RGBA', self.size)
-        d = ImageDraw.Draw(im, 'RGBA')
-        # Opaque white background
-        d.rectangle([0, 0, self.size[0], self.size[1]], fill='white')
-        return im
+            elif not layering:
+                # Hidden layers are redrawn in full when shown again
+                layer.size = None
+
+        self.annotate_layers()
+        return self.frame_to_bitmap(self.frame.pixels)
+
+    def preview_bitmap(self, scale, translate):
+        """Zoom preview, the current frame scaled and cropped."""
+        if self.frame.size != self.size:
+            return None
+        return self.frame_to_bitmap(self.frame.zoom(scale, translate))
+
+    def render_dlg_layer(self, layer, rect=None):
+        """Draw a single layer/category into the layer's pixels.
 
-    def render_dlg_layer(self, category):
-        print(f'render_dlg_layer, code={category}')
-        im = Image.new('RGBA', self.size)
+        Areas are drawn with Pillow, then lines are rasterized on top of them,
+        one pass for all the lines of the layer that share the same style.
+        The selected area, if any, is drawn last, over the lines. With a rect,
+        only that part of the pixels is redrawn, see scroll_bitmap().
+        """
+        category = layer.code
+        self.view_rect = rect
+        if rect is None:
+            im = Image.new('RGBA', self.size)
+        else:
+            left, upper, right, lower = rect
+            im = Image.new('RGBA', (right - left, lower - upper))
         d = ImageDraw.Draw(im, 'RGBA')
 
         # Define transformation form model to drawing window
         # FIXME this doesn't need to be done all the time
         bbox = self.model.bounding_box()
         self.t = self.get_transform(bbox)
+        self.t_array = self.get_array_transform(bbox)
 
         # Draw a single layer/category
+        groups = {}
         for dlg in self.model.get_files_by_category(category):
-            print(dlg)
             self.dlg_draw(d, dlg)
+            for style, batch in self.dlg_line_batches(dlg).items():
+                groups.setdefault(style, []).append(batch)
 
         # Special requests act on the first file
         if self.model.line is not None:
-            self.draw_line(d, self.model.get_first_file(), self.model.line,
-                           pen='red')
+            dlg = self.model.get_first_file()
+            style = self.dlg_line_style(dlg, self.model.line, pen='red')
+            if style is not None:
+                batch = LineBatch.build([self.model.line.coords])
+                groups.setdefault(style, []).append(batch)
+
+        layer.set_image(im, rect)
+        layer.add_box(self.draw_batches(layer.pixels, groups, bbox, rect))
+
+        # The selected area goes over the lines
         if self.model.area is not None:
-            self.draw_area(d, self.model.get_first_file(), self.model.area,
+            im = Image.new('RGBA', im.size)
+            self.draw_area(ImageDraw.Draw(im, 'RGBA'),
+                           self.model.get_first_file(), self.model.area,
                            pen='black',
                            brush='red')
                            # brush=nbr_brush(area.id))
-        return im
+            layer.over(im, rect)
+        self.view_rect = None
+
+    def render_shp_layer(self, layer, rect=None):
+        """Draw the lines of a layer of a shapefile model into the layer's
+        pixels, or only into their rect part.
+        """
+        # Layers are found by object, their names needn't be unique
+        shp_layer = next(s for s, (_, l) in self.shp_layers.items()
+                         if l is layer)
+        if rect is None:
+            im = Image.new('RGBA', self.size)
+        else:
+            left, upper, right, lower = rect
+            im = Image.new('RGBA', (right - left, lower - upper))
+        bbox = self.model.bounding_box()
+        color, width = shp_layer.style
+        layer.set_image(im, rect)
+        layer.add_box(self.draw_shp_lines(layer.pixels, shp_layer.shp, bbox,
+                                          rect, (ImageColor.getrgb(color),
+                                                 width)))
+
+    def render(self, rect=None):
+        """Draw the models other than DLG-3 directly into the frame.
 
-    def render(self):
-        im = Image.new('RGBA', self.size)
+        Shapefiles and OSM files can also be drawn into a rect part of the
+        frame only, see scroll_bitmap().
+        """
+        if rect is None:
+            rect = (0, 0) + self.size
+        left, upper, right, lower = rect
+        im = Image.new('RGBA', (right - left, lower - upper))
         d = ImageDraw.Draw(im, 'RGBA')
         # Opaque white background
-        d.rectangle([0, 0, self.size[0], self.size[1]], fill='white')
+        d.rectangle([0, 0, right - left, lower - upper], fill='white')
 
         # Define transformation from model to drawing window 
-        self.t = self.get_transform(self.model.bounding_box())
+        bbox = self.model.bounding_box()
+        self.t = self.get_transform(bbox)
+        self.t_array = self.get_array_transform(bbox)
 
         # Models should expose iterators/generators on polygons, lines, nodes,
         # so that any model can be drawn with the same code.
 
         if self.model.kind == 'Usgs':
             self.draw_usgs(d, self.model)
-            return im
 
         elif self.model.kind == 'UsgsNames':
             self.draw_usgs_names(d, self.model)
-            return im
-
-        elif self.model.kind == 'Shapefile':
-            self.draw_shp_lines(d, self.model.first_file)
-            return im
 
         elif self.model.kind == 'Osm':
-            self.draw_osm_lines(d, self.model.first_file)
-            return im
+            osm = self.model.first_file
+            self.write_annotation(d, f'{len(osm.ways)} lines', rect)
+            self.frame.blit(im, rect)
+            self.draw_osm_areas(self.frame.pixels, osm, bbox, rect)
+            self.draw_osm_lines(self.frame.pixels, osm, bbox, rect)
+            return
+
+        # Copy the prepared image
+        self.frame.blit(im)
 
-        # Return the prepared image
-        return im
+    def scroll_bitmap(self, dx, dy):
+        """Update the bitmap after the view has been panned by (dx, dy).
+
+        The frame, and the pixels of the visible layers, are shifted in place,
+        then only the strips exposed by the shift are drawn, going through the
+        spatial indexes so that only the lines crossing them are rasterized.
+        A full redraw is only needed when the window size, the zoom level or
+        the model change, or for the models that can't be drawn by parts.
+        """
+        w, h = self.size
+        if self.model is None or self.frame.size != self.size or \
+           abs(dx) >= w or abs(dy) >= h or \
+           self.model.kind not in ('Dlg3', 'Shapefile', 'Osm') or \
+           any(layer.visible and layer.size != self.size
+               for layer in self.drawing_layers()):
+            return self.render_bitmap()
+
+        rects = self.frame.scroll(dx, dy)
+
+        # The annotation stays in place: redraw it, and where the shift has
+        # moved it to
+        left, upper, right, lower = self.annotation_box
+        moved = box_intersection((left + dx, upper + dy,
+                                  right + dx, lower + dy), (0, 0, w, h))
+        annotation = [r for r in (self.annotation_box, moved) if r is not None]
+        if self.model.kind not in ('Dlg3', 'Shapefile'):
+            for rect in rects + annotation:
+                self.render(rect)
+            return self.frame_to_bitmap(self.frame.pixels)
+
+        layers = self.drawing_layers()
+        for layer in layers:
+            if not layer.visible:
+                # Hidden layers are redrawn in full when shown again
+                layer.size = None
+                continue
+            layer.scroll(dx, dy)
+            for rect in rects:
+                self.render_layer(layer, rect)
+
+        # The layers' pixels are all there after their scroll, the parts of
+        # the frame under the annotation are only composited again
+        if self.model.kind == 'Shapefile':
+            rects = rects + annotation
+        for rect in rects:
+            self.frame.clear(rect=rect)
+            for layer in layers:
+                if layer.visible:
+                    box = box_intersection(layer.bbox, rect)
+                    if box is not None:
+                        self.frame.over(layer.pixels, box)
+
+        self.annotate_layers()
+        return self.frame_to_bitmap(self.frame.pixels)
 
 #-------------------------------------------------------------------------------
 # Drawing
 #-------------------------------------------------------------------------------
 
-    def write_annotation(self, d, s):
+    # Part of the window the annotation is written into
+    annotation_box = (0, 0, 200, 30)
+
+    def write_annotation(self, d, s, rect=None):
+        """Write s at the top left of the window, d draws into rect."""
+        left, upper = (0, 0) if rect is None else rect[:2]
         fn = ImageFont.truetype(r'C:\Windows\Fonts\calibri.ttf', 14)
-        d.text((10, 10), s, font=fn, fill=(0, 0, 255))
+        d.text((10 - left, 10 - upper), s, font=fn, fill=(0, 0, 255))
 
-    def get_transform(self, bbox):
-        """Get the transformation functions from map to drawing.
+    def annotate_layers(self):
+        """Write the number of lines of a shapefile model over the frame,
+        once its layers are composited.
+        """
+        if self.model.kind != 'Shapefile' or len(self.model.layers) == 0:
+            return
+        box = box_intersection(self.annotation_box, (0, 0) + self.size)
+        if box is None:
+            return
+        left, upper, right, lower = box
+        im = Image.new('RGBA', (right - left, lower - upper))
+        self.write_annotation(ImageDraw.Draw(im, 'RGBA'),
+                              f'{len(self.model.first_file)} lines', box)
+        src, _ = premultiply(im)
+        over(self.frame.pixels[upper:lower, left:right], src,
+             self.frame.scratch[upper:lower, left:right],
+             (0, 0, right - left, lower - upper))
+
+    def fit(self, bbox):
+        """Scale and origin that fit the map bbox into the drawing area.
 
         This changes on two occasions:
           - when another DLG file is added (new bbox)
           - when the window is resized (w_wx, h_wx are the window size)
-          """
+
+        Return the scale k (pixels per map unit), the window position of the
+        map's north-west corner, and that corner in map coordinates. The view
+        zoom scales the fitted map, and panning then moves it by the view
+        offset.
+        """
         # Size of drawing area
         w_wx = self.size[0]
         h_wx = self.size[1]
@@ -219,6 +487,15 @@ class DrawingArea(BufferedWindow):
             h_win = k*h_map  # Height of drawing window must be computed
             vert_offset = (h_draw - h_win)/2
             orig_win = (pad, pad + vert_offset)
+
+        z = self.zoom
+        orig_win = (z*orig_win[0] + self.offset[0],
+                    z*orig_win[1] + self.offset[1])
+        return z*k, orig_win, (min_long, max_lat)
+
+    def get_transform(self, bbox):
+        """Get the transformation functions from map to drawing."""
+        k, orig_win, (min_long, max_lat) = self.fit(bbox)
     
         def x_win(long_):
             # Axis direction: longitude grows to the right
@@ -230,6 +507,98 @@ class DrawingArea(BufferedWindow):
         # Return the required functions
         return x_win, y_win
 
+    def get_array_transform(self, bbox):
+        """Get the vectorized transformation function from map to drawing.
+
+        The function maps an (n, 2) array of (long, lat) couples to an (n, 2)
+        array of (x, y) window coordinates, as floats.
+        """
+        k, orig_win, (min_long, max_lat) = self.fit(bbox)
+
+        def xy_win(xy):
+            out = np.empty(xy.shape, dtype=np.float64)
+            np.multiply(xy[:, 0] - min_long, k, out=out[:, 0])
+            np.multiply(max_lat - xy[:, 1], k, out=out[:, 1])
+            out += orig_win
+            return out
+
+        return xy_win
+
+    def get_map_box(self, bbox):
+        """Get the function converting a window rectangle to a map box.
+
+        The rectangle is given as (left, upper, right, lower) window
+        coordinates, the box is returned as (xmin, ymin, xmax, ymax), with x
+        the longitude and y the latitude.
+        """
+        k, orig_win, (min_long, max_lat) = self.fit(bbox)
+
+        def to_map(left, upper, right, lower):
+            return (min_long + (left - orig_win[0])/k,
+                    max_lat - (lower - orig_win[1])/k,
+                    min_long + (right - orig_win[0])/k,
+                    max_lat - (upper - orig_win[1])/k)
+
+        return to_map
+
+    def draw_batches(self, dst, groups, bbox, rect=None):
+        """Rasterize line batches and paint them on dst.
+
+        Argument groups is a dictionary of lists of LineBatch instances, keyed
+        by compiled style, a (color, width) couple. Each group is transformed
+        in a single pass, whatever the number of files it comes from, then
+        rasterized in parallel tiles, see tiles.py. Argument bbox is the map
+        bounding box, and rect limits drawing to a part of the window, None is
+        all of it. Return the bounding box of the painted pixels, or None.
+
+        Only the polylines whose bounding box intersects the window, as given
+        by the batch's spatial index, are transformed, and their segments are
+        clipped to each tile before being rasterized.
+        """
+        xy_win = self.get_array_transform(bbox)
+        to_map = self.get_map_box(bbox)
+        left, upper, right, lower = rect or (0, 0) + self.size
+
+        tile_groups = []
+        for (color, width), batches in groups.items():
+            m = width/2 + 1
+            view = to_map(left - m, upper - m, right + m, lower + m)
+            items = []
+            for b in batches:
+                v = b.vertex_ids(b.index.query(view))
+                xy = np.empty_like(b.xy)
+                xy[v] = xy_win(b.xy[v])
+                items.append((b, xy))
+            tile_groups.append((color, width, items))
+
+        return self.tiles.draw(dst, self.frame.coverage, tile_groups, to_map,
+                               self.antialias, rect)
+
+    def window_ring(self, points):
+        """Transform a ring of map points, and clip it to the window.
+
+        When drawing only a part of the window, view_rect, the ring is clipped
+        to it and the coordinates are relative to its top left corner.
+        Return a list of (x, y) couples ready for ImageDraw.polygon(), or None
+        if no part of the ring is visible.
+        """
+        if points is None or len(points) == 0:
+            return None
+        xy = self.t_array(np.array(points, dtype=np.float64).reshape(-1, 2))
+
+        # A couple of pixels of margin, so outlines don't show at the border
+        left, upper, right, lower = self.view_rect or (0, 0) + self.size
+        xy -= (left, upper)
+        view = -2, -2, right - left + 2, lower - upper + 2
+        box = xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max()
+        if box_outside(box, view):
+            return None
+        if not box_inside(box, view):
+            xy = clip_ring(xy, view)
+            if len(xy) < 3:
+                return None
+        return [tuple(p) for p in np.rint(xy).astype(int).tolist()]
+
     #---------------------------------------------------------------------------
     # DLG-3 with Pillow
     #---------------------------------------------------------------------------
@@ -237,13 +606,10 @@ class DrawingArea(BufferedWindow):
     def dlg_draw(self, d, dlg):
         x_win, y_win = self.t
         
-        # Draw areas
+        # Draw areas, the lines are rasterized by batches, see
+        # dlg_line_batches()
         for a in dlg.areas:
             self.draw_area(d, dlg, a)
-        
-        # Draw lines
-        for line in dlg.lines:
-            self.draw_line(d, dlg, line)
             
     def draw_area(self, d, dlg, area, pen=None, brush=None):
         """Paint the area's polygon, and all the areas inside its islands."""
@@ -269,9 +635,9 @@ class DrawingArea(BufferedWindow):
                       attr_brush if attr_brush is not None else
                       'white')
         
-        points = [(x_win(long_), y_win(lat))
-                      for long_, lat in area.get_points(dlg)]
-        d.polygon(points, fill=fill_color, outline=outline_color)
+        points = self.window_ring(area.get_points(dlg))
+        if points is not None:
+            d.polygon(points, fill=fill_color, outline=outline_color)
 
         # Now draw all the areas inside the islands
         for a in area.inner_areas():
@@ -293,91 +659,156 @@ class DrawingArea(BufferedWindow):
                         # Priority: function argument, then attributes, then default
                         outline_color = (attr_pen if attr_pen is not None else 'black')
 
-                        points = [(x_win(long_), y_win(lat))
-                                      for long_, lat in area.get_points(dlg)]
-                        d.polygon(points, fill=attr_brush, outline=outline_color)
+                        points = self.window_ring(area.get_points(dlg))
+                        if points is not None:
+                            d.polygon(points, fill=attr_brush,
+                                      outline=outline_color)
 
                         # Now draw all the areas inside the islands
                         for a in area.inner_areas():
                             self.draw_area(d, dlg, a)
 
-    def draw_line(self, d, dlg, line, pen=None, brush=None):
-        # print(f'dlg.categ.name={dlg.categ.name}')
-        if dlg.categ.name.lower() == 'railroads':
-            self.draw_line_roads(d, dlg, line, pen, brush)
-            return
-        elif dlg.categ.name.lower() == 'roads and trails':
-            return
-        x_win, y_win = self.t
+    def dlg_line_style(self, dlg, line, pen=None):
+        """Compiled style of a DLG line, or None if it isn't drawn.
 
-        attr_pen = attr_brush = None
-        if line.attrs is not None and len(line.attrs) > 0:
-            maj, min = line.attrs[0]
-            attr_pen, attr_brush = get_style(dlg.categ.name.lower(), 'lines', maj, min)
-            
-        # Priority: function argument, then attributes, then default
-        outline_color = (pen if pen is not None else
-                         attr_pen if attr_pen is not None else
-                         'black')
-        
-        if len(line.coords) > 1:
-            # Draw line segment from prev to current
-            d.line([(x_win(long_), y_win(lat)) for long_, lat in line.coords],
-                   fill=outline_color)
-
-    def draw_line_roads(self, d, dlg, line, pen=None, brush=None):
-        x_win, y_win = self.t
+        The compiled style is a (color, width) couple, where color is an RGB or
+        RGBA tuple. Lines sharing a compiled style are rasterized together.
+        """
+        categ = dlg.categ.name.lower()
+        if categ == 'roads and trails':
+            return None
 
-        attr_pen = attr_brush = None
+        attr_pen = None
         if line.attrs is not None and len(line.attrs) > 0:
             maj, min = line.attrs[0]
-            categ = dlg.categ.name.lower()
-            # print(f'categ="{categ}"')
-            categ = categ.replace(' ', '_')
-            attr_pen, attr_brush = get_style(categ, 'lines', maj, min)
+            attr_pen, _ = get_style(categ, 'lines', maj, min)
 
+        if categ == 'railroads':
+            # Only the railroads that have a style are drawn
             if attr_pen is None:
-                return
-            # Priority: function argument, then attributes, then default
-            # print(f'attr_pen={attr_pen}')
-            outline_color = attr_pen
-            outline_color = 'green'
+                return None
+            return ImageColor.getrgb('green'), 2
 
-            if len(line.coords) > 1:
-                # Draw line segment from prev to current
-                d.line([(x_win(long_), y_win(lat)) for long_, lat in line.coords],
-                       fill=outline_color, width=2)
+        # Priority: function argument, then attributes, then default
+        outline_color = (pen if pen is not None else
+                         attr_pen if attr_pen is not None else
+                         'black')
+        if isinstance(outline_color, str):
+            outline_color = ImageColor.getrgb(outline_color)
+        return outline_color, 1
+
+    def dlg_line_batches(self, dlg):
+        """The lines of a DLG file, as LineBatch instances by compiled style."""
+        if dlg not in self.prepared:
+            groups = {}
+            for line in dlg.lines:
+                style = self.dlg_line_style(dlg, line)
+                if style is not None:
+                    groups.setdefault(style, []).append(line.coords)
+            self.prepared[dlg] = {style: LineBatch.build(coords)
+                                  for style, coords in groups.items()}
+        return self.prepared[dlg]
 
     #---------------------------------------------------------------------------
     # Shapefiles
     #---------------------------------------------------------------------------
 
-    def draw_shp_lines(self, d, shp):
-        x_win, y_win = self.t
-
-        for rec in shp.recs:
-            d.line([(x_win(x), y_win(y)) for x, y in rec.points], fill='black')
-        self.write_annotation(d, f'{len(shp.recs)} lines')
+    def draw_shp_lines(self, dst, shp, bbox, rect=None, style=None):
+        """Draw the lines of shp in style, a compiled style, black by
+        default. Return the bounding box of the painted pixels, or None.
+        """
+        if style is None:
+            style = ImageColor.getrgb('black'), 1
+
+        # Only the records in view are decoded, see ShapeFile.query(), along
+        # with the ones decoded for the previous views
+        left, upper, right, lower = rect or (0, 0) + self.size
+        m = style[1]/2 + 1
+        view = self.get_map_box(bbox)(left - m, upper - m, right + m,
+                                      lower + m)
+        ids = shp.query(view)
+        decoded, batches = self.prepared.get(shp, (np.empty(0, np.int64), []))
+        new = np.setdiff1d(ids, decoded, assume_unique=True)
+        if len(new) > 0:
+            # Each part of a record is a polyline on its own, the columns
+            # already have the layout of a LineBatch. The records new to
+            # this view make a batch of their own, with its own index;
+            # batches are merged when the last one is at least as big as the
+            # one before, so that each polyline is indexed again only a
+            # logarithmic number of times.
+            batches = batches + [LineBatch(*shp.take(new).polylines())]
+            while len(batches) > 1 and \
+                  len(batches[-2].xy) <= len(batches[-1].xy):
+                batches[-2:] = [LineBatch.concatenate(batches[-2:])]
+            self.prepared[shp] = np.union1d(decoded, new), batches
+
+        return self.draw_batches(dst, {style: batches}, bbox, rect)
 
     #---------------------------------------------------------------------------
     # OpenStreetMap
     #---------------------------------------------------------------------------
 
-    def draw_osm_lines(self, d, osm):
-        x_win, y_win = self.t
-
-        for w in osm.ways:
-            # w is an OsmWay, w.refs is an array of OsmNode references
-            points = []
-            for n in w.refs:
-                try:
-                    nd = osm.node_dict[n]
-                except KeyError as e:
-                    print(f'Node {n} not found')
-                points.append((x_win(nd.lon), y_win(nd.lat)))
-            d.line(points, fill='black')
-            # d.line([(x_win(x), y_win(y)) for n in w.refs], fill='black')
-        self.write_annotation(d, f'{len(osm.ways)} lines')
+    def draw_osm_lines(self, dst, osm, bbox, rect=None):
+        if osm not in self.prepared:
+            # The ways were resolved into polylines, and indexed, when the
+            # file was read
+            g = osm.geometry
+            black = ImageColor.getrgb('black')
+            self.prepared[osm] = {(black, 1): LineBatch(g.xy, g.offsets,
+                                                        g.index)}
+
+        groups = {style: [batch]
+                  for style, batch in self.prepared[osm].items()}
+        self.draw_batches(dst, groups, bbox, rect)
+
+    def draw_osm_areas(self, dst, osm, bbox, rect=None):
+        """Fill the areas of an OSM file, with one color per class of area.
+
+        The areas were assembled when the file was read, here the rings of
+        the visible ones are transformed, and all the polygons of a color
+        filled in one pass, see raster.rasterize_polygons(). The classes are
+        filled in area_fill_order.
+        """
+        areas = osm.areas
+        if areas is None or len(areas) == 0:
+            return
+        if osm not in self.prepared_areas:
+            batches = {}
+            class_ids = {name: k for k, (name, _) in enumerate(area_classes)}
+            for name in area_fill_order:
+                k = class_ids[name]
+                rings = np.flatnonzero(areas.classes[areas.ring_area] == k)
+                if len(rings) == 0:
+                    continue
+                starts = areas.offsets[rings]
+                counts = areas.offsets[rings + 1] - starts
+                offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+                np.cumsum(counts, out=offsets[1:])
+                xy = areas.xy[ranges(starts, counts)]
+                # Areas of the class numbered from 0
+                poly = np.cumsum(np.diff(areas.ring_area[rings],
+                                         prepend=-1) != 0) - 1
+                color = ImageColor.getrgb(area_colors[name])
+                batches[color] = PolygonBatch(xy, offsets, poly)
+            self.prepared_areas[osm] = batches
+
+        xy_win = self.get_array_transform(bbox)
+        to_map = self.get_map_box(bbox)
+        left, upper, right, lower = rect or (0, 0) + self.size
+        view = to_map(left, upper, right, lower)
+        cov = self.frame.coverage[upper:lower, left:right]
+        dst = dst[upper:lower, left:right]
+        for color, batch in self.prepared_areas[osm].items():
+            rings = batch.ring_ids(batch.index.query(view))
+            if len(rings) == 0:
+                continue
+            xy = np.empty_like(batch.xy)
+            v = batch.vertex_ids(rings)
+            xy[v] = xy_win(batch.xy[v])
+            rasterize_polygons(cov, *batch.edges(xy, rings),
+                               origin=(left, upper))
+            ys, xs = paint(dst, cov, color)
+            cov[ys, xs] = 0
 
     #---------------------------------------------------------------------------
     # USGS Quads
@@ -3,6 +3,10 @@
 import os
 from model import Model
 from pbf.osm_pbf import OsmPbfFile
+from pbf.osm_xml import OsmXmlFile, is_osm_xml
+from pbf.osm_o5m import OsmO5mFile, is_o5m
+from pbf.osm_areas import OsmAreas
+from pbf.osm_cache import OsmCacheFile, source_stamp
 
 class Osm(Model):
 
@@ -12,11 +16,40 @@ class Osm(Model):
         self.line = None
         self.area = None
 
-    def open(self, filepath):
+    def open(self, filepath, tag_filter=None, cache=True):
+        """Read a .pbf, .o5m or OSM XML file (.osm, .osm.bz2, .osm.gz),
+        tag_filter is an expression like 'highway=*'.
+
+        With cache, the decoded data is written to a cache file the first
+        time, and later opens only map that file, see OsmCacheFile.
+        """
         if self.files is None:
             self.files = []
         print(f'Opening {filepath}')
-        self.files.append(OsmPbfFile.build(filepath))
+        path = OsmCacheFile.filepath(filepath)
+        source = source_stamp(filepath, tag_filter, ways_only=True)
+        osm = OsmCacheFile.load(path, source) if cache else None
+        if osm is None:
+            # Only the ways are drawn, and the nodes they need
+            if is_osm_xml(filepath):
+                reader = OsmXmlFile
+            elif is_o5m(filepath):
+                reader = OsmO5mFile
+            else:
+                reader = OsmPbfFile
+            osm = reader.build(filepath, ways_only=True,
+                               tag_filter=tag_filter)
+            # Resolve the geometry of the ways and assemble the areas now,
+            # rather than when drawing
+            missing = len(osm.geometry.missing)
+            if missing > 0:
+                print(f'{missing} nodes not found')
+            osm.areas = OsmAreas.build(osm.ways, osm.relations,
+                                       osm.node_dict)
+            print(osm.areas.show())
+            if cache:
+                OsmCacheFile.save(path, osm, source)
+        self.files.append(osm)
         print('Done.')
 
     @property
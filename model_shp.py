@@ -5,23 +5,53 @@ from storage import mapname_filepaths
 from model import Model
 from shp.shp import build
 
+class ShpLayer:
+    """An open shapefile, and how it's drawn."""
+    def __init__(self, shp, name, color='black', width=1):
+        self.shp = shp
+        self.name = name
+        self.visible = True
+        self.color = color
+        self.width = width
+
+    @property
+    def style(self):
+        return self.color, self.width
+
 class Shapefile(Model):
 
     def __init__(self):
         super().__init__('Shapefile')
         # self.kind = 'Shapefile'
-        self.files = None
+        self.layers = []  # ShpLayer instances, in drawing order
+        self.bbox = None  # union of the bounding boxes of the layers
         self.line = None
         self.area = None
 
     def open(self, filepath):
-        if self.files is None:
-            self.files = []
-        self.files.append(build(filepath))
+        """Open a shapefile as a new layer, drawn above the others."""
+        shp = build(filepath, lazy=True)
+        base = os.path.splitext(os.path.basename(filepath))[0]
+        name, n = base, 1
+        while self.get_layer(name) is not None:
+            n += 1
+            name = f'{base} ({n})'
+        layer = ShpLayer(shp, name)
+        self.layers.append(layer)
+
+        hdr = shp.hdr
+        bbox = hdr.Ymin, hdr.Ymax, hdr.Xmin, hdr.Xmax
+        self.bbox = bbox if self.bbox is None else self.bbox_union(self.bbox,
+                                                                   bbox)
+        return layer
+
+    @property
+    def files(self):
+        return [layer.shp for layer in self.layers]
 
     @property
     def first_file(self):
-        return self.files[0]
+        return self.layers[0].shp
 
     def open_files(self):
         return self.files
@@ -30,7 +60,36 @@ class Shapefile(Model):
         for f in mapname_filepaths(mapname, 'hydrography'):
             self.open(f)
 
+    def get_layer(self, name):
+        """The layer called name, or None."""
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+        return None
+
+    def set_visible(self, name, state):
+        """Show or hide a layer, return False if there's no layer name."""
+        layer = self.get_layer(name)
+        if layer is None:
+            print(f'No layer {name}')
+            return False
+        layer.visible = state
+        return True
+
+    def set_style(self, name, color=None, width=None):
+        """Change the color and/or the line width of a layer, return False
+        if there's no layer name.
+        """
+        layer = self.get_layer(name)
+        if layer is None:
+            print(f'No layer {name}')
+            return False
+        if color is not None:
+            layer.color = color
+        if width is not None:
+            layer.width = width
+        return True
+
     def bounding_box(self):
         """Return this model's bounding box in model coordinates."""
-        hdr = self.files[0].hdr
-        return hdr.Ymin, hdr.Ymax, hdr.Xmin, hdr.Xmax
+        return self.bbox
@@ -0,0 +1,176 @@
+# mapv/o5m_t.py
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from pbf.osm_o5m import (O5mStringTable, OsmO5mFile, decode_varints,
+                         read_signed, read_varint, zigzag)
+
+#-------------------------------------------------------------------------------
+# I want stdout to be unbuffered, always
+#-------------------------------------------------------------------------------
+
+class Unbuffered(object):
+    def __init__(self, stream):
+        self.stream = stream
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+import sys
+sys.stdout = Unbuffered(sys.stdout)
+
+#-------------------------------------------------------------------------------
+# Helper functions
+#-------------------------------------------------------------------------------
+
+def uvarint(n):
+    s = b''
+    while n >= 0x80:
+        s += bytes([n & 0x7f | 0x80])
+        n >>= 7
+    return s + bytes([n])
+
+def svarint(n):
+    return uvarint(2*n if n >= 0 else -2*n - 1)
+
+def pair(k, v):
+    return b'\0' + k.encode() + b'\0' + v.encode() + b'\0'
+
+def dataset(kind, payload):
+    return bytes([kind]) + uvarint(len(payload)) + payload
+
+def o5m_file():
+    """A small .o5m file: 3 nodes, a reset, 2 ways and a relation."""
+    s = b'\xff' + dataset(0xe0, b'o5m2') + dataset(0xdc, svarint(1600000000))
+
+    # Nodes 10, 12, 15, without author; the second one has the tags of the
+    # first, as a reference to the string table
+    s += dataset(0x10, svarint(10) + b'\0' + svarint(60000000) +
+                 svarint(450000000) + pair('natural', 'tree'))
+    s += dataset(0x10, svarint(2) + b'\0' + svarint(100) + svarint(-100) +
+                 uvarint(1))
+    s += dataset(0x10, svarint(3) + b'\0' + svarint(100) + svarint(-100))
+
+    # After the reset, deltas start from 0 again; refs run from one way to
+    # the next
+    s += b'\xff'
+    refs = svarint(10) + svarint(2) + svarint(3)
+    s += dataset(0x11, svarint(100) + b'\0' + uvarint(len(refs)) + refs +
+                 pair('highway', 'residential'))
+    refs = svarint(0) + svarint(-5)
+    s += dataset(0x11, svarint(1) + b'\0' + uvarint(len(refs)) + refs +
+                 pair('building', 'yes'))
+    members = svarint(100) + b'\x001outer\0'
+    s += dataset(0x12, svarint(7) + b'\0' + uvarint(len(members)) + members +
+                 pair('type', 'multipolygon'))
+    return s + b'\xfe'
+
+#-------------------------------------------------------------------------------
+# Varints
+#-------------------------------------------------------------------------------
+
+class Varints(unittest.TestCase):
+
+    def test_01_unsigned(self):
+        for n in (0, 1, 127, 128, 300, 2**35 + 5):
+            self.assertEqual((n, len(uvarint(n))), read_varint(uvarint(n), 0))
+
+    def test_02_signed(self):
+        for n in (0, 1, -1, 63, -64, 64, -2**40):
+            self.assertEqual((n, len(svarint(n))), read_signed(svarint(n), 0))
+
+    def test_03_all_at_once(self):
+        numbers = [0, 5, 127, 128, 16384, 2**40]
+        data = np.frombuffer(b''.join(uvarint(n) for n in numbers),
+                             dtype=np.uint8)
+        values, starts = decode_varints(data)
+        self.assertEqual(numbers, values.tolist())
+        self.assertEqual([0, 1, 2, 3, 5, 8], starts.tolist())
+
+    def test_04_zigzag(self):
+        numbers = [0, -1, 1, -300, 300]
+        values, _ = decode_varints(np.frombuffer(
+            b''.join(svarint(n) for n in numbers), dtype=np.uint8))
+        self.assertEqual(numbers, zigzag(values).tolist())
+
+#-------------------------------------------------------------------------------
+# StringTable
+#-------------------------------------------------------------------------------
+
+class StringTable(unittest.TestCase):
+
+    def test_01_references(self):
+        buf = pair('a', 'b') + pair('c', 'd') + uvarint(2) + uvarint(1)
+        table = O5mStringTable()
+        p = 0
+        entries = []
+        for _ in range(4):
+            entry, p = table.read(buf, p)
+            entries.append(entry)
+        self.assertEqual([('a', 'b'), ('c', 'd'), ('a', 'b'), ('c', 'd')],
+                         entries)
+
+    def test_02_long_strings_not_stored(self):
+        buf = pair('a', 'b') + pair('note', 'x'*300) + uvarint(1)
+        table = O5mStringTable()
+        _, p = table.read(buf, 0)
+        _, p = table.read(buf, p)
+        self.assertEqual(('a', 'b'), table.read(buf, p)[0])
+
+#-------------------------------------------------------------------------------
+# O5mFile
+#-------------------------------------------------------------------------------
+
+class O5mFile(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filepath = tempfile.mkstemp(suffix='.o5m')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(o5m_file())
+
+    def tearDown(self):
+        os.remove(self.filepath)
+
+    def test_01_nodes(self):
+        f = OsmO5mFile.build(self.filepath)
+        nodes = f.node_dict
+        self.assertEqual([10, 12, 15], nodes.ids.tolist())
+        self.assertEqual([450000000, 449999900, 449999800],
+                         nodes.lat.tolist())
+        self.assertEqual([60000000, 60000100, 60000200], nodes.lon.tolist())
+        self.assertEqual({'natural': 'tree'}, nodes.node(1).tags)
+        self.assertEqual(1600000000, f.meta['timestamp'])
+
+    def test_02_ways_and_relations(self):
+        f = OsmO5mFile.build(self.filepath)
+        ways = list(f.ways)
+        self.assertEqual([100, 101], [w.id_ for w in ways])
+        self.assertEqual([10, 12, 15], list(ways[0].refs))
+        self.assertEqual([15, 10], list(ways[1].refs))
+        self.assertEqual({'building': 'yes'}, ways[1].tags)
+        r, = f.relations
+        self.assertEqual(7, r.id_)
+        self.assertEqual([('outer', 100, 1)], [tuple(m) for m in r.array])
+
+    def test_03_ways_only(self):
+        f = OsmO5mFile.build(self.filepath, ways_only=True)
+        self.assertEqual([10, 12, 15], f.node_dict.ids.tolist())
+        self.assertIsNone(f.node_dict.tags)
+
+    def test_04_tag_filter(self):
+        f = OsmO5mFile.build(self.filepath, tag_filter='building')
+        self.assertEqual([101], [w.id_ for w in f.ways])
+        self.assertEqual([10, 15], f.node_dict.ids.tolist())
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,152 @@
+# mapv/osm_cache_t.py
+
+import json
+import os
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from pbf.osm_areas import OsmAreas
+from pbf.osm_builder import OsmDataFile, OsmStoreBuilder
+from pbf.osm_cache import OsmCacheFile, source_stamp
+
+#-------------------------------------------------------------------------------
+# I want stdout to be unbuffered, always
+#-------------------------------------------------------------------------------
+
+class Unbuffered(object):
+    def __init__(self, stream):
+        self.stream = stream
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+import sys
+sys.stdout = Unbuffered(sys.stdout)
+
+#-------------------------------------------------------------------------------
+# Helper functions
+#-------------------------------------------------------------------------------
+
+def osm_data():
+    """A square forest and a road, as an OsmDataFile with its areas."""
+    b = OsmStoreBuilder()
+    for i, (lat, lon) in enumerate([(0, 0), (0, 10), (10, 10), (10, 0),
+                                    (20, 20)]):
+        b.add_node(i + 1, lat*10000000, lon*10000000,
+                   [('name', 'corner')] if i == 0 else [])
+    b.add_way(10, [1, 2, 3, 4, 1], [('landuse', 'forest')])
+    b.add_way(11, [3, 5], [('highway', 'track'), ('name', 'Chemin')])
+    osm = OsmDataFile(*b.finish(), {'seq_number': 42, 'timestamp': 1000})
+    osm.areas = OsmAreas.build(osm.ways, osm.relations, osm.node_dict)
+    return osm
+
+#-------------------------------------------------------------------------------
+# CacheFile
+#-------------------------------------------------------------------------------
+
+class CacheFile(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filepath = tempfile.mkstemp(suffix='.osm')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'source')
+        self.path = OsmCacheFile.filepath(self.filepath)
+        self.source = source_stamp(self.filepath, 'highway landuse', True)
+        OsmCacheFile.save(self.path, osm_data(), self.source)
+
+    def tearDown(self):
+        for path in (self.filepath, self.path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_01_round_trip(self):
+        osm = osm_data()
+        for copy in (False, True):
+            c = OsmCacheFile.load(self.path, self.source, copy=copy)
+            self.assertIsNotNone(c)
+            for a, b in ((osm.node_dict.ids, c.node_dict.ids),
+                         (osm.node_dict.lat, c.node_dict.lat),
+                         (osm.ways.ids, c.ways.ids),
+                         (osm.ways.offsets, c.ways.offsets),
+                         (osm.ways.refs, c.ways.refs),
+                         (osm.areas.ids, c.areas.ids),
+                         (osm.areas.classes, c.areas.classes)):
+                np.testing.assert_array_equal(a, b)
+            np.testing.assert_array_equal(osm.geometry.xy, c.geometry.xy)
+            self.assertEqual([w.tags for w in osm.ways],
+                             [w.tags for w in c.ways])
+            self.assertEqual({'name': 'corner'}, c.node_dict.node(0).tags)
+            self.assertEqual((42, 1000), (c.seq_number, c.timestamp))
+            self.assertEqual(osm.bbox, c.bbox)
+
+    def test_02_index(self):
+        index = osm_data().geometry.index
+        c = OsmCacheFile.load(self.path, self.source)
+        loaded = c.geometry.index
+        self.assertIsInstance(loaded.items, np.memmap)
+        self.assertEqual((index.extent, index.shape),
+                         (loaded.extent, loaded.shape))
+        for a, b in ((index.boxes, loaded.boxes),
+                     (index.cell_start, loaded.cell_start),
+                     (index.items, loaded.items)):
+            np.testing.assert_array_equal(a, b)
+        self.assertEqual([1], loaded.query((15, 5, 25, 25)).tolist())
+
+    def test_03_equivalent_filter(self):
+        source = source_stamp(self.filepath, 'landuse=*, highway', True)
+        self.assertIsNotNone(OsmCacheFile.load(self.path, source))
+
+    def test_04_stale_filter(self):
+        for tag_filter in (None, 'highway'):
+            source = source_stamp(self.filepath, tag_filter, True)
+            self.assertIsNone(OsmCacheFile.load(self.path, source))
+
+    def test_05_stale_ways_only(self):
+        source = source_stamp(self.filepath, 'highway landuse', False)
+        self.assertIsNone(OsmCacheFile.load(self.path, source))
+
+    def test_06_stale_source(self):
+        with open(self.filepath, 'ab') as f:
+            f.write(b' changed')
+        source = source_stamp(self.filepath, 'highway landuse', True)
+        self.assertIsNone(OsmCacheFile.load(self.path, source))
+
+    def test_07_not_a_cache(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'garbage')
+        self.assertIsNone(OsmCacheFile.load(self.path, self.source))
+        os.remove(self.path)
+        self.assertIsNone(OsmCacheFile.load(self.path, self.source))
+
+    def test_08_truncated(self):
+        size = os.path.getsize(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(size - 40)
+        for copy in (False, True):
+            self.assertIsNone(OsmCacheFile.load(self.path, self.source,
+                                                copy=copy))
+
+    def test_09_missing_array(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        toc_len, = struct.unpack('<I', data[8:12])
+        toc = json.loads(data[12:12 + toc_len])
+        del toc['arrays']['way.refs']
+
+        # Same length, so that the offsets of the arrays stay right
+        toc_bytes = json.dumps(toc).encode('utf-8').ljust(toc_len)
+        with open(self.path, 'wb') as f:
+            f.write(data[:12] + toc_bytes + data[12 + toc_len:])
+        self.assertIsNone(OsmCacheFile.load(self.path, self.source))
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,159 @@
+# mapv/osm_change_t.py
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from pbf.osm_areas import OsmAreas
+from pbf.osm_builder import OsmDataFile, OsmStoreBuilder
+from pbf.osm_cache import OsmCacheFile, source_stamp
+from pbf.osm_change import OsmChange, apply_changes, change_state
+
+#-------------------------------------------------------------------------------
+# I want stdout to be unbuffered, always
+#-------------------------------------------------------------------------------
+
+class Unbuffered(object):
+    def __init__(self, stream):
+        self.stream = stream
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+import sys
+sys.stdout = Unbuffered(sys.stdout)
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Node 3 moves, way 11 is modified twice, way 12 is created then deleted,
+# node 4 is deleted, way 13 and its nodes are created
+osc_100 = '''<?xml version="1.0"?>
+<osmChange version="0.6">
+<modify>
+  <node id="3" lat="1.5" lon="1.0"/>
+  <way id="11"><nd ref="1"/><nd ref="2"/><tag k="highway" v="old"/></way>
+</modify>
+<create>
+  <way id="12"><nd ref="1"/><nd ref="3"/></way>
+  <node id="5" lat="2.0" lon="2.0"/>
+  <node id="6" lat="3.0" lon="3.0"/>
+  <way id="13"><nd ref="5"/><nd ref="6"/><tag k="highway" v="path"/></way>
+</create>
+<modify>
+  <way id="11"><nd ref="1"/><nd ref="3"/><tag k="highway" v="track"/></way>
+</modify>
+<delete>
+  <way id="12"/>
+  <node id="4"/>
+</delete>
+</osmChange>
+'''
+
+# Way 10 is deleted
+osc_101 = '''<?xml version="1.0"?>
+<osmChange version="0.6">
+<delete>
+  <way id="10"/>
+</delete>
+</osmChange>
+'''
+
+#-------------------------------------------------------------------------------
+# Helper functions
+#-------------------------------------------------------------------------------
+
+def osm_data():
+    """Ways 10 and 11 on nodes 1 to 4, as an OsmDataFile with its areas."""
+    b = OsmStoreBuilder(ways_only=True)
+    for i, (lat, lon) in enumerate([(0, 0), (0, 1), (1, 1), (1, 0)]):
+        b.add_node(i + 1, lat*10000000, lon*10000000)
+    b.add_way(10, [3, 4], [('highway', 'service')])
+    b.add_way(11, [1, 2], [('highway', 'track')])
+    osm = OsmDataFile(*b.finish(), {'seq_number': 99, 'timestamp': None})
+    osm.areas = OsmAreas.build(osm.ways, osm.relations, osm.node_dict)
+    return osm
+
+#-------------------------------------------------------------------------------
+# Change
+#-------------------------------------------------------------------------------
+
+class Change(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.dir, 'extract.osm')
+        with open(self.filepath, 'w') as f:
+            f.write('source')
+        OsmCacheFile.save(OsmCacheFile.filepath(self.filepath), osm_data(),
+                          source_stamp(self.filepath, None, True))
+        self.osc = []
+        for seq, body in ((100, osc_100), (101, osc_101)):
+            path = os.path.join(self.dir, f'{seq}.osc')
+            with open(path, 'w') as f:
+                f.write(body)
+            with open(os.path.join(self.dir, f'{seq}.state.txt'), 'w') as f:
+                f.write(f'#comment\nsequenceNumber={seq}\n'
+                        'timestamp=2024-05-01T10\\:00\\:00Z\n')
+            self.osc.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_01_state(self):
+        self.assertEqual((100, 1714557600), change_state(self.osc[0]))
+        path = os.path.join(self.dir, '123.osc.gz')
+        self.assertEqual((123, None), change_state(path))
+        self.assertEqual((None, None), change_state(self.filepath))
+
+    def test_02_build(self):
+        change = OsmChange.build(self.osc[0])
+        self.assertEqual([3, 5, 6], change.nodes.ids.tolist())
+        self.assertEqual([11, 13], sorted(change.ways.ids.tolist()))
+        w = change.ways.way(int(np.flatnonzero(change.ways.ids == 11)[0]))
+        self.assertEqual([1, 3], list(w.refs))
+        self.assertEqual({'highway': 'track'}, w.tags)
+        self.assertEqual([4], change.deleted['node'].tolist())
+        self.assertEqual([12], change.deleted['way'].tolist())
+        self.assertEqual(100, change.seq_number)
+
+    def test_03_apply(self):
+        osm = apply_changes(self.filepath, self.osc)
+        self.assertEqual(101, osm.meta['seq_number'])
+        self.assertEqual([11, 13], sorted(osm.ways.ids.tolist()))
+        nodes = osm.node_dict
+        self.assertNotIn(4, nodes)
+        self.assertAlmostEqual(1.5, nodes[3].lat)
+        self.assertAlmostEqual(3.0, nodes[6].lon)
+
+        # The cache was replaced
+        c = OsmCacheFile.load(OsmCacheFile.filepath(self.filepath))
+        self.assertEqual(101, c.seq_number)
+        self.assertEqual([11, 13], sorted(c.ways.ids.tolist()))
+
+    def test_04_sequence(self):
+        apply_changes(self.filepath, self.osc[:1])
+        osm = apply_changes(self.filepath, self.osc)
+        self.assertEqual(101, osm.meta['seq_number'])
+        self.assertEqual([11, 13], sorted(osm.ways.ids.tolist()))
+
+        # Nothing left to apply
+        osm = apply_changes(self.filepath, self.osc)
+        self.assertEqual(101, osm.seq_number)
+
+    def test_05_no_cache(self):
+        os.remove(OsmCacheFile.filepath(self.filepath))
+        self.assertIsNone(apply_changes(self.filepath, self.osc))
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,25 @@
+# osm_update.py
+
+"""Run this module with the pathname of an OSM file, already opened once so
+that it has a cache, and the pathnames of replication change files (.osc,
+.osc.gz), to apply the changes to the cache. Later opens of the file show the
+updated data.
+
+"""
+
+import sys
+from pbf.osm_change import apply_changes
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    # Check cmd line args
+    if len(sys.argv) < 3:
+        print(f'usage: {sys.argv[0]} <osm file> <osc file>...')
+        exit(-1)
+
+    osm = apply_changes(sys.argv[1], sys.argv[2:])
+    if osm is not None:
+        print(f'Sequence number {osm.meta["seq_number"]}, {osm.show()}')
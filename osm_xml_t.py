@@ -0,0 +1,88 @@
+# mapv/osm_xml_t.py
+
+import gzip
+import os
+import tempfile
+import unittest
+
+from pbf.osm_xml import OsmXmlFile, to_seconds
+
+#-------------------------------------------------------------------------------
+# I want stdout to be unbuffered, always
+#-------------------------------------------------------------------------------
+
+class Unbuffered(object):
+    def __init__(self, stream):
+        self.stream = stream
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+import sys
+sys.stdout = Unbuffered(sys.stdout)
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# 3 nodes, a way on 2 of them and a multipolygon
+osm_xml = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" timestamp="2020-09-13T12:26:40Z">
+  <bounds minlat="45" minlon="6" maxlat="46" maxlon="7"/>
+  <node id="1" lat="45.5" lon="6.5"><tag k="natural" v="tree"/></node>
+  <node id="2" lat="45.6" lon="6.6"/>
+  <node id="3" lat="45.7" lon="6.7"/>
+  <way id="10"><nd ref="1"/><nd ref="3"/><tag k="highway" v="track"/></way>
+  <relation id="20">
+    <member type="way" ref="10" role="outer"/>
+    <tag k="type" v="multipolygon"/>
+  </relation>
+</osm>
+'''
+
+#-------------------------------------------------------------------------------
+# XmlFile
+#-------------------------------------------------------------------------------
+
+class XmlFile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.dir, 'extract.osm.gz')
+        with gzip.open(self.filepath, 'wt', encoding='utf-8') as f:
+            f.write(osm_xml)
+
+    def tearDown(self):
+        os.remove(self.filepath)
+        os.rmdir(self.dir)
+
+    def test_01_elements(self):
+        f = OsmXmlFile.build(self.filepath)
+        self.assertEqual([1, 2, 3], f.node_dict.ids.tolist())
+        self.assertEqual([455000000, 456000000, 457000000],
+                         f.node_dict.lat.tolist())
+        self.assertEqual({'natural': 'tree'}, f.node_dict.node(0).tags)
+        w, = f.ways
+        self.assertEqual((10, [1, 3]), (w.id_, list(w.refs)))
+        r, = f.relations
+        self.assertEqual([('outer', 10, 1)], [tuple(m) for m in r.array])
+
+    def test_02_ways_only(self):
+        f = OsmXmlFile.build(self.filepath, ways_only=True)
+        self.assertEqual([1, 3], f.node_dict.ids.tolist())
+
+    def test_03_timestamp(self):
+        self.assertEqual(1600000000, OsmXmlFile.build(self.filepath)
+                         .meta['timestamp'])
+        self.assertEqual(1600000000, to_seconds('2020-09-13T12:26:40Z'))
+        self.assertIsNone(to_seconds(None))
+        self.assertIsNone(to_seconds('yesterday'))
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
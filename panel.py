@@ -2,6 +2,21 @@
 
 import wx
 
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Checkboxes of the DLG-3 categories, label -> code
+dlg_layers = {
+    'Hydrography': 'HY',
+    'Hypsography': 'HP',
+    'Railroads': 'RR',
+    'Pipe & trans lines': 'MT',
+    'Roads and trails': 'RD',
+    'Boundaries': 'BO',
+    'Public Lands': 'PL',
+}
+
 #-------------------------------------------------------------------------------
 # CheckPanel
 #-------------------------------------------------------------------------------
@@ -9,35 +24,46 @@ import wx
 class CheckPanel(wx.Panel):
     """Checkboxes panel.
 
-    Each checkbox represents a layer that I want to toggle on/off.
+    Each checkbox represents a layer that I want to toggle on/off: the DLG-3
+    categories, or the layers of a shapefile model, see set_layers().
     """
     
     def __init__(self, *args, **kw):
         super().__init__(*args, **kw)
 
-        self.layers = {
-            'Hydrography': 'HY',
-            'Hypsography': 'HP',
-            'Railroads': 'RR',
-            'Pipe & trans lines': 'MT',
-            'Roads and trails': 'RD',
-            'Boundaries': 'BO',
-            'Public Lands': 'PL',
-        }
+        self.layers = {}  # label -> code
+        self.cbs = []
 
         # Lay out controls vertically
-        vbox = wx.BoxSizer(wx.VERTICAL)
+        self.vbox = wx.BoxSizer(wx.VERTICAL)
+        self.set_layers(dlg_layers)
+
+        # Finished doing layout
+        self.SetSizer(self.vbox)
+
+    def set_layers(self, layers, checked=None):
+        """Show one checkbox per layer, layers maps the labels to the codes.
+
+        The boxes of the codes in checked are checked, none if it's None, and
+        then nothing changes if the layers are already the ones shown.
+        """
+        if checked is None and layers == self.layers:
+            return
+        for cb in self.cbs:
+            cb.Destroy()
+        self.vbox.Clear()
 
         # Create and bind checkboxes
+        self.layers = dict(layers)
         self.cbs = []
-        for layer in self.layers.keys():
-            cb = wx.CheckBox(self, label=layer)
+        for label, code in self.layers.items():
+            cb = wx.CheckBox(self, label=label)
+            cb.SetValue(checked is not None and code in checked)
             self.Bind(wx.EVT_CHECKBOX, self.on_check, cb)
-            vbox.Add(cb, 0)
+            self.vbox.Add(cb, 0)
             self.cbs.append(cb)
-
-        # Finished doing layout
-        self.SetSizer(vbox)
+        self.Layout()
+        self.GetParent().Layout()
 
     def on_check(self, e):
         cb = e.GetEventObject()
@@ -0,0 +1,253 @@
+# pbf/osm_areas.py - areas from closed ways and multipolygon relations
+
+"""OSM has no polygon type: an area is either a closed way, with tags that
+make it an area (landuse, natural, building...), or a multipolygon relation,
+whose member ways are pieces of its outer and inner rings, in any order and
+direction.
+
+Assembling a multipolygon means joining its member ways end to end until
+they close. The ways are looked up by their endpoint node ids in a
+dictionary, so that joining is linear in the number of members, whatever
+their order. Rings that don't close, typically because some members are
+outside the extract, are dropped.
+
+The assembled areas are kept as arrays, like the ways' geometry: a flat array
+of (lon, lat) coordinates, the offsets of the rings in it, and for each ring
+its area and whether it's an outer ring. Holes are given by inner rings, and
+the even-odd rule is enough to fill them.
+
+"""
+from collections import defaultdict
+
+import numpy as np
+
+from .osm_pbf import TagFilter, concatenate_runs, make_offsets, take_runs
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Area classes, in order of precedence, and the tags that make an area
+area_classes = (
+    ('water', 'natural=water waterway=riverbank landuse=reservoir|basin'),
+    ('green', 'landuse=forest|grass|meadow|orchard|vineyard|farmland'
+              ' natural=wood|scrub|heath|grassland leisure=park|garden'),
+    ('building', 'building=*'),
+    ('other', 'landuse=* natural=* leisure=* amenity=* area=yes'),
+)
+
+area_filters = [TagFilter.parse(expr) for _, expr in area_classes]
+
+# OSM member types, see osmformat.proto
+member_way = 1
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def area_class(tags):
+    """Class of a tags dictionary, as a position in area_classes, or -1."""
+    for i, f in enumerate(area_filters):
+        if f.match(tags):
+            return i
+    return -1
+
+def assemble_rings(chains):
+    """Join chains of node ids end to end into closed rings.
+
+    Argument chains is a list of arrays of node ids, in any order and
+    direction. Return the list of closed rings, whose first and last node are
+    the same; the chains that don't end up in a closed ring are dropped.
+    """
+    rings = []
+    pieces = []
+    ends = defaultdict(list)  # Node id -> pieces starting or ending there
+    for c in chains:
+        if len(c) < 2:
+            continue
+        if c[0] == c[-1]:
+            rings.append(c)
+            continue
+        ends[int(c[0])].append(len(pieces))
+        ends[int(c[-1])].append(len(pieces))
+        pieces.append(c)
+
+    used = [False]*len(pieces)
+    for i, c in enumerate(pieces):
+        if used[i]:
+            continue
+        used[i] = True
+        parts = [c]
+        start, end = int(c[0]), int(c[-1])
+        while end != start:
+            j = next((j for j in ends[end] if not used[j]), None)
+            if j is None:
+                break
+            used[j] = True
+            c = pieces[j] if pieces[j][0] == end else pieces[j][::-1]
+            parts.append(c[1:])
+            end = int(c[-1])
+        if end == start:
+            rings.append(np.concatenate(parts))
+    return rings
+
+#-------------------------------------------------------------------------------
+# OsmAreas
+#-------------------------------------------------------------------------------
+
+class OsmAreas:
+    """Areas of a file, as rings of (lon, lat) coordinates in degrees.
+
+    Ring i is xy[offsets[i]:offsets[i+1]], it's implicitly closed (its last
+    point is usually its first one, but not when that node is missing),
+    belongs to area ring_area[i], and ring_outer[i] tells if it's an outer
+    ring. Area j comes from the way or relation with id ids[j],
+    is_rel[j] tells which, and its class is area_classes[classes[j]].
+    """
+    def __init__(self, xy, offsets, ring_area, ring_outer, ids, is_rel,
+                 classes):
+        self.xy = xy
+        self.offsets = offsets
+        self.ring_area = ring_area
+        self.ring_outer = ring_outer
+        self.ids = ids
+        self.is_rel = is_rel
+        self.classes = classes
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def rings(self):
+        """Number of rings."""
+        return len(self.offsets) - 1
+
+    def show(self):
+        counts = np.bincount(self.classes, minlength=len(area_classes))
+        s = f'{len(self)} areas, {self.rings} rings'
+        for (name, _), n in zip(area_classes, counts):
+            s += f', {name}={n}'
+        return s
+
+    def select(self, keep):
+        """Areas for which boolean array keep is True, renumbered."""
+        ring_keep = keep[self.ring_area]
+        offsets, xy = take_runs(self.offsets, ring_keep, self.xy)
+        new_area = np.cumsum(keep) - 1
+        return OsmAreas(xy, offsets, new_area[self.ring_area[ring_keep]],
+                        self.ring_outer[ring_keep], self.ids[keep],
+                        self.is_rel[keep], self.classes[keep])
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Merge several OsmAreas, in order, into one."""
+        parts = list(parts)
+        first = np.cumsum([0] + [len(a) for a in parts[:-1]])
+        offsets, xy, ring_area, ring_outer, ids, is_rel, classes = \
+            concatenate_runs([a.offsets for a in parts],
+                             [a.xy for a in parts],
+                             [a.ring_area + f for a, f in zip(parts, first)],
+                             [a.ring_outer for a in parts],
+                             [a.ids for a in parts], [a.is_rel for a in parts],
+                             [a.classes for a in parts])
+        return cls(xy, offsets, ring_area, ring_outer, ids, is_rel, classes)
+
+    @classmethod
+    def build(cls, ways, relations, nodes):
+        """Assemble the areas of an OsmWayStore, a list of OsmRelation and
+        an OsmNodeStore.
+        """
+        rings = []  # Node ids of the rings
+        ring_area = []
+        ring_outer = []
+        ids = []
+        is_rel = []
+        classes = []
+
+        def add(rings_ids, outer, id_, rel, klass):
+            rings.extend(rings_ids)
+            ring_area.extend([len(ids)]*len(rings_ids))
+            ring_outer.extend(outer)
+            ids.append(id_)
+            is_rel.append(rel)
+            classes.append(klass)
+
+        # Closed ways, classified on their tag codes for all of them at once
+        o = ways.offsets
+        closed = (np.diff(o) >= 4) & \
+            (ways.refs[o[:-1]] == ways.refs[np.maximum(o[1:] - 1, 0)])
+        klass = np.full(len(ways), -1, dtype=np.int64)
+        if ways.tags is not None:
+            for i, f in reversed(list(enumerate(area_filters))):
+                klass[f.select(ways.tags)] = i
+        for i in np.flatnonzero(closed & (klass >= 0)):
+            add([ways.refs[o[i]:o[i + 1]]], [True], ways.ids[i], False,
+                klass[i])
+
+        # Multipolygons, their member ways are found by id
+        order = np.argsort(ways.ids)
+        sorted_ids = ways.ids[order]
+        for rel in relations:
+            tags = rel.tags or {}
+            if tags.get('type') != 'multipolygon':
+                continue
+            k = area_class(tags)
+            if k < 0:
+                continue
+            members = [(role, memid) for role, memid, type_ in rel.array
+                       if type_ == member_way]
+            memids = np.array([m for _, m in members], dtype=np.int64)
+            if len(memids) == 0 or len(sorted_ids) == 0:
+                continue
+            pos = np.searchsorted(sorted_ids, memids)
+            pos[pos == len(sorted_ids)] = 0
+            found = sorted_ids[pos] == memids
+            outer = []
+            inner = []
+            for (role, _), p, ok in zip(members, order[pos], found):
+                if ok:
+                    chain = ways.refs[o[p]:o[p + 1]]
+                    (inner if role == 'inner' else outer).append(chain)
+            outer = assemble_rings(outer)
+            if len(outer) > 0:
+                inner = assemble_rings(inner)
+                add(outer + inner, [True]*len(outer) + [False]*len(inner),
+                    rel.id_, True, k)
+
+        return cls.resolve(rings, ring_area, ring_outer, ids, is_rel,
+                           classes, nodes)
+
+    @classmethod
+    def resolve(cls, rings, ring_area, ring_outer, ids, is_rel, classes,
+                nodes):
+        """Build the areas from the node ids of their rings.
+
+        The coordinates of all the rings are looked up at once. Missing nodes
+        are dropped, then the rings left with less than 4 points (a triangle,
+        closed), then the areas left without an outer ring.
+        """
+        counts = np.array([len(r) for r in rings], dtype=np.int64)
+        refs = np.concatenate(rings) if len(rings) > 0 else \
+            np.empty(0, dtype=np.int64)
+        xy, found = nodes.coords(refs)
+        owner = np.repeat(np.arange(len(rings)), counts)
+        kept = np.bincount(owner[found], minlength=len(rings))
+
+        ring_area = np.array(ring_area, dtype=np.int64)
+        ring_outer = np.array(ring_outer, dtype=bool)
+        keep_ring = kept >= 4
+        has_outer = np.zeros(len(ids), dtype=bool)
+        has_outer[ring_area[keep_ring & ring_outer]] = True
+        keep_ring &= has_outer[ring_area]
+
+        # Areas are renumbered once the empty ones are gone
+        new_area = np.cumsum(has_outer) - 1
+        return cls(xy[found & keep_ring[owner]],
+                   make_offsets(kept[keep_ring]),
+                   new_area[ring_area[keep_ring]], ring_outer[keep_ring],
+                   np.array(ids, dtype=np.int64)[has_outer],
+                   np.array(is_rel, dtype=bool)[has_outer],
+                   np.array(classes, dtype=np.int8)[has_outer])
+
+# End of osm_areas.py
+#===============================================================================
@@ -0,0 +1,185 @@
+# pbf/osm_builder.py - building the OSM stores from a stream of elements
+
+"""The .pbf reader decodes whole blocks of elements into arrays at once. Other
+formats, OSM XML and O5M, are read one element at a time; the elements are
+appended here to flat growing arrays (from the array module, 4 or 8 bytes per
+value), so that memory stays proportional to the data kept, never to Python
+objects per element. Tag strings are interned into a single string table as
+they come, and the tags are kept as codes, like OsmTags.
+
+Once the stream is over, the arrays become the same stores as the ones the
+.pbf reader builds: an OsmNodeStore, an OsmWayStore and a list of
+OsmRelation, in an OsmDataFile.
+
+"""
+from array import array
+
+import numpy as np
+
+from .osm_geometry import OsmWayGeometry
+from .osm_pbf import (OsmNodeStore, OsmRelation, OsmTags, OsmWayStore,
+                      TagFilter, make_offsets)
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def append_array(column, a):
+    """Append the values of NumPy array a to column, an array.array."""
+    column.frombytes(np.asarray(a, dtype=column.typecode).tobytes())
+
+#-------------------------------------------------------------------------------
+# OsmStoreBuilder
+#-------------------------------------------------------------------------------
+
+class OsmStoreBuilder:
+    """Accumulate elements, see above.
+
+    Node coordinates are given in units of 1e-7 degrees, tags as sequences
+    of (key, value) couples of strings. With a tag_filter (see TagFilter),
+    only the ways that match are kept; with ways_only, or a tag filter, only
+    the nodes referenced by the ways kept. With ways_only, the tags of the
+    nodes are dropped as they come, node_tags is None.
+    """
+    def __init__(self, ways_only=False, tag_filter=None):
+        self.ways_only = ways_only
+        self.tag_filter = TagFilter.make(tag_filter)
+        self.table = {'': 0}  # String -> code
+
+        self.node_ids = array('q')
+        self.node_lat = array('i')
+        self.node_lon = array('i')
+        self.node_tags = None if ways_only else self.new_tags()
+
+        self.way_ids = array('q')
+        self.way_counts = array('q')
+        self.way_refs = array('q')
+        self.way_tags = self.new_tags()
+
+        self.relations = []
+
+    @staticmethod
+    def new_tags():
+        """Counts, keys and values arrays for the tags of elements."""
+        return array('q'), array('i'), array('i')
+
+    def add_tags(self, arrays, tags):
+        counts, keys, vals = arrays
+        table = self.table
+        counts.append(len(tags))
+        for k, v in tags:
+            keys.append(table.setdefault(k, len(table)))
+            vals.append(table.setdefault(v, len(table)))
+
+    def add_node_tags(self, tags):
+        """Add the tags of the next node, unless they are dropped."""
+        if self.node_tags is not None:
+            self.add_tags(self.node_tags, tags)
+
+    def add_node(self, id_, lat, lon, tags=()):
+        self.node_ids.append(id_)
+        self.node_lat.append(lat)
+        self.node_lon.append(lon)
+        self.add_node_tags(tags)
+
+    def add_way(self, id_, refs, tags=()):
+        """Add a way, unless the tag filter leaves it out."""
+        if self.tag_filter is not None and \
+           not self.tag_filter.match(dict(tags)):
+            return
+        self.way_ids.append(id_)
+        self.way_counts.append(len(refs))
+        self.way_refs.extend(refs)
+        self.add_tags(self.way_tags, tags)
+
+    def extend_nodes(self, ids, lat, lon):
+        """Add nodes given as arrays, their tags having been added in the
+        same order with add_node_tags().
+        """
+        for column, a in zip((self.node_ids, self.node_lat, self.node_lon),
+                             (ids, lat, lon)):
+            append_array(column, a)
+
+    def extend_ways(self, ids, counts, refs):
+        """Add ways given as arrays, the refs of all of them in one, their
+        tags having been added in the same order with
+        add_tags(self.way_tags, ...). The tag filter is not applied.
+        """
+        for column, a in zip((self.way_ids, self.way_counts, self.way_refs),
+                             (ids, counts, refs)):
+            append_array(column, a)
+
+    def add_relation(self, id_, members, tags=()):
+        """Add a relation, members are (role, memid, type) triples."""
+        self.relations.append(OsmRelation(id_, dict(tags), list(members)))
+
+    def tags(self, arrays, strings):
+        counts, keys, vals = arrays
+        return OsmTags(make_offsets(np.frombuffer(counts, dtype=np.int64)),
+                       np.array(keys, dtype=np.int32),
+                       np.array(vals, dtype=np.int32), strings)
+
+    def finish(self):
+        """Return the node store, way store and relations list."""
+        strings = list(self.table)
+        ways = OsmWayStore(np.array(self.way_ids, dtype=np.int64),
+                           make_offsets(np.frombuffer(self.way_counts,
+                                                      dtype=np.int64)),
+                           np.array(self.way_refs, dtype=np.int64),
+                           self.tags(self.way_tags, strings))
+
+        # Select the nodes on the flat columns, before the store sorts them
+        ids = np.frombuffer(self.node_ids, dtype=np.int64)
+        lat = np.frombuffer(self.node_lat, dtype=np.int32)
+        lon = np.frombuffer(self.node_lon, dtype=np.int32)
+        tags = None
+        if self.node_tags is not None:
+            tags = self.tags(self.node_tags, strings)
+        if self.ways_only or self.tag_filter is not None:
+            refs = np.unique(ways.refs)
+            pos = np.searchsorted(refs, ids)
+            pos[pos == len(refs)] = 0
+            keep = refs[pos] == ids if len(refs) else pos < 0
+            ids, lat, lon = ids[keep], lat[keep], lon[keep]
+            if tags is not None:
+                tags = tags.take(keep)
+        nodes = OsmNodeStore.build(ids, lat, lon, tags)
+        return nodes, ways, self.relations
+
+#-------------------------------------------------------------------------------
+# OsmDataFile
+#-------------------------------------------------------------------------------
+
+class OsmDataFile:
+    """OSM data read from a file other than .pbf, see OsmStoreBuilder.
+
+    Offers the same data as an OsmPbfFile: node_dict, ways, relations,
+    geometry, areas and bbox.
+    """
+    def __init__(self, node_dict, ways, relations, meta=None):
+        self.node_dict = node_dict  # OsmNodeStore
+        self.ways = ways  # OsmWayStore
+        self.relations = relations  # list of OsmRelation
+        self.meta = meta or {'seq_number': None, 'timestamp': None}
+        self.areas = None  # OsmAreas, see osm_areas.py
+        self._geometry = None
+
+    def show(self):
+        return f'{len(self.node_dict)} nodes, {len(self.ways)} ways' \
+            f', {len(self.relations)} relations, bbox={self.bbox}'
+
+    @property
+    def bbox(self):
+        """Bounding box of this file's nodes."""
+        return self.node_dict.bbox
+
+    @property
+    def geometry(self):
+        """Polylines of all the ways of the file, as an OsmWayGeometry."""
+        if self._geometry is None:
+            self._geometry = OsmWayGeometry.build(
+                self.ways, *self.node_dict.coords(self.ways.refs))
+        return self._geometry
+
+# End of osm_builder.py
+#===============================================================================
@@ -0,0 +1,286 @@
+# pbf/osm_cache.py - decoded OSM data in a memory-mapped cache file
+
+"""Decoding a .pbf file takes seconds for a small extract, and much longer for
+a country. Once decoded, the data is a handful of flat arrays: the node ids
+and coordinates, the way ids, refs and their offsets, the tags as codes into a
+string table. These arrays are written as they are into a single cache file,
+next to the .pbf file, along with the geometry of the ways, its spatial index,
+and the assembled areas, see OsmWayGeometry and OsmAreas.
+
+Reopening maps the cache file and wraps its arrays into the same stores as
+decoding does, without reading them: pages are only read from disk when the
+arrays are used, for the part that is used. Drawing a view reads the grid
+cells in view and the polylines found there, not the whole geometry.
+
+File layout:
+
+- magic (8 bytes), then the length of the table of contents (uint32)
+- table of contents, as JSON: the source file stamp, some metadata, the
+  extent and shape of the geometry's grid index, and the dtype, shape and
+  offset of each array
+- the arrays, each aligned on 64 bytes
+
+The strings of the string table are stored as one array of UTF-8 bytes plus
+their offsets, and decoded on demand, see PackedStrings.
+
+"""
+import os
+import json
+import struct
+
+import numpy as np
+
+from spatial import GridIndex
+from .osm_areas import OsmAreas
+from .osm_geometry import OsmWayGeometry
+from .osm_pbf import OsmNodeStore, OsmTags, OsmWayStore, TagFilter, \
+    make_offsets
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Appended to the .pbf file name
+cache_suffix = '.cache'
+
+# First bytes of a cache file, the last one is the format version
+cache_magic = b'MAPVOSM\x04'
+
+# Alignment of the arrays in the file
+cache_align = 64
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def source_stamp(filepath, tag_filter, ways_only):
+    """What the cache of filepath depends on, as a dictionary.
+
+    The tag filter, see TagFilter, is given in its canonical form, so that
+    equivalent filters share a cache.
+    """
+    st = os.stat(filepath)
+    tag_filter = TagFilter.make(tag_filter)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+            'ways_only': bool(ways_only),
+            'tag_filter': None if tag_filter is None else str(tag_filter)}
+
+def split_tags(tags, n):
+    """Split an OsmTags in two, the first n elements and the others."""
+    o = tags.offsets
+    head = OsmTags(o[:n + 1], tags.keys[:o[n]], tags.vals[:o[n]],
+                   tags.strings)
+    tail = OsmTags(o[n:] - o[n], tags.keys[o[n]:], tags.vals[o[n]:],
+                   tags.strings)
+    return head, tail
+
+#-------------------------------------------------------------------------------
+# PackedStrings
+#-------------------------------------------------------------------------------
+
+class PackedStrings:
+    """String table as one array of UTF-8 bytes, string i being
+    data[offsets[i]:offsets[i+1]].
+
+    Strings are decoded when they are read, so that a mapped table costs
+    nothing until it is used. Can be used like the list of strings it
+    replaces: len(), indexing, iteration.
+    """
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]) \
+            .decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @classmethod
+    def build(cls, strings):
+        """Pack a sequence of strings."""
+        encoded = [s.encode('utf-8') for s in strings]
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                   make_offsets([len(e) for e in encoded]))
+
+#-------------------------------------------------------------------------------
+# OsmCacheFile
+#-------------------------------------------------------------------------------
+
+class OsmCacheFile:
+    """Decoded OSM data, read from a cache file.
+
+    Offers what the viewer uses of an OsmPbfFile: node_dict, ways, geometry,
+    areas and bbox, plus the replication sequence number and timestamp of the
+    source file.
+    """
+    def __init__(self, node_dict, ways, geometry, areas, meta):
+        self.node_dict = node_dict  # OsmNodeStore
+        self.ways = ways  # OsmWayStore
+        self.geometry = geometry  # OsmWayGeometry
+        self.areas = areas  # OsmAreas
+        self.meta = meta  # dictionary, see save()
+
+    def show(self):
+        return f'Cache of {len(self.node_dict)} nodes, {len(self.ways)} ways' \
+            f', seq_number={self.seq_number}, bbox={self.bbox}'
+
+    @property
+    def bbox(self):
+        bbox = self.meta['bbox']
+        return None if bbox is None else tuple(bbox)
+
+    @property
+    def seq_number(self):
+        return self.meta['seq_number']
+
+    @property
+    def timestamp(self):
+        return self.meta['timestamp']
+
+    @staticmethod
+    def filepath(pbf_path):
+        """Path of the cache of file pbf_path."""
+        return pbf_path + cache_suffix
+
+    @classmethod
+    def save(cls, path, osm, source):
+        """Write the data of osm, an OsmPbfFile or OsmCacheFile, to path.
+
+        Argument source is the stamp of the source file, see source_stamp().
+        """
+        nodes = osm.node_dict
+        ways = osm.ways
+        geometry = osm.geometry
+        index = geometry.index
+        areas = osm.areas
+        if areas is None:
+            areas = OsmAreas.build(ways, osm.relations, nodes)
+
+        # One string table for the tags of both nodes and ways
+        tags = OsmTags.concatenate([
+            nodes.tags if nodes.tags is not None else OsmTags.empty(len(nodes)),
+            ways.tags if ways.tags is not None else OsmTags.empty(len(ways))])
+        strings = PackedStrings.build(tags.strings)
+
+        arrays = {
+            'node.ids': nodes.ids, 'node.lat': nodes.lat,
+            'node.lon': nodes.lon,
+            'way.ids': ways.ids, 'way.offsets': ways.offsets,
+            'way.refs': ways.refs,
+            'geometry.xy': geometry.xy, 'geometry.offsets': geometry.offsets,
+            'geometry.ways': geometry.ways,
+            'geometry.missing': geometry.missing,
+            'index.boxes': index.boxes, 'index.cell_start': index.cell_start,
+            'index.items': index.items,
+            'areas.xy': areas.xy, 'areas.offsets': areas.offsets,
+            'areas.ring_area': areas.ring_area,
+            'areas.ring_outer': areas.ring_outer, 'areas.ids': areas.ids,
+            'areas.is_rel': areas.is_rel, 'areas.classes': areas.classes,
+            'tags.offsets': tags.offsets, 'tags.keys': tags.keys,
+            'tags.vals': tags.vals,
+            'strings.data': strings.data, 'strings.offsets': strings.offsets}
+
+        hdr = getattr(osm, 'header_block', None)
+        meta = getattr(osm, 'meta', None) or {
+            'seq_number': hdr.osmo_seq_number if hdr else None,
+            'timestamp': hdr.osmo_timestamp if hdr else None}
+        meta = dict(meta, bbox=osm.bbox)
+
+        grid = {'extent': [float(v) for v in index.extent],
+                'shape': [int(n) for n in index.shape]}
+        toc = {'source': source, 'meta': meta, 'grid': grid, 'arrays': {}}
+        toc_len = 0
+        while True:
+            # The offsets depend on the length of the TOC, which contains them
+            pos = len(cache_magic) + 4 + toc_len
+            for name, a in arrays.items():
+                pos = (pos + cache_align - 1)//cache_align*cache_align
+                toc['arrays'][name] = [a.dtype.str, list(a.shape), pos]
+                pos += a.nbytes
+            toc_bytes = json.dumps(toc).encode('utf-8')
+            if len(toc_bytes) == toc_len:
+                break
+            toc_len = len(toc_bytes)
+
+        # Write a temporary file, so that a failure leaves no partial cache
+        tmp = path + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(cache_magic + struct.pack('<I', len(toc_bytes)))
+                f.write(toc_bytes)
+                for name, a in arrays.items():
+                    f.seek(toc['arrays'][name][2])
+                    f.write(np.ascontiguousarray(a).data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f'Cannot write cache {path}: {e}')
+
+    @classmethod
+    def load(cls, path, source=None, copy=False):
+        """Map the cache file at path, None if it's missing or stale.
+
+        The cache is stale if source, when given, is not the stamp the cache
+        was made from. With copy, the file is read into memory rather than
+        mapped, so that it can be replaced while the data is in use: Windows
+        doesn't allow it for a mapped file.
+        """
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(len(cache_magic) + 4)
+                if head[:len(cache_magic)] != cache_magic:
+                    return None
+                toc_len, = struct.unpack('<I', head[len(cache_magic):])
+                toc = json.loads(f.read(toc_len))
+            if source is not None and toc['source'] != source:
+                return None
+            if copy:
+                buf = np.fromfile(path, dtype=np.uint8)
+            else:
+                buf = np.memmap(path, dtype=np.uint8, mode='r')
+        except (OSError, ValueError, KeyError, TypeError, struct.error):
+            return None
+
+        def array(name):
+            dtype, shape, offset = toc['arrays'][name]
+            dtype = np.dtype(dtype)
+            nbytes = int(np.prod(shape))*dtype.itemsize
+            if offset < 0 or offset + nbytes > len(buf):
+                raise ValueError(f'{name} is past the end of the file')
+            return buf[offset:offset + nbytes].view(dtype).reshape(shape)
+
+        # A truncated file, or a TOC without some array, is stale too
+        try:
+            strings = PackedStrings(array('strings.data'),
+                                    array('strings.offsets'))
+            tags = OsmTags(array('tags.offsets'), array('tags.keys'),
+                           array('tags.vals'), strings)
+            node_ids = array('node.ids')
+            node_tags, way_tags = split_tags(tags, len(node_ids))
+            nodes = OsmNodeStore(node_ids, array('node.lat'),
+                                 array('node.lon'), node_tags)
+            ways = OsmWayStore(array('way.ids'), array('way.offsets'),
+                               array('way.refs'), way_tags)
+            grid = toc['grid']
+            index = GridIndex(array('index.boxes'), tuple(grid['extent']),
+                              tuple(grid['shape']), array('index.cell_start'),
+                              array('index.items'))
+            geometry = OsmWayGeometry(array('geometry.xy'),
+                                      array('geometry.offsets'),
+                                      array('geometry.ways'),
+                                      array('geometry.missing'), index)
+            areas = OsmAreas(*(array(f'areas.{name}') for name in (
+                'xy', 'offsets', 'ring_area', 'ring_outer', 'ids', 'is_rel',
+                'classes')))
+            meta = toc['meta']
+        except (KeyError, TypeError, ValueError, IndexError):
+            return None
+        return cls(nodes, ways, geometry, areas, meta)
+
+# End of osm_cache.py
+#===============================================================================
@@ -0,0 +1,313 @@
+# pbf/osm_change.py - applying OSM change files to a cached file
+
+"""OSM change files, .osc, are the diffs published by the replication service,
+minutely, hourly or daily, as OSM XML: an <osmChange> root, then <create>,
+<modify> and <delete> elements holding the nodes, ways and relations
+concerned, in their new version. The same element can appear more than once
+in a file, the last occurrence wins.
+
+Keeping a decoded file up to date means applying the changes to its cache,
+see OsmCacheFile, rather than decoding a whole new extract. The changes are
+merged with the cached arrays: the nodes and ways that are deleted or
+modified are dropped, then the new versions added. The geometry of the ways
+and the areas are built again once all the files are applied.
+
+A modified way may reference nodes that the cache doesn't have, since it
+only keeps the nodes of the ways, and the nodes of the changes applied
+before. Only those are read from the .pbf file, decoding only the blocks that
+its index shows may hold them: the nodes of the cache are the most recent
+ones. The entries of the index are extended to cover the changed elements,
+see OsmPbfBlockIndex.patch().
+
+Replication files come with a .state.txt file, that gives their sequence
+number and timestamp. The files whose sequence number is not above the one of
+the cache are already applied, and skipped. The cache then gets the sequence
+number and timestamp of the last file applied.
+
+The cache doesn't have the relations. The multipolygons that are in the
+changes are assembled again, and so are the ones with a member way that
+changed, itself or its nodes, after reading them from the .pbf file. These
+are the relations of the .pbf file though: a relation changed by files
+applied before comes back in its original version. Without an index, for
+files other than .pbf, the areas of the latter are kept as they are.
+
+"""
+import os
+import re
+from xml.etree.ElementTree import iterparse
+
+import numpy as np
+
+from .osm_areas import OsmAreas, member_way
+from .osm_builder import OsmDataFile, OsmStoreBuilder
+from .osm_cache import OsmCacheFile, source_stamp
+from .osm_pbf import OsmNodeStore, OsmPbfFile, OsmWayStore, TagFilter, \
+    degrees_per_unit, take_runs
+from .osm_xml import add_element, open_xml, to_seconds
+from .pbf_index import OsmPbfBlockIndex
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Change file suffixes
+osc_suffixes = ('.osc', '.osc.gz', '.osc.bz2')
+
+# Actions of a change file
+osc_actions = ('create', 'modify', 'delete')
+
+# Elements of a change file
+osc_elems = ('node', 'way', 'relation')
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def change_state(filepath):
+    """Sequence number and timestamp, in seconds, of a change file.
+
+    They are read from the replication state file next to it, 123.state.txt
+    for 123.osc.gz, else the sequence number is taken from the file name.
+    Either is None when it can't be found.
+    """
+    base = filepath
+    for suffix in osc_suffixes:
+        if filepath.endswith(suffix):
+            base = filepath[:-len(suffix)]
+    state = {}
+    try:
+        with open(base + '.state.txt', encoding='utf-8') as f:
+            for line in f:
+                if '=' in line and not line.startswith('#'):
+                    key, value = line.strip().split('=', 1)
+                    state[key] = value.replace('\\', '')
+    except OSError:
+        pass
+
+    seq_number = state.get('sequenceNumber')
+    if seq_number is None:
+        m = re.fullmatch(r'\d+', os.path.basename(base))
+        seq_number = m and m.group()
+    timestamp = to_seconds(state.get('timestamp'))
+    return None if seq_number is None else int(seq_number), timestamp
+
+def last_occurrences(ids):
+    """Boolean array of the last occurrence of each id in array ids."""
+    keep = np.zeros(len(ids), dtype=bool)
+    _, first = np.unique(ids[::-1], return_index=True)
+    keep[len(ids) - 1 - first] = True
+    return keep
+
+def ways_using(ways, node_ids):
+    """Sorted positions of the ways of an OsmWayStore that reference some of
+    the nodes node_ids.
+    """
+    hits = np.flatnonzero(np.isin(ways.refs, node_ids))
+    return np.unique(np.searchsorted(ways.offsets, hits, side='right') - 1)
+
+def way_boxes(ways, pos, nodes):
+    """Bounding boxes (min_lat, max_lat, min_lon, max_lon) of the ways at
+    positions pos of an OsmWayStore, as an (n, 4) array.
+
+    The ways without any node in the OsmNodeStore get NaN.
+    """
+    offsets, refs = take_runs(ways.offsets, pos, ways.refs)
+    xy, found = nodes.coords(refs)
+    boxes = np.full((len(pos), 4), np.nan)
+    nonempty = offsets[:-1] < offsets[1:]
+    if len(refs) > 0:
+        starts = offsets[:-1][nonempty]
+        for k, (reduce, column) in enumerate(((np.fmin, 1), (np.fmax, 1),
+                                              (np.fmin, 0), (np.fmax, 0))):
+            boxes[nonempty, k] = reduce.reduceat(xy[:, column], starts)
+    return boxes
+
+#-------------------------------------------------------------------------------
+# OsmChange
+#-------------------------------------------------------------------------------
+
+class OsmChange:
+    """The changes of an .osc file.
+
+    Nodes and ways created or modified are in an OsmNodeStore and an
+    OsmWayStore, relations in a list of OsmRelation, only their last version.
+    Argument deleted maps each kind of element to the sorted array of the ids
+    deleted.
+    """
+    def __init__(self, nodes, ways, relations, deleted, seq_number=None,
+                 timestamp=None):
+        self.nodes = nodes
+        self.ways = ways
+        self.relations = relations
+        self.deleted = deleted
+        self.seq_number = seq_number
+        self.timestamp = timestamp
+
+    def show(self):
+        return f'Change {self.seq_number}: {len(self.nodes)} nodes' \
+            f', {len(self.ways)} ways, {len(self.relations)} relations' \
+            f' created or modified, {len(self.deleted["node"])} nodes' \
+            f', {len(self.deleted["way"])} ways' \
+            f', {len(self.deleted["relation"])} relations deleted'
+
+    @classmethod
+    def build(cls, filepath):
+        """Read an .osc file, possibly compressed."""
+        builder = OsmStoreBuilder()
+        last = {elem: {} for elem in osc_elems}  # Id -> deleted
+        action = None
+        with open_xml(filepath) as f:
+            for event, elem in iterparse(f, events=('start', 'end')):
+                if elem.tag in osc_actions:
+                    # Elements are cleared from their action as they come
+                    action = elem
+                    continue
+                if event == 'start' or elem.tag not in osc_elems:
+                    continue
+                deleted = action.tag == 'delete'
+                last[elem.tag][int(elem.get('id'))] = deleted
+                if not deleted:
+                    add_element(builder, elem)
+                action.clear()
+
+        nodes, ways, relations = builder.finish()
+        deleted = {elem: np.array(sorted(i for i, d in last[elem].items()
+                                         if d), dtype=np.int64)
+                   for elem in osc_elems}
+
+        # Drop the versions that are not the last one
+        nodes = nodes.take(~np.isin(nodes.ids, deleted['node']))
+        ways = ways.select(last_occurrences(ways.ids) &
+                           ~np.isin(ways.ids, deleted['way']))
+        relations = {r.id_: r for r in relations}
+        relations = [r for r in relations.values()
+                     if not last['relation'][r.id_]]
+        return cls(nodes, ways, relations, deleted, *change_state(filepath))
+
+    def apply(self, nodes, ways, tag_filter=None):
+        """Apply the changes to an OsmNodeStore and an OsmWayStore.
+
+        Return the new stores. With a tag_filter (see TagFilter), the ways
+        modified that don't match are dropped, and the ones created are not
+        added.
+        """
+        gone = np.union1d(self.deleted['node'], self.nodes.ids)
+        nodes = OsmNodeStore.concatenate([
+            nodes.take(~np.isin(nodes.ids, gone)), self.nodes])
+
+        changed = self.ways
+        if tag_filter is not None:
+            changed = changed.select(tag_filter.select(changed.tags))
+        gone = np.union1d(self.deleted['way'], self.ways.ids)
+        ways = OsmWayStore.concatenate([
+            ways.select(~np.isin(ways.ids, gone)), changed])
+        return nodes, ways
+
+#-------------------------------------------------------------------------------
+# apply_changes
+#-------------------------------------------------------------------------------
+
+def apply_changes(filepath, osc_paths, tag_filter=None, workers=None):
+    """Apply change files, .osc, to the cache of filepath, see above.
+
+    Argument tag_filter must be the one of the cache, see Osm.open(). Return
+    the updated data, an OsmDataFile, or None if filepath has no cache.
+    """
+    path = OsmCacheFile.filepath(filepath)
+    source = source_stamp(filepath, tag_filter, ways_only=True)
+    # Not mapped, the cache file is replaced at the end
+    osm = OsmCacheFile.load(path, source, copy=True)
+    if osm is None:
+        print(f'No cache for {filepath}, open it first')
+        return None
+    tag_filter = TagFilter.make(tag_filter)
+    meta = {'seq_number': osm.seq_number, 'timestamp': osm.timestamp}
+
+    nodes, ways = osm.node_dict, osm.ways
+    relations = {}  # Id -> OsmRelation, created or modified
+    dropped = []  # Ids of the relations deleted
+    changed = {'node': [], 'way': []}
+    deleted_nodes = []
+    dropped_ways = []
+    states = sorted(((change_state(p), p) for p in osc_paths),
+                    key=lambda s: (s[0][0] is None, s[0][0] or 0))
+    for (seq_number, _), p in states:
+        if None not in (seq_number, meta['seq_number']) and \
+           seq_number <= meta['seq_number']:
+            print(f'{p} already applied')
+            continue
+        change = OsmChange.build(p)
+        print(change.show())
+        nodes, ways = change.apply(nodes, ways, tag_filter)
+        for r in change.relations:
+            relations[r.id_] = r
+        for id_ in change.deleted['relation']:
+            relations.pop(int(id_), None)
+        dropped.append(change.deleted['relation'])
+        changed['node'].append(change.nodes.ids)
+        changed['way'].append(change.ways.ids)
+        deleted_nodes.append(change.deleted['node'])
+        dropped_ways.append(change.deleted['way'])
+        if change.seq_number is not None:
+            meta['seq_number'] = change.seq_number
+        if change.timestamp is not None:
+            meta['timestamp'] = change.timestamp
+    if len(changed['node']) == 0:
+        return osm
+
+    # Fetch the nodes that changed ways need and the cache doesn't have from
+    # the .pbf file
+    index = OsmPbfBlockIndex.load(filepath)
+    deleted_nodes = np.concatenate(deleted_nodes)
+    missing = np.setdiff1d(np.setdiff1d(np.unique(ways.refs), nodes.ids),
+                           deleted_nodes)
+    if len(missing) > 0 and index is not None:
+        found = OsmPbfFile.read_nodes(filepath, missing, index, workers)
+        print(f'{len(found)} nodes read from {filepath}')
+        nodes = OsmNodeStore.concatenate([nodes, found])
+
+    # Ways changed, themselves or their nodes
+    changed_ways = np.union1d(np.concatenate(changed['way']),
+                              np.concatenate(dropped_ways))
+    moved = ways_using(ways, np.union1d(np.concatenate(changed['node']),
+                                        deleted_nodes))
+    touched = np.union1d(changed_ways, ways.ids[moved])
+
+    # Multipolygons with one of them as a member, from the .pbf file
+    dropped = np.concatenate(dropped)
+    if len(touched) > 0 and index is not None:
+        touched_set = set(touched.tolist())
+        dropped_set = set(dropped.tolist())
+        count = 0
+        for r in OsmPbfFile.read_relations(filepath, index, workers):
+            if r.id_ in relations or r.id_ in dropped_set:
+                continue
+            if any(type_ == member_way and memid in touched_set
+                   for _, memid, type_ in r.array):
+                relations[r.id_] = r
+                count += 1
+        print(f'{count} relations read from {filepath}')
+
+    # Areas of the ways, all of them, and of the relations changed
+    old = osm.areas
+    keep = old.is_rel & ~np.isin(old.ids, np.concatenate(
+        [dropped, np.array(list(relations), dtype=np.int64)]))
+    new = OsmAreas.build(ways, list(relations.values()), nodes)
+    updated = OsmDataFile(nodes, ways, [], meta)
+    updated.areas = OsmAreas.concatenate([old.select(keep), new])
+    OsmCacheFile.save(path, updated, source)
+
+    if index is not None:
+        ids = np.unique(np.concatenate(changed['node']))
+        pos, found = nodes.lookup(ids)
+        lat = nodes.lat[pos[found]]*degrees_per_unit
+        lon = nodes.lon[pos[found]]*degrees_per_unit
+        index.patch('node', ids[found], np.column_stack([lat, lat, lon, lon]))
+
+        pos = np.flatnonzero(np.isin(ways.ids, touched))
+        index.patch('way', ways.ids[pos], way_boxes(ways, pos, nodes))
+        index.save(filepath)
+    return updated
+
+# End of osm_change.py
+#===============================================================================
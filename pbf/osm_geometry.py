@@ -0,0 +1,73 @@
+# pbf/osm_geometry.py - geometry of OSM ways
+
+"""Ways only hold node ids, drawing them needs the coordinates of these nodes.
+Rather than looking nodes up on every redraw, the refs of all the ways are
+resolved once, after the file is read, into polylines: a flat array of (lon,
+lat) coordinates plus offsets, the layout of raster.LineBatch.
+
+Nodes missing from the file, as at the edges of an extract, are dropped from
+their way, and their ids are kept so that they can be reported or fetched.
+Ways left with less than two nodes can't be drawn, they have no polyline.
+
+The polylines come with a spatial index of their bounding boxes, see
+spatial.GridIndex, so that drawing only reads the ones in view; it's saved in
+the cache with them, see osm_cache.py.
+
+"""
+import numpy as np
+
+from spatial import GridIndex, polyline_boxes
+
+#-------------------------------------------------------------------------------
+# OsmWayGeometry
+#-------------------------------------------------------------------------------
+
+class OsmWayGeometry:
+    """Polylines of the ways of a file, in degrees.
+
+    Polyline i is xy[offsets[i]:offsets[i+1]], and it's the geometry of the
+    way at position ways[i] in the OsmWayStore.
+    """
+    def __init__(self, xy, offsets, ways, missing, index=None):
+        self.xy = xy  # (n, 2) array of (lon, lat)
+        self.offsets = offsets
+        self.ways = ways  # positions of the ways
+        self.missing = missing  # sorted ids of the nodes not found
+        self._index = index
+
+    def __len__(self):
+        return len(self.ways)
+
+    @property
+    def index(self):
+        """Spatial index of the polylines' bounding boxes, built once."""
+        if self._index is None:
+            self._index = GridIndex.build(polyline_boxes(self.xy,
+                                                         self.offsets))
+        return self._index
+
+    def polyline(self, i):
+        """Coordinates of polyline i, an (n, 2) array."""
+        return self.xy[self.offsets[i]:self.offsets[i + 1]]
+
+    @classmethod
+    def build(cls, ways, xy, found):
+        """Build the polylines of an OsmWayStore.
+
+        Arguments xy and found are the coordinates of all the refs of the
+        ways, and which ones were found, see OsmNodeStore.coords().
+        """
+        counts = np.diff(ways.offsets)
+        owner = np.repeat(np.arange(len(ways)), counts)
+
+        # Drop the missing nodes, then the ways left with less than two
+        kept = np.bincount(owner[found], minlength=len(ways))
+        drawable = kept > 1
+        keep = found & drawable[owner]
+        offsets = np.zeros(np.count_nonzero(drawable) + 1, dtype=np.int64)
+        np.cumsum(kept[drawable], out=offsets[1:])
+        return cls(xy[keep], offsets, np.flatnonzero(drawable),
+                   np.unique(ways.refs[~found]))
+
+# End of osm_geometry.py
+#===============================================================================
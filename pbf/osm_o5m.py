@@ -0,0 +1,352 @@
+# pbf/osm_o5m.py - reading an OSM .o5m file
+
+"""The .o5m format, see journal.txt, is a sequence of datasets: a type byte,
+the length of the payload as a varint, then the payload. Types 0xf0 to 0xff
+are single bytes: 0xff resets the delta coding and the string table, 0xfe ends
+the file. The datasets of interest are nodes (0x10), ways (0x11), relations
+(0x12) and the file timestamp (0xdc).
+
+Numbers are varints, 7 bits per byte, least significant first, the high bit
+telling that more bytes follow. Signed numbers have their sign in the lowest
+bit, like protobuf's sint64. Ids, coordinates and refs are delta-coded, each
+with its own running value, which continues from one element to the next
+until a reset.
+
+Strings, tag keys and values, user names, member roles, are either inline,
+introduced by a 0 byte and terminated by 0 bytes, or a varint reference to the
+n-th last inline string, kept in a table of 15000 entries.
+
+The file is memory-mapped and read in a single pass. Since strings are mixed
+with numbers, the datasets are scanned one at a time, but the deltas are only
+collected along the way: the running sums are computed at the end, with NumPy,
+for all the elements at once. The refs of the ways, the bulk of a file, are
+not even read during the scan: the position of each way's ref section is
+noted, and all the sections are decoded together, see decode_varints().
+
+"""
+import mmap
+from array import array
+
+import numpy as np
+
+from spatial import ranges
+from .osm_builder import OsmDataFile, OsmStoreBuilder
+from .osm_pbf import make_offsets, take_runs, undelta_runs
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# File name suffix
+o5m_suffix = '.o5m'
+
+# Dataset types
+o5m_node = 0x10
+o5m_way = 0x11
+o5m_relation = 0x12
+o5m_timestamp = 0xdc
+o5m_header = 0xe0
+o5m_eof = 0xfe
+o5m_reset = 0xff
+
+# Size of the string table, and longest strings stored in it
+table_size = 15000
+table_max_len = 250
+
+# Member types are coded as the first character of the role
+member_types = {'0': 0, '1': 1, '2': 2}
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def is_o5m(filepath):
+    """Whether filepath is named like an .o5m file."""
+    return filepath.endswith(o5m_suffix)
+
+def read_varint(buf, p):
+    """Unsigned varint at position p of buf, and the position after it."""
+    b = buf[p]
+    if b < 0x80:
+        return b, p + 1
+    value = b & 0x7f
+    shift = 7
+    while True:
+        p += 1
+        b = buf[p]
+        value |= (b & 0x7f) << shift
+        if b < 0x80:
+            return value, p + 1
+        shift += 7
+
+def read_signed(buf, p):
+    """Signed varint at position p of buf, and the position after it."""
+    u, p = read_varint(buf, p)
+    return (u >> 1) ^ -(u & 1), p
+
+def decode_varints(data):
+    """Decode a uint8 array of consecutive varints, all of them at once.
+
+    Return the uint64 array of the values, and the position of the first
+    byte of each value.
+    """
+    data = np.asarray(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty(len(ends), dtype=np.int64)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    if len(ends) == 0:
+        return np.empty(0, dtype=np.uint64), starts
+    first = np.repeat(starts, ends - starts + 1)
+    shift = (np.arange(len(first)) - first)*7
+    values = (data[:len(first)] & 0x7f).astype(np.uint64) << \
+        shift.astype(np.uint64)
+    return np.add.reduceat(values, starts), starts
+
+def zigzag(values):
+    """Signed values of uint64 varints, see above."""
+    values = values.astype(np.int64)
+    return (values >> 1) ^ -(values & 1)
+
+#-------------------------------------------------------------------------------
+# O5mStringTable
+#-------------------------------------------------------------------------------
+
+class O5mStringTable:
+    """The table of the last inline strings, see above.
+
+    Entries are a string, or a (key, value) couple for pairs of strings.
+    """
+    def __init__(self):
+        self.entries = [None]*table_size
+        self.pos = 0
+
+    def reset(self):
+        self.pos = 0
+
+    def read(self, buf, p, pair=True):
+        """Read a string or a pair of strings at position p of buf.
+
+        Return the entry and the position after it.
+        """
+        if buf[p] != 0:
+            n, p = read_varint(buf, p)
+            return self.entries[(self.pos - n) % table_size], p
+        start = p + 1
+        end = buf.find(b'\0', start)
+        if pair:
+            end2 = buf.find(b'\0', end + 1)
+            entry = (buf[start:end].decode('utf-8', 'replace'),
+                     buf[end + 1:end2].decode('utf-8', 'replace'))
+            length = end2 - start - 1
+            end = end2
+        else:
+            entry = buf[start:end].decode('utf-8', 'replace')
+            length = end - start
+        if length <= table_max_len:
+            self.entries[self.pos % table_size] = entry
+            self.pos += 1
+        return entry, end + 1
+
+#-------------------------------------------------------------------------------
+# OsmO5mFile
+#-------------------------------------------------------------------------------
+
+class OsmO5mFile(OsmDataFile):
+    """Data of an .o5m file, see OsmDataFile."""
+
+    @classmethod
+    def build(cls, filepath, ways_only=False, tag_filter=None):
+        """Read an .o5m file.
+
+        With ways_only, or a tag_filter for the ways (see TagFilter), only
+        the nodes referenced by the ways are kept.
+        """
+        builder = OsmStoreBuilder(ways_only, tag_filter)
+        meta = {'seq_number': None, 'timestamp': None}
+        with open(filepath, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            scan = O5mScan(buf, builder)
+            scan.run()
+            meta['timestamp'] = scan.timestamp
+            scan.finish()
+        finally:
+            buf.close()
+        return cls(*builder.finish(), meta)
+
+#-------------------------------------------------------------------------------
+# O5mScan
+#-------------------------------------------------------------------------------
+
+class O5mScan:
+    """Single pass over the datasets of an .o5m file, see above.
+
+    Tags and relations go to the builder as they are read, node and way
+    columns are added by finish(), once their deltas are summed.
+    """
+    def __init__(self, buf, builder):
+        self.buf = buf
+        self.builder = builder
+        self.table = O5mStringTable()
+        self.timestamp = None
+        self.history = 0  # Running value of the element timestamps
+
+        # Deltas, and the number of them between resets. Deleted elements,
+        # in change files, and the ways the tag filter leaves out, have their
+        # deltas summed but are not kept.
+        self.node_deltas = array('q')  # (id, lon, lat) triples
+        self.node_keep = array('b')
+        self.node_runs = [0]
+        self.way_deltas = array('q')  # ids
+        self.way_keep = array('b')
+        self.way_runs = [0]
+        self.ref_sections = array('q')  # (offset, size) in buf
+        self.ref_runs = [0]  # bytes of ref sections between resets
+        self.rel_id = 0
+        self.member_ids = [0, 0, 0]  # One running value per member type
+
+    def reset(self):
+        self.table.reset()
+        self.history = 0
+        self.rel_id = 0
+        self.member_ids = [0, 0, 0]
+        for runs in (self.node_runs, self.way_runs, self.ref_runs):
+            runs.append(0)
+
+    def run(self):
+        buf = self.buf
+        p = 0
+        size = len(buf)
+        while p < size:
+            kind = buf[p]
+            p += 1
+            if kind >= 0xf0:
+                if kind == o5m_reset:
+                    self.reset()
+                elif kind == o5m_eof:
+                    break
+                continue
+            length, p = read_varint(buf, p)
+            end = p + length
+            if kind == o5m_node:
+                self.node(p, end)
+            elif kind == o5m_way:
+                self.way(p, end)
+            elif kind == o5m_relation:
+                self.relation(p, end)
+            elif kind == o5m_timestamp:
+                self.timestamp, _ = read_signed(buf, p)
+            elif kind == o5m_header and buf[p:end] not in (b'o5m2', b'o5c2'):
+                raise ValueError(f'Not an o5m file: {buf[p:end]}')
+            p = end
+
+    def author(self, p):
+        """Skip the version, timestamp, changeset and author of an element.
+        """
+        buf = self.buf
+        version, p = read_varint(buf, p)
+        if version != 0:
+            delta, p = read_signed(buf, p)
+            self.history += delta
+            if self.history != 0:
+                _, p = read_signed(buf, p)
+                _, p = self.table.read(buf, p)
+        return p
+
+    def tags(self, p, end):
+        """Tags from position p to the end of the dataset."""
+        tags = []
+        while p < end:
+            tag, p = self.table.read(self.buf, p)
+            tags.append(tag)
+        return tags
+
+    def node(self, p, end):
+        buf = self.buf
+        id_, p = read_signed(buf, p)
+        p = self.author(p)
+        self.node_runs[-1] += 1
+        if p == end:
+            # Deleted node, in a change file
+            self.node_deltas.extend((id_, 0, 0))
+            self.node_keep.append(False)
+            return
+        lon, p = read_signed(buf, p)
+        lat, p = read_signed(buf, p)
+        self.node_deltas.extend((id_, lon, lat))
+        self.node_keep.append(True)
+        # The tags are read anyway, for the strings they add to the table
+        self.builder.add_node_tags(self.tags(p, end))
+
+    def way(self, p, end):
+        buf = self.buf
+        id_, p = read_signed(buf, p)
+        self.way_deltas.append(id_)
+        self.way_runs[-1] += 1
+        p = self.author(p)
+        if p == end:
+            # Deleted way, in a change file
+            self.ref_sections.extend((p, 0))
+            self.way_keep.append(False)
+            return
+        size, p = read_varint(buf, p)
+        self.ref_sections.extend((p, size))
+        self.ref_runs[-1] += size
+        tags = self.tags(p + size, end)
+        b = self.builder
+        keep = b.tag_filter is None or b.tag_filter.match(dict(tags))
+        self.way_keep.append(keep)
+        if keep:
+            b.add_tags(b.way_tags, tags)
+
+    def relation(self, p, end):
+        buf = self.buf
+        delta, p = read_signed(buf, p)
+        self.rel_id += delta
+        p = self.author(p)
+        if p == end:
+            # Deleted relation, in a change file
+            return
+        members = []
+        size, p = read_varint(buf, p)
+        refs_end = p + size
+        while p < refs_end:
+            delta, p = read_signed(buf, p)
+            role, p = self.table.read(buf, p, pair=False)
+            type_ = member_types[role[:1]]
+            self.member_ids[type_] += delta
+            members.append((role[1:], self.member_ids[type_], type_))
+        self.builder.add_relation(self.rel_id, members, self.tags(p, end))
+
+    def finish(self):
+        """Sum the deltas of the nodes and ways, and add them to the builder.
+        """
+        # Nodes, coordinates are summed in 32 bits, see journal.txt
+        deltas = np.frombuffer(self.node_deltas, dtype=np.int64).reshape(-1, 3)
+        keep = np.frombuffer(self.node_keep, dtype=bool)
+        runs = self.node_runs
+        ids = undelta_runs(deltas[:, 0], runs)
+        lon = undelta_runs(deltas[:, 1], runs).astype(np.int32)
+        lat = undelta_runs(deltas[:, 2], runs).astype(np.int32)
+        self.builder.extend_nodes(ids[keep], lat[keep], lon[keep])
+
+        # Ways, the ref sections are decoded as one array of bytes, where
+        # the offsets of the sections and of the resets become offsets of
+        # refs once the starts of the varints are known
+        sections = np.frombuffer(self.ref_sections, dtype=np.int64) \
+            .reshape(-1, 2)
+        data = np.frombuffer(self.buf, dtype=np.uint8)[
+            ranges(sections[:, 0], sections[:, 1])]
+        values, starts = decode_varints(data)
+        offsets = np.searchsorted(starts, make_offsets(sections[:, 1]))
+        ref_runs = np.diff(np.searchsorted(starts,
+                                           make_offsets(self.ref_runs)))
+        refs = undelta_runs(zigzag(values), ref_runs)
+        ids = undelta_runs(self.way_deltas, self.way_runs)
+        keep = np.frombuffer(self.way_keep, dtype=bool)
+        offsets, refs = take_runs(offsets, keep, refs)
+        self.builder.extend_ways(ids[keep], np.diff(offsets), refs)
+
+# End of osm_o5m.py
+#===============================================================================
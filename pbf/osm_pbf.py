@@ -10,14 +10,39 @@ On a first level, the file can be seen a series of Blob structures, see
 pbf_blobs.py. The second level, implemented here, handles the OSM payloads
 extracted from the blobs.
 
+Since file blocks are independently decodable, they are decoded in a process
+pool: each worker decompresses and parses a block, and hands its nodes and
+ways back as NumPy arrays in shared memory, rather than as pickled objects.
+
+When only the ways are of interest, as in the viewer, the file is read in two
+passes: the first one decodes the ways, possibly filtered on their tags, and
+collects the ids of the nodes they reference; the second one decodes only
+those nodes.
+
+Tags of nodes and ways are kept as codes into the string table of their
+block, so that each string is decoded once per block, and a tag filter such as
+'highway=* waterway=river|stream' is evaluated on those codes, before the ways
+are built. The filter applies to ways only: the nodes kept are the ones the
+selected ways reference, whatever their tags, and the relations, few and
+needed whole to assemble multipolygons, are all built, with their tags as
+dictionaries of strings.
+
 """
 import os
 import sys
 import zlib
 import struct
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import chain, islice
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
 
-from .pbf_blobs import blob_structs
+from spatial import ranges
+from .osm_geometry import OsmWayGeometry
+from .pbf_blobs import OsmPbfBlob, OsmPbfBlobStruct, blob_structs, map_file
+from .pbf_index import OsmPbfBlockIndex, bbox_union
 from .osmformat_pb2 import HeaderBlock, PrimitiveBlock
 
 #-------------------------------------------------------------------------------
@@ -27,6 +52,14 @@ from .osmformat_pb2 import HeaderBlock, PrimitiveBlock
 # Indentation prefix
 indent = ' '*4
 
+# Below this number of file blocks, a process pool costs more than it saves
+min_parallel_blocks = 4
+
+# Nodes coordinates are stored in units of 1e-7 degrees (100 nanodegrees),
+# the precision of the OSM database
+nano_per_unit = 100
+degrees_per_unit = 1e-7
+
 #-------------------------------------------------------------------------------
 # Helpers
 #-------------------------------------------------------------------------------
@@ -112,26 +145,443 @@ class OsmRelation(OsmPrimitive):
         s += '\n'
         
         s_array = []
-        for role_sid, memid, type in self.array[:10]:
+        for role, memid, type in self.array[:10]:
             # Each of these must be on its own line
             t = ''
-            t += f'{indent*(level+1)}role={role_sid}'
+            t += f'{indent*(level+1)}role={role}'
             t += f', memid={memid}'
             t += f', type={type}'
             s_array.append(t)
         s += '\n'.join(s_array)
         return s
 
+#-------------------------------------------------------------------------------
+# Flat arrays helpers
+#-------------------------------------------------------------------------------
+
+def make_offsets(counts):
+    """Offsets of runs of lengths counts in a flat array, one more element."""
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+def take_runs(offsets, idx, *arrays):
+    """Keep runs idx of flat arrays, return the new offsets and arrays."""
+    starts = offsets[:-1][idx]
+    counts = offsets[1:][idx] - starts
+    pos = ranges(starts, counts)
+    return (make_offsets(counts),) + tuple(a[pos] for a in arrays)
+
+def concatenate_runs(offsets, *arrays):
+    """Concatenate lists of runs, return the new offsets and arrays.
+
+    Argument offsets is a list of offsets arrays, and each of the arrays a
+    list of flat arrays, one of each per part.
+    """
+    counts = np.concatenate([np.diff(o) for o in offsets])
+    return (make_offsets(counts),) + tuple(np.concatenate(a) for a in arrays)
+
+#-------------------------------------------------------------------------------
+# OsmTags
+#-------------------------------------------------------------------------------
+
+class OsmTags:
+    """Tags of a sequence of elements, as integer codes into a string table.
+
+    The keys of element i are keys[offsets[i]:offsets[i+1]], its values are
+    at the same positions in vals. When decoding a file block, the string
+    table is the block's own, so its strings are decoded once whatever the
+    number of tags referring to them. Merging tables interns the strings into
+    a single table, each block's codes being remapped with one array lookup.
+    """
+    def __init__(self, offsets, keys, vals, strings):
+        self.offsets = offsets
+        self.keys = keys
+        self.vals = vals
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def tags(self, i):
+        """Tags of element i, as a dictionary."""
+        st = self.strings
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return {st[k]: st[v] for k, v in zip(self.keys[a:b], self.vals[a:b])}
+
+    @classmethod
+    def build(cls, keys, vals, strings):
+        """Build from sequences of key and value sequences, one per element."""
+        offsets = make_offsets([len(k) for k in keys])
+        n = int(offsets[-1])
+        return cls(offsets,
+                   np.fromiter(chain.from_iterable(keys), np.int32, count=n),
+                   np.fromiter(chain.from_iterable(vals), np.int32, count=n),
+                   strings)
+
+    @classmethod
+    def empty(cls, n, strings=None):
+        """No tags for n elements."""
+        return cls(np.zeros(n + 1, dtype=np.int64), np.empty(0, np.int32),
+                   np.empty(0, np.int32), strings or [''])
+
+    @classmethod
+    def dense(cls, keys_vals, n, strings):
+        """Decode the keys_vals field of DenseNodes, for n nodes.
+
+        Each node has its (key, value) couples followed by a 0, or the field
+        is empty if no node in the block has tags.
+        """
+        kv = np.asarray(keys_vals, dtype=np.int32)
+        if len(kv) == 0:
+            return cls.empty(n, strings)
+        ends = np.flatnonzero(kv == 0)
+        counts = (np.diff(ends, prepend=-1) - 1)//2
+        codes = kv[kv != 0]
+        return cls(make_offsets(counts), codes[0::2], codes[1::2], strings)
+
+    def take(self, idx):
+        """Tags of the elements idx, an array of positions or a mask."""
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        offsets, keys, vals = take_runs(self.offsets, idx, self.keys,
+                                        self.vals)
+        return OsmTags(offsets, keys, vals, self.strings)
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Merge the tags of several sequences, interning their strings."""
+        table = {}
+        parts = list(parts)
+        keys = []
+        vals = []
+        for t in parts:
+            remap = np.array([table.setdefault(s, len(table))
+                              for s in t.strings], dtype=np.int32)
+            keys.append(remap[t.keys])
+            vals.append(remap[t.vals])
+        offsets, keys, vals = concatenate_runs([t.offsets for t in parts],
+                                               keys, vals)
+        return cls(offsets, keys, vals, list(table) or [''])
+
+    @staticmethod
+    def merge(stores):
+        """Tags of a list of stores, as one OsmTags, or None if none has any.
+        """
+        if all(s.tags is None for s in stores):
+            return None
+        return OsmTags.concatenate([s.tags if s.tags is not None else
+                                    OsmTags.empty(len(s)) for s in stores])
+
+#-------------------------------------------------------------------------------
+# TagFilter
+#-------------------------------------------------------------------------------
+
+class TagFilter:
+    """Tag filter expression, such as 'highway=*' or 'waterway=river|stream'.
+
+    An expression is a list of terms separated by commas or spaces, an element
+    matches if any of the terms matches one of its tags. A term is a key, and
+    either '*' for any value or values separated by '|'.
+
+    Filters are evaluated on the string codes of a whole group of elements at
+    once, so that the elements left out are never built. Only ways are
+    filtered this way, see OsmPbfPrimitiveGroup.build().
+    """
+    def __init__(self, terms):
+        self.terms = terms  # key -> set of values, or None for any value
+
+    def __repr__(self):
+        """Canonical expression, the same for all the equivalent filters."""
+        return ' '.join(f'{k}=*' if v is None else f'{k}=' + '|'.join(sorted(v))
+                        for k, v in sorted(self.terms.items()))
+
+    @classmethod
+    def make(cls, spec):
+        """Filter from a TagFilter, an expression or a terms dictionary, or
+        None.
+        """
+        if isinstance(spec, str):
+            return cls.parse(spec)
+        elif isinstance(spec, dict):
+            return cls(spec)
+        return spec
+
+    @classmethod
+    def parse(cls, expr):
+        """Build a filter from an expression, see above."""
+        terms = {}
+        for term in expr.replace(',', ' ').split():
+            key, sep, values = term.partition('=')
+            if sep == '' or values == '*':
+                terms[key] = None
+            elif key not in terms or terms[key] is not None:
+                terms[key] = terms.get(key) or set()
+                terms[key].update(values.split('|'))
+        return cls(terms)
+
+    def match(self, tags):
+        """True if the tags dictionary matches the filter."""
+        for key, values in self.terms.items():
+            value = tags.get(key)
+            if value is not None and (values is None or value in values):
+                return True
+        return False
+
+    def select(self, tags):
+        """Boolean array of the elements whose OsmTags match the filter."""
+        # Codes of the strings we need, in the tags' own table
+        wanted = set(self.terms)
+        for values in self.terms.values():
+            wanted |= values or set()
+        code = {s: i for i, s in enumerate(tags.strings) if s in wanted}
+
+        hit = np.zeros(len(tags.keys), dtype=bool)
+        for key, values in self.terms.items():
+            if key not in code:
+                continue
+            on_key = tags.keys == code[key]
+            if values is None:
+                hit |= on_key
+            else:
+                codes = [code[v] for v in values if v in code]
+                hit |= on_key & np.isin(tags.vals, codes)
+
+        # An element matches if any of its tags does
+        owner = np.repeat(np.arange(len(tags)), np.diff(tags.offsets))
+        keep = np.zeros(len(tags), dtype=bool)
+        keep[owner[hit]] = True
+        return keep
+
+#-------------------------------------------------------------------------------
+# OsmNodeStore
+#-------------------------------------------------------------------------------
+
+class OsmNodeStore:
+    """Nodes as arrays: sorted int64 ids, int32 lat and lon, and OsmTags.
+
+    A dictionary of OsmNode objects costs a few hundred bytes per node, this
+    costs 16, plus the tags. Coordinates are in units of 1e-7 degrees,
+    whatever the granularity of the file blocks, and converted to degrees when
+    they are read: OsmNode instances, coords() and bbox are all in degrees.
+    Lookups are done with a binary search on the ids, a whole array of them
+    at once, and OsmNode instances are only created on demand, so the store
+    can still be used like the node dictionary it replaces: store[id], id in
+    store, store.get(id), store.values().
+    """
+    def __init__(self, ids, lat, lon, tags=None):
+        self.ids = ids
+        self.lat = lat
+        self.lon = lon
+        self.tags = tags  # OsmTags, or None when not decoded
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id_):
+        return bool(self.lookup([id_])[1][0])
+
+    def __getitem__(self, id_):
+        pos, found = self.lookup([id_])
+        if not found[0]:
+            raise KeyError(id_)
+        return self.node(pos[0])
+
+    def get(self, id_, default=None):
+        try:
+            return self[id_]
+        except KeyError:
+            return default
+
+    def node(self, i):
+        """OsmNode instance for the node at position i."""
+        tags = self.tags.tags(i) if self.tags is not None else None
+        return OsmNode(int(self.ids[i]), tags,
+                       float(self.lat[i])*degrees_per_unit,
+                       float(self.lon[i])*degrees_per_unit)
+
+    def values(self):
+        """Generator of OsmNode instances, in id order."""
+        for i in range(len(self)):
+            yield self.node(i)
+
+    @classmethod
+    def build(cls, ids, lat, lon, tags=None):
+        """Build a store from sequences of ids and coordinates, in any order.
+
+        When a node id appears more than once, the last one wins.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        lat = np.asarray(lat, dtype=np.int32)
+        lon = np.asarray(lon, dtype=np.int32)
+        if len(ids) > 1 and not np.all(ids[1:] > ids[:-1]):
+            # Stable sort, then keep the last of each run of equal ids
+            order = np.argsort(ids, kind='stable')
+            last = np.append(ids[order][1:] != ids[order][:-1], True)
+            return cls(ids, lat, lon, tags).take(order[last])
+        return cls(ids, lat, lon, tags)
+
+    @classmethod
+    def concatenate(cls, stores):
+        """Merge stores, typically one per file block, into a single one."""
+        stores = list(stores)
+        if len(stores) == 0:
+            return cls.build([], [], [])
+        return cls.build(np.concatenate([s.ids for s in stores]),
+                         np.concatenate([s.lat for s in stores]),
+                         np.concatenate([s.lon for s in stores]),
+                         OsmTags.merge(stores))
+
+    def take(self, idx):
+        """Store holding the nodes idx, an array of positions or a mask."""
+        tags = self.tags.take(idx) if self.tags is not None else None
+        return OsmNodeStore(self.ids[idx], self.lat[idx], self.lon[idx], tags)
+
+    def select(self, ids):
+        """Store holding only the nodes whose id is in sorted array ids."""
+        if len(ids) == 0:
+            return self.take(np.empty(0, dtype=np.int64))
+        pos = np.searchsorted(ids, self.ids)
+        pos[pos == len(ids)] = 0
+        return self.take(ids[pos] == self.ids)
+
+    def lookup(self, refs):
+        """Positions of node ids refs in the store, all of them at once.
+
+        Return the positions and a boolean array telling which ids were found,
+        the positions of the missing ones are meaningless.
+        """
+        refs = np.asarray(refs, dtype=np.int64)
+        if len(self) == 0:
+            return (np.zeros(len(refs), dtype=np.int64),
+                    np.zeros(len(refs), dtype=bool))
+        pos = np.searchsorted(self.ids, refs)
+        pos[pos == len(self)] = 0
+        return pos, self.ids[pos] == refs
+
+    def coords(self, refs):
+        """Coordinates of node ids refs, as an (n, 2) array of (lon, lat) in
+        degrees.
+
+        Also return the boolean array of the ids found, the coordinates of the
+        missing ones are NaN.
+        """
+        pos, found = self.lookup(refs)
+        xy = np.column_stack([self.lon[pos], self.lat[pos]]).astype(np.float64)
+        xy *= degrees_per_unit
+        xy[~found] = np.nan
+        return xy, found
+
+    @property
+    def bbox(self):
+        """Bounding box (lat_min, lat_max, lon_min, lon_max) in degrees, or
+        None.
+        """
+        if len(self) == 0:
+            return None
+        return (float(self.lat.min())*degrees_per_unit,
+                float(self.lat.max())*degrees_per_unit,
+                float(self.lon.min())*degrees_per_unit,
+                float(self.lon.max())*degrees_per_unit)
+
+#-------------------------------------------------------------------------------
+# OsmWayStore
+#-------------------------------------------------------------------------------
+
+class OsmWayStore:
+    """Ways as arrays: int64 ids, the refs of all the ways in one array, and
+    OsmTags.
+
+    The refs of way i are refs[offsets[i]:offsets[i+1]]. The store can be used
+    like the list of OsmWay it replaces, OsmWay instances being created on
+    demand: len(ways), ways[i], ways[i:j], iteration.
+    """
+    def __init__(self, ids, offsets, refs, tags=None):
+        self.ids = ids
+        self.offsets = offsets
+        self.refs = refs
+        self.tags = tags  # OsmTags, or None when not decoded
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.way(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.way(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.way(i)
+
+    def way(self, i):
+        """OsmWay instance for the way at position i."""
+        tags = self.tags.tags(i) if self.tags is not None else None
+        return OsmWay(int(self.ids[i]), tags,
+                      self.refs[self.offsets[i]:self.offsets[i + 1]])
+
+    @classmethod
+    def build(cls, ids, refs, tags=None):
+        """Build a store from a sequence of ids and one of refs sequences."""
+        offsets = make_offsets([len(r) for r in refs])
+        flat = np.fromiter(chain.from_iterable(refs), dtype=np.int64,
+                           count=offsets[-1])
+        return cls(np.asarray(ids, dtype=np.int64), offsets, flat, tags)
+
+    def select(self, keep):
+        """Store holding only the ways for which boolean array keep is True."""
+        offsets, refs = take_runs(self.offsets, keep, self.refs)
+        tags = self.tags.take(keep) if self.tags is not None else None
+        return OsmWayStore(self.ids[keep], offsets, refs, tags)
+
+    @classmethod
+    def concatenate(cls, stores):
+        """Merge stores, in order, into a single one."""
+        stores = list(stores)
+        if len(stores) == 0:
+            return cls.build([], [])
+        offsets, ids, refs = concatenate_runs([s.offsets for s in stores],
+                                              [s.ids for s in stores],
+                                              [s.refs for s in stores])
+        return cls(ids, offsets, refs, OsmTags.merge(stores))
+
 #-------------------------------------------------------------------------------
 # undelta
 #-------------------------------------------------------------------------------
 
 def undelta(array):
-    """Remove delta-coding from the input array, creating a new array."""
-    newarr = [array[0]]
-    for j, x in enumerate(array[1:]):
-        newarr.append(newarr[j] + x)
-    return newarr
+    """Remove delta-coding from the input array, creating a new int64 array.
+
+    Argument array is any sequence of integers, typically a protobuf repeated
+    field. Sums are done in 64 bits, see journal.txt about 32 bit deltas.
+    """
+    return np.cumsum(np.asarray(array, dtype=np.int64))
+
+def undelta_runs(array, counts):
+    """Remove delta-coding from consecutive runs of array, of lengths counts.
+
+    Each run is delta-coded on its own, like the refs of the ways of a group:
+    the running sum over the whole array is computed once, then the sum before
+    each run is subtracted from its elements.
+    """
+    total = undelta(array)
+    counts = np.asarray(counts, dtype=np.int64)
+    ends = np.cumsum(counts)
+    before = np.concatenate([[0], total])[ends - counts]
+    return total - np.repeat(before, counts)
+
+def to_units(raw, granularity, offset):
+    """Convert a block's raw coordinates to int32 units of 1e-7 degrees.
+
+    The coordinate in nanodegrees is offset + granularity*raw, see
+    osmformat.proto, rounded to the nearest unit.
+    """
+    nano = offset + granularity*np.asarray(raw, dtype=np.int64)
+    return ((nano + nano_per_unit//2)//nano_per_unit).astype(np.int32)
 
 #-------------------------------------------------------------------------------
 # OsmPbfPrimitiveGroup
@@ -143,65 +593,106 @@ class OsmPbfPrimitiveGroup:
     All primitives in a group must be the same type, either nodes, ways,
     relation, or changesets.
     """
-    def __init__(self, elem, primitives, bbox=None):
-        # Array of OSMPrimitives, all of the same type
+    def __init__(self, elem, primitives, bbox=None, id_range=None):
+        # Array of OSMPrimitives, all of the same type, or an OsmNodeStore
         self.elem = elem
         self.primitives = primitives
+        # Bounding box of the nodes, and (min, max) of the ids, both for all
+        # the elements of the group, including the ones left out
         self.bbox = bbox
+        self.id_range = id_range
 
     def show(self, level):
         # Dictionary of nodes, arrays of ways and relations
-        prims = list(self.primitives.values())[:10] if self.elem == 'node' \
-            else self.primitives[:10]
+        prims = list(islice(self.primitives.values(), 10)) \
+            if self.elem == 'node' else self.primitives[:10]
 
         return '\n'.join([p.show(level) for p in prims])
 
+    @staticmethod
+    def kind(pg):
+        """Kind of the elements in protobuf PrimitiveGroup pg, or None."""
+        if len(pg.nodes) > 0 or pg.HasField('dense') and len(pg.dense.id) > 0:
+            return 'node'
+        elif len(pg.ways) > 0:
+            return 'way'
+        elif len(pg.relations) > 0:
+            return 'rel'
+        return None
+
     @classmethod
-    def build(cls, pg):
+    def build(cls, pg, granularity=100, lat_offset=0, lon_offset=0,
+              string_table=None, node_ids=None, tag_filter=None):
         """pg is a protobuf PrimitiveGroup message.
 
         The docs say "All primitives in a group must be the same type".
+        The next arguments come from the enclosing block, they define how
+        node coordinates are stored, and the strings the tags refer to.
+        Argument node_ids is a sorted array, when present only the nodes with
+        these ids are kept, and tag_filter, a TagFilter, an expression or a
+        terms dictionary, filters the ways on their tags before they are built.
+
+        The tags of nodes and ways are decoded as OsmTags codes. Groups of
+        nodes and relations are not filtered on their tags: nodes are selected
+        by node_ids, the refs of the ways kept, and relations are built with
+        their tags as dictionaries of strings.
         """
-        if len(pg.nodes) > 0 or pg.HasField('dense') and len(pg.dense.id) > 0:
-            # Group of nodes            
+        kind = cls.kind(pg)
+        tag_filter = TagFilter.make(tag_filter)
+        if kind == 'node':
+            # Group of nodes
             if len(pg.nodes) > 0:
                 # Normal
-                nodes = {x.id: OsmNode(x.id, None, x.lat, x.lon) for x in pg.nodes}
+                ids = [x.id for x in pg.nodes]
+                lat = [x.lat for x in pg.nodes]
+                lon = [x.lon for x in pg.nodes]
+                tags = OsmTags.build([x.keys for x in pg.nodes],
+                                     [x.vals for x in pg.nodes], string_table)
             else:
-                # Delta-coded
-                nodes = {id: OsmNode(id, None, lat, lon)
-                         for id, lat, lon in zip(undelta(pg.dense.id),
-                                                 undelta(pg.dense.lat),
-                                                 undelta(pg.dense.lon))}
-            # Bounding box
-            lat_min, lat_max, lon_min, lon_max = 9_999_999_999, \
-                -9_999_999_999, 9_999_999_999, -9_999_999_999
-            for n in nodes.values():
-                if n.lat < lat_min:
-                    lat_min = n.lat
-                if n.lat > lat_max:
-                    lat_max = n.lat
-                if n.lon < lon_min:
-                    lon_min = n.lon
-                if n.lon > lon_max:
-                    lon_max = n.lon
-            bbox = lat_min, lat_max, lon_min, lon_max
-                    
-            return cls('node', nodes, bbox)
-
-        elif len(pg.ways) > 0:
-            # Group of ways
-            # FIXME undelta code the refs here
-            ways = [OsmWay(x.id, None, undelta(x.refs)) for x in pg.ways]
-            return cls('way', ways)
-
-        elif len(pg.relations) > 0:
-            # Group of relations, delta-coded
+                # Delta-coded, the tags of all the nodes in a single array
+                ids = undelta(pg.dense.id)
+                lat = undelta(pg.dense.lat)
+                lon = undelta(pg.dense.lon)
+                tags = OsmTags.dense(pg.dense.keys_vals, len(ids),
+                                     string_table)
+            nodes = OsmNodeStore.build(ids,
+                                       to_units(lat, granularity, lat_offset),
+                                       to_units(lon, granularity, lon_offset),
+                                       tags)
+            bbox, id_range = nodes.bbox, (int(nodes.ids[0]), int(nodes.ids[-1]))
+            if node_ids is not None:
+                nodes = nodes.select(node_ids)
+            return cls('node', nodes, bbox, id_range)
+
+        elif kind == 'way':
+            # Group of ways, the refs of each way are delta-coded
+            tags = OsmTags.build([x.keys for x in pg.ways],
+                                 [x.vals for x in pg.ways], string_table)
+            offsets = make_offsets([len(x.refs) for x in pg.ways])
+            refs = np.fromiter(chain.from_iterable(x.refs for x in pg.ways),
+                               dtype=np.int64, count=offsets[-1])
+            ways = OsmWayStore(np.array([x.id for x in pg.ways],
+                                        dtype=np.int64),
+                               offsets, undelta_runs(refs, np.diff(offsets)),
+                               tags)
+            id_range = int(ways.ids.min()), int(ways.ids.max())
+            if tag_filter is not None:
+                ways = ways.select(tag_filter.select(tags))
+            return cls('way', ways, id_range=id_range)
+
+        elif kind == 'rel':
+            # Group of relations, delta-coded, roles are decoded as they are
+            # needed to assemble multipolygons
+            st = string_table
             relations = []
             for rel in pg.relations:
-                array = list(zip(rel.roles_sid, undelta(rel.memids), rel.types))
-                relations.append(OsmRelation(rel.id, None, array))
-            return cls('rel', relations)
+                tags = {st[k]: st[v] for k, v in zip(rel.keys, rel.vals)}
+                roles = [st[r] for r in rel.roles_sid]
+                array = list(zip(roles, undelta(rel.memids).tolist(),
+                                 rel.types))
+                relations.append(OsmRelation(rel.id, tags, array))
+            ids = [r.id_ for r in relations]
+            return cls('rel', relations, id_range=(min(ids), max(ids)))
 
 #-------------------------------------------------------------------------------
 # OsmPbfPrimitiveBlock
@@ -210,7 +701,7 @@ class OsmPbfPrimitiveGroup:
 class OsmPbfPrimitiveBlock:
     """This is what the docs call a file block, independently decodable."""
     def __init__(self, string_table, groups, granularity, lat_offset,
-                 lon_offset, date_granularity, elems):
+                 lon_offset, date_granularity, elems, skipped=None):
         self.string_table = string_table
         self.groups = groups
         self.granularity = granularity
@@ -218,6 +709,8 @@ class OsmPbfPrimitiveBlock:
         self.lon_offset = lon_offset
         self.date_granularity = date_granularity
         self.elems = elems
+        # Kinds of elements present in the block, but not decoded
+        self.skipped = skipped or set()
 
     def show(self, level):
         s = ''
@@ -237,36 +730,212 @@ class OsmPbfPrimitiveBlock:
         return s
 
     @classmethod
-    def build(cls, blob):
+    def build(cls, blob, **kwargs):
         """Argument blob is an instance of OsmPbfBlobStruct where the type in the
-        BlobHeader is OSMData.
+        BlobHeader is OSMData. See parse() for the keyword arguments.
+        """
+        return cls.parse(blob.get_data(), **kwargs)
+
+    @classmethod
+    def parse(cls, data, elems=None, node_ids=None, tag_filter=None):
+        """Argument data is the decompressed payload of an OSMData blob.
+
+        Only the groups of the kinds in elems ('node', 'way', 'rel') are
+        decoded, None is all of them; node_ids and tag_filter select nodes and
+        ways, see OsmPbfPrimitiveGroup.build().
         """
-        has_node = has_way = has_rel = False
-        
         prim_blk = PrimitiveBlock()
-        prim_blk.ParseFromString(blob.get_data())
+        prim_blk.ParseFromString(data)
 
         # Extract the string table and factory-build instance of primitive groups
-        string_table = prim_blk.stringtable.s
-
-        groups = [OsmPbfPrimitiveGroup.build(pg)
-                  for pg in prim_blk.primitivegroup]
+        string_table = [x.decode('utf-8') for x in prim_blk.stringtable.s]
+
+        groups = []
+        skipped = set()
+        for pg in prim_blk.primitivegroup:
+            kind = OsmPbfPrimitiveGroup.kind(pg)
+            if elems is not None and kind not in elems:
+                # Groups of changesets, or empty ones, hold nothing to skip
+                if kind is not None:
+                    skipped.add(kind)
+                continue
+            groups.append(OsmPbfPrimitiveGroup.build(
+                pg, prim_blk.granularity, prim_blk.lat_offset,
+                prim_blk.lon_offset, string_table, node_ids, tag_filter))
 
         # Mark the block according to the group contents
-        elems = set()
+        decoded = set()
         for g in groups:
             if g.elem == 'node':
-                elems.add('node')
+                decoded.add('node')
             elif g.elem == 'way':
-                elems.add('way')
+                decoded.add('way')
             elif g.elem == 'rel':
-                elems.add('rel')
+                decoded.add('rel')
 
         # FIXME optional fields
         return cls(string_table, groups, prim_blk.granularity,
                    prim_blk.lat_offset, prim_blk.lon_offset,
-                   prim_blk.date_granularity, elems)
+                   prim_blk.date_granularity, decoded, skipped)
+
+    @classmethod
+    def empty(cls, skipped):
+        """Block not decoded at all, holding elements of the kinds skipped."""
+        return cls([], [], 100, 0, 0, 1000, set(), set(skipped))
+
+    def summary(self):
+        """Id ranges of the kinds of elements decoded, and bbox of the nodes.
+
+        Return a dictionary with 'ids', mapping kinds to (min, max), and
+        'node_bbox', (min_lat, max_lat, min_lon, max_lon) in degrees or None.
+        """
+        ids = {}
+        bbox = None
+        for g in self.groups:
+            if g.id_range is not None:
+                lo, hi = ids.get(g.elem, g.id_range)
+                ids[g.elem] = min(lo, g.id_range[0]), max(hi, g.id_range[1])
+            bbox = bbox_union(bbox, g.bbox)
+        return {'ids': ids, 'node_bbox': bbox}
+
+    def merge(self, other):
+        """Add the groups decoded from the same block by another pass.
+
+        Node groups come first, as they do in the files.
+        """
+        self.groups = [g for g in other.groups if g.elem == 'node'] + \
+            self.groups + [g for g in other.groups if g.elem != 'node']
+        self.elems |= other.elems
+        self.skipped -= other.elems
+        return self
         
+#-------------------------------------------------------------------------------
+# Parallel decoding
+#-------------------------------------------------------------------------------
+
+# Worker processes keep their mapping of the file from one block to the next
+_buffers = {}
+
+# Shared memory segments created by a worker process, on Windows only
+_segments = []
+
+# Ids of the nodes to keep, set once per worker process, see init_worker()
+_node_ids = None
+
+def init_worker(node_ids):
+    """Worker process initializer, for the arguments shared by all blocks."""
+    global _node_ids
+    _node_ids = node_ids
+
+def decode_block(filepath, offset, size, elems=None, tag_filter=None):
+    """Decode a file block in a worker process, see decode_blocks().
+
+    The Blob message is read from the memory-mapped file at offset, and the
+    block is returned by to_shared().
+    """
+    if filepath not in _buffers:
+        _buffers[filepath] = map_file(filepath)
+    blob = OsmPbfBlob.build(_buffers[filepath][offset:offset + size])
+    block = OsmPbfPrimitiveBlock.parse(blob.get_data(), elems, _node_ids,
+                                       tag_filter)
+    return to_shared(block)
+
+def block_arrays(block):
+    """The arrays of a block's node and way stores, and of their tags.
+
+    Generator of (group index, store attribute name, array) triples, the
+    attribute names of the tags arrays are dotted, like 'tags.keys'. The
+    string tables of the tags are small, they are pickled with the block.
+    """
+    for i, grp in enumerate(block.groups):
+        if isinstance(grp.primitives, OsmNodeStore):
+            names = ['ids', 'lat', 'lon']
+        elif isinstance(grp.primitives, OsmWayStore):
+            names = ['ids', 'offsets', 'refs']
+        else:
+            continue
+        if grp.primitives.tags is not None:
+            names += ['tags.offsets', 'tags.keys', 'tags.vals']
+        for name in names:
+            obj, attr = attr_owner(grp.primitives, name)
+            yield i, name, getattr(obj, attr)
+
+def attr_owner(store, name):
+    """Object holding the dotted attribute name of store, and the last name.
+    """
+    *path, attr = name.split('.')
+    for p in path:
+        store = getattr(store, p)
+    return store, attr
+
+def to_shared(block):
+    """Move the arrays of a block into a new shared memory segment.
+
+    Return the segment name, the layout of the arrays in it as a list of
+    (group index, attribute name, dtype, shape, offset), and the block
+    stripped of its arrays, which is small and cheap to pickle.
+    """
+    arrays = list(block_arrays(block))
+    layout = []
+    pos = 0
+    for i, name, a in arrays:
+        layout.append((i, name, a.dtype.str, a.shape, pos))
+        pos += (a.nbytes + 7)//8*8  # Keep every array 8-byte aligned
+
+    shm = shared_memory.SharedMemory(create=True, size=max(pos, 1))
+    for (i, name, a), (_, _, dtype, shape, offset) in zip(arrays, layout):
+        np.ndarray(shape, dtype, shm.buf, offset)[...] = a
+        setattr(*attr_owner(block.groups[i].primitives, name), None)
+
+    # On Windows the segment vanishes with its last handle, so the worker
+    # keeps it until it exits, after the main process has read it
+    if os.name == 'nt':
+        _segments.append(shm)
+    else:
+        shm.close()
+    return shm.name, layout, block
+
+def from_shared(name, layout, block):
+    """Put back the arrays of a block returned by to_shared(), free the memory.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        for i, attr, dtype, shape, offset in layout:
+            a = np.ndarray(shape, dtype, shm.buf, offset).copy()
+            setattr(*attr_owner(block.groups[i].primitives, attr), a)
+    finally:
+        shm.close()
+        shm.unlink()
+    return block
+
+def decode_blocks(filepath, blobs, workers=None, elems=None, node_ids=None,
+                  tag_filter=None):
+    """Decode the OSMData blobs of a file into OsmPbfPrimitiveBlock instances.
+
+    Argument blobs is an iterable of OsmPbfBlobStruct instances, only their
+    offsets and sizes are used. The blocks are decoded by a pool of workers
+    processes, and returned in file order. Small files, or workers=1, are
+    decoded in this process. See OsmPbfPrimitiveBlock.parse() for the other
+    arguments.
+    """
+    blobs = list(blobs)
+    workers = workers or os.cpu_count() or 1
+    if workers < 2 or len(blobs) < min_parallel_blocks:
+        return [OsmPbfPrimitiveBlock.build(b, elems=elems, node_ids=node_ids,
+                                           tag_filter=tag_filter)
+                for b in blobs]
+
+    # Workers must share our resource tracker, which frees the segments
+    # left over if anything goes wrong
+    resource_tracker.ensure_running()
+    n = len(blobs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(node_ids,)) as pool:
+        results = pool.map(decode_block, [filepath]*n,
+                           [b.offset for b in blobs], [b.size for b in blobs],
+                           [elems]*n, [tag_filter]*n)
+        return [from_shared(*r) for r in results]
+
 #-------------------------------------------------------------------------------
 # OsmPbfHeaderBlock
 #-------------------------------------------------------------------------------
@@ -358,12 +1027,19 @@ class OsmPbfFile:
 
     """
     def __init__(self, header_block, primitive_blocks, first_way, first_rel,
-                 node_dict):
+                 node_dict, index=None):
+        # node_dict is an OsmNodeStore, indexed by node id like a dictionary
         self.header_block = header_block
         self.primitive_blocks = primitive_blocks
         self.first_way = first_way
         self.first_rel = first_rel
         self.node_dict = node_dict
+        self.index = index  # OsmPbfBlockIndex, or None
+        self._ways = None
+        self._geometry = None
+        self._relations = None
+        self.areas = None  # OsmAreas, see osm_areas.py
+        self._bbox = None
 
     def show(self):
         s = ''
@@ -375,37 +1051,148 @@ class OsmPbfFile:
         return s
 
     @classmethod
-    def build(cls, filepath):
-        g = blob_structs(filepath)
+    def build(cls, filepath, workers=None, ways_only=False, tag_filter=None):
+        """Read an OSM .pbf file, decoding its blocks with workers processes.
+
+        With ways_only, or a tag_filter for the ways (see TagFilter), the
+        file is read in two passes, and only the nodes referenced by the ways
+        are kept.
+
+        The blocks are found in the file's index when it has one, see
+        OsmPbfBlockIndex, and the index is written otherwise, without the
+        bboxes of the ways when they're filtered. Blocks that the index shows
+        to be of no use are left undecoded.
+        """
+        index = OsmPbfBlockIndex.load(filepath)
+        if index is None:
+            g = blob_structs(filepath)
+            header = next(g)
+            blobs = list(g)
+        else:
+            buf = map_file(filepath)
+            header = OsmPbfBlobStruct.at(buf, *index.header, 'OSMHeader')
+            blobs = [OsmPbfBlobStruct.at(buf, int(b['offset']), int(b['size']))
+                     for b in index.blocks]
 
         # First blob in the file is a HeaderBlock
-        hdr = OsmPbfHeaderBlock.build(next(g))
-
-        # FIXME can I do a list comprehension skipping the first element ? 
-        array = []
-        d = {}
-        while True:
-            # Following blocks are PrimitiveBlocks
-            try:
-                b = OsmPbfPrimitiveBlock.build(next(g))
-            except StopIteration:
-                break
-
-            # Accumulate node dictionaries
-            if 'node' in b.elems:
-                grp = b.groups[0]
-                # g.primitives is a dictionary of nodes
-                d.update(grp.primitives)
-            
-            # Save the indexes of the first blocks with ways and relations
-            if 'node' in b.elems and 'way' in b.elems:
-                first_way = len(array)
-            if 'way' in b.elems and 'rel' in b.elems:
-                first_rel = len(array)
+        hdr = OsmPbfHeaderBlock.build(header)
+
+        # Following blocks are PrimitiveBlocks
+        if ways_only or tag_filter is not None:
+            blocks = cls.decode_two_pass(filepath, blobs, workers,
+                                         tag_filter, index)
+        else:
+            blocks = decode_blocks(filepath, blobs, workers)
+
+        # Accumulate node stores
+        stores = [g.primitives for b in blocks for g in b.groups
+                  if g.elem == 'node']
+        f = cls(hdr, blocks, None, None, OsmNodeStore.concatenate(stores),
+                index)
+
+        # The blocks, their kinds and id ranges are always indexed, the bbox
+        # of the ways needs all of them, without a tag filter
+        if index is None:
+            f.index = OsmPbfBlockIndex.build(
+                header, blobs, [f.block_summary(b) for b in blocks],
+                way_bbox=tag_filter is None)
+            f.index.save(filepath)
+        elif tag_filter is None and not index.way_bbox:
+            index.set_way_bboxes([f.block_summary(b)['way_bbox']
+                                  for b in blocks])
+            index.save(filepath)
+
+        # Indexes of the first blocks with ways and relations
+        if f.index is not None:
+            f.first_way = f.index.first('way')
+            f.first_rel = f.index.first('rel')
+        else:
+            kinds = [b.elems | b.skipped for b in blocks]
+            f.first_way = next((i for i, k in enumerate(kinds)
+                                if 'way' in k), None)
+            f.first_rel = next((i for i, k in enumerate(kinds)
+                                if 'rel' in k), None)
+        return f
+
+    @staticmethod
+    def read_nodes(filepath, node_ids, index, workers=None):
+        """Read the nodes node_ids, a sorted array, from the file.
 
-            array.append(b)
+        Only the blocks that the index shows may hold some of them are
+        decoded.
+        """
+        buf = map_file(filepath)
+        blobs = [OsmPbfBlobStruct.at(buf, int(b['offset']), int(b['size']))
+                 for b in index.blocks[index.holding(node_ids)]]
+        blocks = decode_blocks(filepath, blobs, workers, elems={'node'},
+                               node_ids=node_ids)
+        return OsmNodeStore.concatenate(g.primitives for b in blocks
+                                        for g in b.groups if g.elem == 'node')
 
-        return cls(hdr, array, first_way, first_rel, d)
+    @staticmethod
+    def read_relations(filepath, index, workers=None):
+        """Read all the relations of the file.
+
+        Only the blocks that the index shows to hold relations are decoded.
+        """
+        buf = map_file(filepath)
+        blobs = [OsmPbfBlobStruct.at(buf, int(b['offset']), int(b['size']))
+                 for b in index.blocks[index.has('rel')]]
+        blocks = decode_blocks(filepath, blobs, workers, elems={'rel'})
+        return [r for b in blocks for g in b.groups if g.elem == 'rel'
+                for r in g.primitives]
+
+    @staticmethod
+    def decode_two_pass(filepath, blobs, workers, tag_filter, index=None):
+        """Decode the ways, then only the nodes they reference.
+
+        Peak memory is bounded by the selected ways and their nodes, plus the
+        blocks being decoded. With an index, the blocks without ways or
+        relations are not decoded in the first pass, nor the blocks whose
+        node ids are all out of the range of the referenced nodes in the
+        second one.
+        """
+        # Pass one: ways, and relations which are few
+        if index is None:
+            todo = list(range(len(blobs)))
+        else:
+            todo = np.flatnonzero(index.has('way') | index.has('rel'))
+        decoded = decode_blocks(filepath, [blobs[i] for i in todo], workers,
+                                elems={'way', 'rel'}, tag_filter=tag_filter)
+        blocks = [OsmPbfPrimitiveBlock.empty({'node'}) for _ in blobs]
+        for i, b in zip(todo, decoded):
+            blocks[i] = b
+        refs = [g.primitives.refs for b in blocks for g in b.groups
+                if g.elem == 'way']
+        node_ids = np.unique(np.concatenate(refs + [np.empty(0, np.int64)]))
+
+        # Pass two: the selected nodes, from the blocks that have nodes
+        if index is None:
+            todo = [i for i, b in enumerate(blocks) if 'node' in b.skipped]
+        else:
+            todo = np.flatnonzero(index.holding(node_ids))
+        nodes = decode_blocks(filepath, [blobs[i] for i in todo], workers,
+                              elems={'node'}, node_ids=node_ids)
+        for i, b in zip(todo, nodes):
+            blocks[i].merge(b)
+        return blocks
+
+    def block_summary(self, block):
+        """Summary of a decoded block for the index, see OsmPbfBlockIndex.
+
+        The bbox of the ways of a block is that of their nodes.
+        """
+        summary = block.summary()
+        summary['way_bbox'] = None
+        refs = [g.primitives.refs for g in block.groups if g.elem == 'way']
+        if len(refs) > 0:
+            xy, found = self.node_dict.coords(np.concatenate(refs))
+            if found.any():
+                lon, lat = xy[found].min(axis=0)
+                lon_max, lat_max = xy[found].max(axis=0)
+                summary['way_bbox'] = (float(lat), float(lat_max),
+                                       float(lon), float(lon_max))
+        return summary
 
     @staticmethod
     def bbox_union(b1, b2):
@@ -417,30 +1204,42 @@ class OsmPbfFile:
 
     @property
     def bbox(self):
-        """Bounding box of this file's nodes."""
-        # FIXME should be the bounding box of the ways
-        # Initialize min,max bbox
-        bbox0 = 9_999_999_999, -9_999_999_999, 9_999_999_999, -9_999_999_999
-        for b in self.primitive_blocks:
-            for g in b.groups:
-                if g.elem == 'node':
-                    bbox0 = OsmPbfFile.bbox_union(bbox0, g.bbox)
-        return bbox0
+        """Bounding box of this file's ways, from the index when possible."""
+        if self._bbox is None:
+            if self.index is not None:
+                self._bbox = self.index.bbox
+            else:
+                self._bbox = self.node_dict.bbox
+        return self._bbox
 
     @property
     def ways(self):
-        arr = []
-        
-        # First block is special
-        g = self.primitive_blocks[self.first_way].groups[1]
-        arr.extend(g.primitives)
+        """All the ways of the file, as an OsmWayStore."""
+        if self._ways is None:
+            self._ways = OsmWayStore.concatenate(
+                g.primitives for b in self.primitive_blocks
+                for g in b.groups if g.elem == 'way')
+        return self._ways
 
-        for b in self.primitive_blocks[self.first_way+1:self.first_rel]:
-            arr.extend(b.groups[0].primitives)
+    @property
+    def relations(self):
+        """All the relations of the file, as a list of OsmRelation."""
+        if self._relations is None:
+            self._relations = [r for b in self.primitive_blocks
+                               for g in b.groups if g.elem == 'rel'
+                               for r in g.primitives]
+        return self._relations
+
+    @property
+    def geometry(self):
+        """Polylines of all the ways of the file, as an OsmWayGeometry.
 
-        # FIXME what a drawing model needs is an array of points, maybe this
-        # could simply generate an array of (lon, lat)
-        return arr
+        The refs of all the ways are resolved at once, the first time.
+        """
+        if self._geometry is None:
+            self._geometry = OsmWayGeometry.build(
+                self.ways, *self.node_dict.coords(self.ways.refs))
+        return self._geometry
 
 # End of osm_pbf.py
 #===============================================================================
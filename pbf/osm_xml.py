@@ -0,0 +1,121 @@
+# pbf/osm_xml.py - reading an OSM XML file
+
+"""OSM XML is the original format of OSM data: an <osm> root element, then
+<node>, <way> and <relation> elements, in that order, each with its <tag>
+children, plus the <nd> refs of ways and the <member> elements of relations.
+
+The file is read with iterparse, one element at a time. Each node, way and
+relation is handed to an OsmStoreBuilder as soon as it ends, then the root is
+cleared, so that the parsed tree never holds more than one element: memory
+stays proportional to the arrays being built, whatever the size of the file.
+
+Compressed files, .osm.bz2 and .osm.gz, are decompressed as they are read,
+never as a whole.
+
+"""
+import os
+import bz2
+import gzip
+from datetime import datetime, timezone
+from xml.etree.ElementTree import iterparse
+
+from .osm_builder import OsmDataFile, OsmStoreBuilder
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# File name suffixes
+xml_suffixes = ('.osm', '.osm.bz2', '.osm.gz')
+
+# Compression suffixes, and how to open such files
+openers = {'.bz2': bz2.open, '.gz': gzip.open}
+
+# Member types, as in osmformat.proto
+member_types = {'node': 0, 'way': 1, 'relation': 2}
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def is_osm_xml(filepath):
+    """Whether filepath is named like an OSM XML file."""
+    return filepath.endswith(xml_suffixes)
+
+def open_xml(filepath):
+    """Open an XML file for binary reading, decompressing it on the fly."""
+    opener = openers.get(os.path.splitext(filepath)[1], open)
+    return opener(filepath, 'rb')
+
+def to_units(s):
+    """Coordinate in units of 1e-7 degrees, from a string in degrees."""
+    return round(float(s)*1e7)
+
+def to_seconds(s):
+    """Seconds since the epoch of an OSM timestamp, '2024-05-01T10:00:00Z',
+    as in the header of .pbf and .o5m files; None if s is None or malformed.
+    """
+    try:
+        return int(datetime.strptime(s, '%Y-%m-%dT%H:%M:%SZ')
+                   .replace(tzinfo=timezone.utc).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+def element_tags(elem):
+    """Tags of an element, as a list of (key, value)."""
+    return [(t.get('k'), t.get('v')) for t in elem.iterfind('tag')]
+
+def add_element(builder, elem):
+    """Hand a node, way or relation element to an OsmStoreBuilder.
+
+    Return False for the other elements.
+    """
+    tag = elem.tag
+    if tag == 'node':
+        builder.add_node(int(elem.get('id')), to_units(elem.get('lat')),
+                         to_units(elem.get('lon')), element_tags(elem))
+    elif tag == 'way':
+        builder.add_way(int(elem.get('id')),
+                        [int(nd.get('ref')) for nd in elem.iterfind('nd')],
+                        element_tags(elem))
+    elif tag == 'relation':
+        builder.add_relation(int(elem.get('id')),
+                             [(m.get('role', ''), int(m.get('ref')),
+                               member_types[m.get('type')])
+                              for m in elem.iterfind('member')],
+                             element_tags(elem))
+    else:
+        return False
+    return True
+
+#-------------------------------------------------------------------------------
+# OsmXmlFile
+#-------------------------------------------------------------------------------
+
+class OsmXmlFile(OsmDataFile):
+    """Data of an OSM XML file, see OsmDataFile."""
+
+    @classmethod
+    def build(cls, filepath, ways_only=False, tag_filter=None):
+        """Read an OSM XML file, possibly compressed.
+
+        With ways_only, or a tag_filter for the ways (see TagFilter), only
+        the nodes referenced by the ways are kept.
+        """
+        builder = OsmStoreBuilder(ways_only, tag_filter)
+        meta = {'seq_number': None, 'timestamp': None}
+        root = None
+        with open_xml(filepath) as f:
+            for event, elem in iterparse(f, events=('start', 'end')):
+                if root is None:
+                    root = elem
+                    meta['timestamp'] = to_seconds(root.get('timestamp'))
+                    continue
+                # Children of the elements, and <bounds>, are left to their
+                # parent
+                if event == 'end' and add_element(builder, elem):
+                    root.clear()
+        return cls(*builder.finish(), meta)
+
+# End of osm_xml.py
+#===============================================================================
@@ -4,7 +4,13 @@
 with BlobHeader and Blob, and a mechanism for extracting a payload from the
 Blob. This level is described in fileformat.proto and used here.
 
+The file is memory-mapped and walked with offsets, so that scanning it costs
+neither a copy of the file nor a copy of its remainder at each step, and the
+blobs are only parsed and decompressed when their data is asked for.
+
 """
+import os
+import mmap
 import zlib
 import struct
 
@@ -24,6 +30,14 @@ indent = ' '*4
 def int_big_end(data):
     """Convert 4 bytes in data (big-endian) to an integer"""
     return struct.unpack(f'>i', data)[0]
+
+def map_file(filepath):
+    """Read-only memoryview on the memory-mapped file, None if it's empty."""
+    with open(filepath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        # The mapping stays valid after the file is closed
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
  
 #-------------------------------------------------------------------------------
 # OsmPbfBlob
@@ -63,6 +77,12 @@ class OsmPbfBlob:
         opt_lzma_data = blob.lzma_data if blob.HasField('lzma_data') else None
 
         return cls(opt_raw, opt_raw_size, opt_zlib_data, opt_lzma_data)
+
+    def get_data(self):
+        """Payload of the blob, decompressed if needed."""
+        if self.raw is not None:
+            return self.raw
+        return zlib.decompress(self.zlib_data)
  
 #-------------------------------------------------------------------------------
 # OsmPbfBlobHeader
@@ -104,18 +124,48 @@ class OsmPbfBlobStruct:
     A file contains a sequence of fileblock headers, each prefixed by their
     length in network byte order, followed by a data block containing the
     actual data.
+
+    This is a lazy descriptor of the blob: its offset in the file, size and
+    type are known from the header, but the Blob message itself is only
+    parsed, from a memoryview on the mapped file, when it is first used.
     """
-    def __init__(self, blob_hdr_len, blob_hdr, blob):
+    def __init__(self, blob_hdr_len, blob_hdr, buf, offset):
         self.blob_hdr_len = blob_hdr_len
         self.blob_hdr = blob_hdr
-        self.blob = blob
+        self.buf = buf  # memoryview on the whole file
+        self.offset = offset  # of the Blob message
+        self._blob = None
+
+    @classmethod
+    def at(cls, buf, offset, size, type_='OSMData'):
+        """Blob structure of known offset and size, without reading its
+        header, as when they come from an index.
+        """
+        return cls(None, OsmPbfBlobHeader(type_, None, size), buf, offset)
+
+    @property
+    def size(self):
+        return self.blob_hdr.datasize
+
+    @property
+    def type_(self):
+        return self.blob_hdr.type_
+
+    @property
+    def blob(self):
+        if self._blob is None:
+            self._blob = OsmPbfBlob.build(
+                self.buf[self.offset:self.offset + self.size])
+        return self._blob
 
     def get_data(self):
-        return zlib.decompress(self.blob.zlib_data)
+        """Payload of the blob, decompressed if needed."""
+        return self.blob.get_data()
 
     def show(self, level):
         s = ''
         s += f'Blob structure\n'
+        s += f'{indent}offset={self.offset}, size={self.size}\n'
         s += f'{indent}len(BlobHeader)={self.blob_hdr_len}\n'
         s += self.blob_hdr.show(level+1) + '\n'
         s += self.blob.show(level+1)
@@ -140,24 +190,27 @@ def blob_structs(filepath):
 
     See https://wiki.openstreetmap.org/wiki/PBF_Format
 
+    Only the small BlobHeader messages are parsed while walking the file, the
+    blob structures are lazy, see OsmPbfBlobStruct, so that even very large
+    files are scanned in constant memory.
     """
-    with open(filepath, 'rb') as f:
-        data = f.read()
+    buf = map_file(filepath)
+    if buf is None:
+        return
 
-    while data != b'':
+    pos = 0
+    while pos < len(buf):
         # int4: length of the BlobHeader message in network byte order
-        blob_hdr_len = int_big_end(data[:4])
-        data = data[4:]
+        blob_hdr_len = int_big_end(buf[pos:pos + 4])
+        pos += 4
 
         # BlobHeader message
-        blob_header = OsmPbfBlobHeader.build(data[:blob_hdr_len])
-        data = data[blob_hdr_len:]
-
-        # Parse the blob itself
-        blob = OsmPbfBlob.build(data[:blob_header.datasize])
-        data = data[blob_header.datasize:]
+        blob_header = OsmPbfBlobHeader.build(buf[pos:pos + blob_hdr_len])
+        pos += blob_hdr_len
 
-        yield OsmPbfBlobStruct(blob_hdr_len, blob_header, blob)
+        # The blob itself is parsed on demand
+        yield OsmPbfBlobStruct(blob_hdr_len, blob_header, buf, pos)
+        pos += blob_header.datasize
 
 #-------------------------------------------------------------------------------
 # Print out level 1 
@@ -0,0 +1,228 @@
+# pbf/pbf_index.py - sidecar index of the blocks of an OSM file
+
+"""Reading a .pbf file means decoding all of its blocks, even when only a few
+of them are needed. The first time a file is read, a summary of each of its
+blocks is written next to it, in a .idx file: the offset and size of the
+block's blob, the kinds of elements it holds, the range of the ids of each
+kind, the bounding box of its nodes, and that of the nodes of its ways.
+
+Later reads use the index to scan nothing, and to decode only the blocks they
+need: the ones holding ways, and the ones holding the nodes of those ways. The
+bbox of the file is also read from the index.
+
+The bboxes of the ways of the blocks need all the ways: a read with a tag
+filter writes the index without them, and the next read without a filter
+fills them in.
+
+The index is a NumPy .npz file, with one structured array row per block. It
+is stale, and ignored, once the .pbf file is modified.
+
+"""
+import os
+
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Indentation prefix
+indent = ' '*4
+
+# Appended to the .pbf file name
+index_suffix = '.idx'
+
+# Bumped when the layout of the index changes
+index_version = 1
+
+# Bits of the elems field
+elem_bits = {'node': 1, 'way': 2, 'rel': 4}
+
+# One row per block, bboxes are (min_lat, max_lat, min_lon, max_lon) in
+# degrees, NaN when the block has no elements of the kind
+block_dtype = np.dtype([
+    ('offset', '<i8'), ('size', '<i8'), ('elems', 'u1'),
+    ('node_min', '<i8'), ('node_max', '<i8'),
+    ('way_min', '<i8'), ('way_max', '<i8'),
+    ('rel_min', '<i8'), ('rel_max', '<i8'),
+    ('node_bbox', '<f8', 4), ('way_bbox', '<f8', 4)])
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def file_stamp(filepath):
+    """Version of a file, as far as the index is concerned."""
+    st = os.stat(filepath)
+    return np.array([index_version, st.st_size, st.st_mtime_ns],
+                    dtype=np.int64)
+
+def bbox_union(b1, b2):
+    """Union of two (min_lat, max_lat, min_lon, max_lon) boxes, or None."""
+    if b1 is None:
+        return b2
+    if b2 is None:
+        return b1
+    return (min(b1[0], b2[0]), max(b1[1], b2[1]),
+            min(b1[2], b2[2]), max(b1[3], b2[3]))
+
+#-------------------------------------------------------------------------------
+# OsmPbfBlockIndex
+#-------------------------------------------------------------------------------
+
+class OsmPbfBlockIndex:
+    """Summary of the data blocks of a .pbf file, see above.
+
+    The header blob is not in the blocks array, its offset and size are kept
+    apart.
+    """
+    def __init__(self, header, blocks, way_bbox=True):
+        self.header = header  # (offset, size) of the header blob
+        self.blocks = blocks  # structured array of block_dtype
+        self.way_bbox = way_bbox  # whether the bboxes of the ways are known
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def show(self, level=0):
+        s = f'{indent*level}Index of {len(self)} blocks'
+        for i, b in enumerate(self.blocks[:10]):
+            elems = [k for k, bit in elem_bits.items() if b['elems'] & bit]
+            s += f'\n{indent*(level+1)}[{i:03}] offset={b["offset"]}' \
+                f', elems={elems}, node bbox={self.block_bbox(i, "node")}' \
+                f', way bbox={self.block_bbox(i, "way")}'
+        return s
+
+    @staticmethod
+    def filepath(pbf_path):
+        """Path of the index of file pbf_path."""
+        return pbf_path + index_suffix
+
+    @classmethod
+    def build(cls, header, blobs, summaries, way_bbox=True):
+        """Build the index from the blobs of the file and their summaries.
+
+        Argument header is the header blob, blobs the data blobs (anything
+        with an offset and a size), and summaries a dictionary per blob,
+        mapping 'ids' to a dictionary of (min, max) per kind of element, and
+        'node_bbox' and 'way_bbox' to boxes or None. Without way_bbox, the
+        bboxes of the ways are left out, they're not those of all the ways.
+        """
+        blocks = np.zeros(len(blobs), dtype=block_dtype)
+        blocks['offset'] = [b.offset for b in blobs]
+        blocks['size'] = [b.size for b in blobs]
+        blocks['node_bbox'] = np.nan
+        blocks['way_bbox'] = np.nan
+        for row, summary in zip(blocks, summaries):
+            for elem, (lo, hi) in summary['ids'].items():
+                row['elems'] |= elem_bits[elem]
+                row[f'{elem}_min'] = lo
+                row[f'{elem}_max'] = hi
+            names = ('node_bbox', 'way_bbox') if way_bbox else ('node_bbox',)
+            for name in names:
+                if summary[name] is not None:
+                    row[name] = summary[name]
+        return cls((header.offset, header.size), blocks, way_bbox)
+
+    @classmethod
+    def load(cls, pbf_path):
+        """Read the index of pbf_path, None if it's missing or stale."""
+        path = cls.filepath(pbf_path)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                if not np.array_equal(npz['stamp'], file_stamp(pbf_path)):
+                    return None
+                # Indexes written before the flag always had them
+                way_bbox = bool(npz['way_bbox']) \
+                    if 'way_bbox' in npz.files else True
+                return cls(tuple(int(x) for x in npz['header']),
+                           npz['blocks'], way_bbox)
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, pbf_path):
+        """Write the index next to pbf_path, if the directory allows it."""
+        path = self.filepath(pbf_path)
+        try:
+            with open(path, 'wb') as f:
+                np.savez(f, stamp=file_stamp(pbf_path),
+                         header=np.array(self.header, dtype=np.int64),
+                         blocks=self.blocks,
+                         way_bbox=np.array(self.way_bbox))
+        except OSError as e:
+            print(f'Cannot write index {path}: {e}')
+
+    def has(self, elem):
+        """Boolean array of the blocks holding elements of kind elem."""
+        return (self.blocks['elems'] & elem_bits[elem]) != 0
+
+    def first(self, elem):
+        """Position of the first block with elements of kind elem, or None."""
+        pos = np.flatnonzero(self.has(elem))
+        return int(pos[0]) if len(pos) > 0 else None
+
+    def holding(self, node_ids):
+        """Boolean array of the node blocks that may hold some of node_ids.
+
+        Argument node_ids is a sorted array, a block may hold some of them if
+        one falls in the block's range of node ids.
+        """
+        b = self.blocks
+        lo = np.searchsorted(node_ids, b['node_min'], side='left')
+        hi = np.searchsorted(node_ids, b['node_max'], side='right')
+        return self.has('node') & (hi > lo)
+
+    def patch(self, elem, ids, boxes):
+        """Grow the entries of the blocks of kind elem to cover elements
+        added or modified since the index was built, see osm_change.py.
+
+        Argument ids are the ids of the elements, boxes an (n, 4) array of
+        their bounding boxes. Each element goes to the block whose range of
+        ids holds its id, else to the last block before it, and the block's
+        range and bbox are extended. Deleted elements are left in the
+        index, which only makes it answer a little more than needed.
+        """
+        blocks = np.flatnonzero(self.has(elem))
+        if len(blocks) == 0 or len(ids) == 0:
+            return
+        b = self.blocks
+        pos = np.searchsorted(b[f'{elem}_min'][blocks], ids, side='right') - 1
+        rows = blocks[np.maximum(pos, 0)]
+        np.minimum.at(b[f'{elem}_min'], rows, ids)
+        np.maximum.at(b[f'{elem}_max'], rows, ids)
+        bbox = b[f'{elem}_bbox']
+        for k, reduce in enumerate((np.fmin, np.fmax, np.fmin, np.fmax)):
+            reduce.at(bbox[:, k], rows, boxes[:, k])
+
+    def set_way_bboxes(self, boxes):
+        """Set the bboxes of the ways of all the blocks, a box or None for
+        each block, once they're known.
+        """
+        b = self.blocks['way_bbox']
+        b[:] = np.nan
+        for i, box in enumerate(boxes):
+            if box is not None:
+                b[i] = box
+        self.way_bbox = True
+
+    def block_bbox(self, i, elem='node'):
+        """Bounding box of the nodes or ways of block i, in degrees, or None.
+        """
+        b = self.blocks[i][f'{elem}_bbox']
+        if np.isnan(b[0]):
+            return None
+        return tuple(float(x) for x in b)
+
+    @property
+    def bbox(self):
+        """Bounding box of the ways of the file, or of its nodes if it has no
+        ways or their bboxes are not known, in degrees.
+        """
+        elem = 'way' if self.way_bbox and self.has('way').any() else 'node'
+        box = None
+        for i in np.flatnonzero(self.has(elem)):
+            box = bbox_union(box, self.block_bbox(i, elem))
+        return box
+
+# End of pbf_index.py
+#===============================================================================
@@ -75,7 +75,7 @@ def level_2(filepath):
     print()
 
     b = f.primitive_blocks[f.first_way]
-    g = b.groups[1]
+    g = next(g for g in b.groups if g.elem == 'way')
     w = g.primitives[0]  # First way
 
     print(f'Way {w.id_}, refs={w.refs}')
@@ -0,0 +1,322 @@
+# mapv/raster.py - batched polyline rasterizer
+
+"""Vectorized line rasterizer.
+
+Drawing one ImageDraw.line per feature costs a Python call and a list of
+tuples for every feature, which is hundreds of thousands of calls per frame on
+an OSM extract. Here all the polylines that share a style are handled as a
+single LineBatch, a flat (n, 2) vertex array plus an offsets array, and
+rasterized in one pass with NumPy.
+
+The rasterizer doesn't draw colors, it fills a coverage mask (uint8, 0 to
+255) with the same shape as the frame; the mask is then painted with the
+batch's color by compose.paint().
+
+Polygons are handled the same way, as a PolygonBatch of rings, and filled
+with a scanline algorithm run on all the edges of all the rings at once.
+
+"""
+from itertools import chain
+
+import numpy as np
+
+from spatial import GridIndex, polyline_boxes, ranges
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Maximum number of pixel samples generated at once, this bounds the size of
+# the temporary arrays when rasterizing very large batches.
+chunk_samples = 1 << 18
+
+#-------------------------------------------------------------------------------
+# LineBatch
+#-------------------------------------------------------------------------------
+
+class LineBatch:
+    """Polylines sharing a style, as a flat vertex array plus offsets.
+
+    Polyline i is xy[offsets[i]:offsets[i+1]], so offsets has one more element
+    than there are polylines. Argument index, if given, is the spatial index
+    of the polylines, as saved with them.
+    """
+    def __init__(self, xy, offsets, index=None):
+        self.xy = xy
+        self.offsets = offsets
+        self._index = index
+
+    @property
+    def index(self):
+        """Spatial index of the polylines' bounding boxes, built once."""
+        if self._index is None:
+            self._index = GridIndex.build(polyline_boxes(self.xy,
+                                                         self.offsets))
+        return self._index
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def build(cls, polylines):
+        """Build a batch from an iterable of sequences of (x, y) couples.
+
+        Polylines with less than two points are dropped, they can't be drawn.
+        """
+        polylines = [p for p in polylines if len(p) > 1]
+        offsets = np.zeros(len(polylines) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in polylines], out=offsets[1:])
+        xy = np.array(list(chain.from_iterable(polylines)), dtype=np.float64)
+        return cls(xy.reshape(-1, 2), offsets)
+
+    @classmethod
+    def concatenate(cls, batches):
+        """Merge batches into a single one, its index is built again."""
+        batches = list(batches)
+        sizes = [len(b.xy) for b in batches]
+        starts = np.cumsum([0] + sizes[:-1])
+        offsets = np.concatenate([b.offsets[:-1] + s
+                                  for b, s in zip(batches, starts)] +
+                                 [[sum(sizes)]]).astype(np.int64)
+        return cls(np.concatenate([b.xy for b in batches]), offsets)
+
+    def vertex_ids(self, ids):
+        """Positions in xy of the vertices of polylines ids."""
+        ids = np.asarray(ids, dtype=np.int64)
+        starts = self.offsets[ids]
+        return ranges(starts, self.offsets[ids + 1] - starts)
+
+    def segments(self, xy=None, ids=None):
+        """Segments of the polylines as an (m, 4) array of x0, y0, x1, y1.
+
+        Argument xy, if present, replaces the batch vertices, it is typically
+        the result of transforming them to window coordinates; only the
+        vertices of the polylines in use need to be valid. Argument ids, if
+        present, restricts the segments to those polylines.
+        """
+        if xy is None:
+            xy = self.xy
+        if ids is None:
+            ids = np.arange(len(self))
+        ids = np.asarray(ids, dtype=np.int64)
+        starts = self.offsets[ids]
+
+        # Every vertex but the last one of its polyline starts a segment
+        v = ranges(starts, self.offsets[ids + 1] - starts - 1)
+        return np.hstack([xy[v], xy[v + 1]])
+
+#-------------------------------------------------------------------------------
+# PolygonBatch
+#-------------------------------------------------------------------------------
+
+class PolygonBatch:
+    """Polygons sharing a style, as rings in a flat vertex array plus offsets.
+
+    Ring i is xy[offsets[i]:offsets[i+1]], implicitly closed, and belongs to
+    polygon ring_poly[i]; polygons are numbered from 0, and the rings of a
+    polygon are consecutive. Holes are
+    rings like the others, filling uses the even-odd rule.
+    """
+    def __init__(self, xy, offsets, ring_poly):
+        self.xy = xy
+        self.offsets = offsets
+        self.ring_poly = ring_poly
+        self._index = None
+
+    @property
+    def index(self):
+        """Spatial index of the polygons' bounding boxes, built once."""
+        if self._index is None:
+            boxes = polyline_boxes(self.xy, self.offsets)
+            if len(boxes) > 0:
+                # Polygon boxes from ring boxes, rings are in polygon order
+                starts = np.flatnonzero(np.diff(self.ring_poly,
+                                                prepend=-1) != 0)
+                boxes = np.column_stack([
+                    np.minimum.reduceat(boxes[:, 0], starts),
+                    np.minimum.reduceat(boxes[:, 1], starts),
+                    np.maximum.reduceat(boxes[:, 2], starts),
+                    np.maximum.reduceat(boxes[:, 3], starts)])
+            self._index = GridIndex.build(boxes)
+        return self._index
+
+    def __len__(self):
+        return int(self.ring_poly[-1]) + 1 if len(self.ring_poly) > 0 else 0
+
+    def ring_ids(self, ids):
+        """Positions of the rings of polygons ids, a sorted array."""
+        return np.flatnonzero(np.isin(self.ring_poly, ids))
+
+    def vertex_ids(self, rings):
+        """Positions in xy of the vertices of the rings."""
+        starts = self.offsets[rings]
+        return ranges(starts, self.offsets[rings + 1] - starts)
+
+    def edges(self, xy=None, rings=None):
+        """Edges of the rings as an (m, 4) array of x0, y0, x1, y1, plus the
+        polygon of each edge.
+
+        Arguments xy and rings are like in LineBatch.segments(), the closing
+        edge of each ring is included.
+        """
+        if xy is None:
+            xy = self.xy
+        if rings is None:
+            rings = np.arange(len(self.offsets) - 1)
+        starts = self.offsets[rings]
+        counts = self.offsets[rings + 1] - starts
+        v = ranges(starts, counts)
+
+        # The next vertex of the last one of a ring is its first one
+        w = v + 1
+        ends = np.cumsum(counts) - 1
+        w[ends] = starts
+        return np.hstack([xy[v], xy[w]]), np.repeat(self.ring_poly[rings],
+                                                    counts)
+
+#-------------------------------------------------------------------------------
+# Rasterizer
+#-------------------------------------------------------------------------------
+
+def rasterize_segments(cov, segs, width=1, antialias=False, origin=(0, 0)):
+    """Rasterize segments into the coverage mask cov, in a vectorized way.
+
+    Each segment is walked along its major axis, one sample per pixel. For
+    every sample, the pixels across the minor axis are covered according to
+    their distance to the segment: fully if closer than width/2, or (with
+    antialias) linearly fading out over the next pixel.
+
+    Segment coordinates are in the frame, origin is the frame position of
+    cov[0, 0], which lets callers rasterize into a tile of the frame.
+    """
+    if len(segs) == 0:
+        return
+    x0, y0, x1, y1 = (segs[:, i] - origin[i % 2] for i in range(4))
+
+    # Work in (major, minor) coordinates, with major increasing
+    steep = np.abs(y1 - y0) > np.abs(x1 - x0)
+    a0 = np.where(steep, y0, x0)
+    a1 = np.where(steep, y1, x1)
+    b0 = np.where(steep, x0, y0)
+    b1 = np.where(steep, x1, y1)
+    swap = a1 < a0
+    a0, a1 = np.where(swap, a1, a0), np.where(swap, a0, a1)
+    b0, b1 = np.where(swap, b1, b0), np.where(swap, b0, b1)
+
+    da = a1 - a0
+    slope = np.divide(b1 - b0, da, out=np.zeros_like(da), where=da != 0)
+
+    # Samples outside of cov along the major axis are never generated
+    h, w = cov.shape
+    size = np.where(steep, h, w)
+    ia0 = np.clip(np.rint(a0), 0, size).astype(np.int64)
+    ia1 = np.clip(np.rint(a1), -1, size - 1).astype(np.int64)
+    n = np.maximum(ia1 - ia0 + 1, 0)
+
+    # Pixels across the minor axis, perpendicular distance is the minor
+    # distance divided by sqrt(1 + slope**2) <= sqrt(2)
+    reach = width/2 + 0.5 if antialias else width/2
+    k = int(np.ceil(reach*np.sqrt(2)))
+    across = np.arange(-k, k + 1)
+    scale = np.sqrt(1 + slope*slope)
+
+    # Split the segments into chunks holding a bounded number of samples
+    ends = np.cumsum(n)
+    lo = 0
+    while lo < len(n):
+        limit = ends[lo] - n[lo] + chunk_samples
+        hi = max(int(np.searchsorted(ends, limit, side='right')), lo + 1)
+        _rasterize(cov, steep[lo:hi], a0[lo:hi], b0[lo:hi], slope[lo:hi],
+                   scale[lo:hi], ia0[lo:hi], n[lo:hi], across, width,
+                   antialias)
+        lo = hi
+
+def _rasterize(cov, steep, a0, b0, slope, scale, ia0, n, across, width,
+               antialias):
+    """Rasterize one chunk of segments, see rasterize_segments()."""
+    total = int(n.sum())
+    if total == 0:
+        return
+    h, w = cov.shape
+
+    # One sample per pixel along the major axis
+    seg = np.repeat(np.arange(len(n)), n)
+    starts = np.cumsum(n) - n
+    a = ia0[seg] + (np.arange(total) - starts[seg])
+    b = b0[seg] + (a - a0[seg])*slope[seg]
+
+    # Candidate pixels across the minor axis
+    bi = np.floor(b + 0.5).astype(np.int64)[:, None] + across
+    dist = np.abs(bi - b[:, None])/scale[seg][:, None]
+    if antialias:
+        val = np.clip(width/2 + 0.5 - dist, 0, 1)
+    else:
+        # The nearest pixel is always drawn, so that thin lines have no gaps
+        val = ((dist <= width/2) | (across == 0)).astype(np.float64)
+
+    steep = np.broadcast_to(steep[seg][:, None], bi.shape)
+    a = np.broadcast_to(a[:, None], bi.shape)
+    xs = np.where(steep, bi, a)
+    ys = np.where(steep, a, bi)
+
+    m = (val > 0) & (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+    xs, ys = xs[m], ys[m]
+    if antialias:
+        np.maximum.at(cov, (ys, xs), np.rint(255*val[m]).astype(np.uint8))
+    else:
+        cov[ys, xs] = 255
+
+def rasterize_lines(cov, batch, xy=None, width=1, antialias=False,
+                    origin=(0, 0)):
+    """Rasterize all the polylines of a LineBatch into the coverage mask."""
+    rasterize_segments(cov, batch.segments(xy), width, antialias, origin)
+
+def rasterize_polygons(cov, edges, poly, origin=(0, 0)):
+    """Fill polygons into the coverage mask cov, with the even-odd rule.
+
+    Argument edges is an (m, 4) array of x0, y0, x1, y1, and poly gives the
+    polygon of each edge, see PolygonBatch.edges(). A pixel is covered when
+    its center is inside. All the crossings of the edges with the pixel rows
+    are computed at once, sorted by polygon, row and x, and paired into
+    spans; the spans are then marked in a difference array, whose running
+    sum along each row gives the covered pixels.
+    """
+    if len(edges) == 0:
+        return
+    h, w = cov.shape
+    x0, y0, x1, y1 = (edges[:, i] - origin[i % 2] for i in range(4))
+
+    # Rows whose center line y + 0.5 is crossed, horizontal edges cross none
+    lo = np.minimum(y0, y1)
+    hi = np.maximum(y0, y1)
+    r0 = np.clip(np.ceil(lo - 0.5), 0, h).astype(np.int64)
+    r1 = np.clip(np.ceil(hi - 0.5), 0, h).astype(np.int64)
+    n = r1 - r0
+    if n.sum() == 0:
+        return
+
+    e = np.repeat(np.arange(len(edges)), n)
+    row = ranges(r0, n)
+    t = (row + 0.5 - y0[e])/(y1[e] - y0[e])
+    x = x0[e] + t*(x1[e] - x0[e])
+
+    # Every polygon crosses every row an even number of times
+    order = np.lexsort((x, row, poly[e]))
+    x = x[order].reshape(-1, 2)
+    row = row[order][0::2]
+
+    # Pixels whose center x + 0.5 is in [x_start, x_end)
+    c0 = np.clip(np.ceil(x[:, 0] - 0.5), 0, w).astype(np.int64)
+    c1 = np.clip(np.ceil(x[:, 1] - 0.5), 0, w).astype(np.int64)
+    span = c1 > c0
+    diff = np.zeros((h, w + 1), dtype=np.int32)
+    np.add.at(diff, (row[span], c0[span]), 1)
+    np.add.at(diff, (row[span], c1[span]), -1)
+    cov[np.cumsum(diff[:, :w], axis=1) > 0] = 255
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    print('This module is not meant to be executed directly.')
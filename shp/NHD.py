@@ -1,9 +1,6 @@
 import os
-from shp import build_header
+from shp.catalog import ShpCatalog
 
 path = 'c:/x/w/carto/NHD_H_01090001_HU8_Shape/Shape'
-for f in os.listdir(path):
-    if not f.endswith('.shp'):
-        continue
-    shp = build_header(os.path.join(path, f))
-    print(f'{f}\t{shp.hdr.shape_type}')
\ No newline at end of file
+for e in ShpCatalog.scan(path).entries:
+    print(f'{os.path.basename(e.path)}\t{e.shape_type}')
@@ -0,0 +1,248 @@
+# mapv/shp/catalog.py
+
+"""Catalog of the shapefiles of a directory tree.
+
+Datasets like ROUTE500 or NHD come as trees of dozens of shapefiles, one per
+layer. Finding the layers of interest means reading the header of each .shp
+file, for its shape type and bounding box, the size of its .shx file, for the
+number of records, and the header of its .dbf file, for the fields of the
+attributes. The files are read by a pool of threads, since most of the time
+is spent waiting for the disk, and the result is written at the root of the
+tree, in shp_catalog.json.
+
+Later scans read the catalog, and only the files that changed since, as
+given by their sizes and modification times. A query of the catalog gives
+the layers whose bounding box intersects a region, and open() opens one of
+them lazily, see ShapeFile.
+
+"""
+
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from .common import MainFileHeader, ShpParser
+from .dbf import DbfFile
+from .shp import build
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Written at the root of the tree
+catalog_name = 'shp_catalog.json'
+
+# Bumped when the layout of the catalog changes
+catalog_version = 1
+
+# Files of a layer, other than the .shp file, that go in the catalog
+sidecar_exts = ('.shx', '.dbf')
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def file_stamps(shp_path):
+    """Size and modification time of the files of a layer, None for the
+    missing ones.
+    """
+    root, ext = os.path.splitext(shp_path)
+    stamps = []
+    for path in (shp_path,) + tuple(root + e for e in sidecar_exts):
+        try:
+            st = os.stat(path)
+            stamps.append([st.st_size, st.st_mtime_ns])
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+def find_shapefiles(root):
+    """Paths of the .shp files under root, relative to it, sorted."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for f in filenames:
+            if f.lower().endswith('.shp'):
+                paths.append(os.path.relpath(os.path.join(dirpath, f), root))
+    return sorted(paths)
+
+#-------------------------------------------------------------------------------
+# CatalogEntry
+#-------------------------------------------------------------------------------
+
+class CatalogEntry:
+    """A layer of the catalog.
+
+    Path is relative to the root of the tree, bbox is (xmin, ymin, xmax,
+    ymax), fields is a list of (name, type, length, decimals), None without
+    a .dbf file.
+    """
+    def __init__(self, path, shape_type, bbox, num_recs, fields, stamps):
+        self.path = path
+        self.shape_type = shape_type  # name of the ShapeType
+        self.bbox = bbox
+        self.num_recs = num_recs
+        self.fields = fields
+        self.stamps = stamps  # see file_stamps()
+
+    def __str__(self):
+        xmin, ymin, xmax, ymax = self.bbox
+        s = ''
+        s += f'{self.path}\t{self.shape_type}\t{self.num_recs:_} records'
+        s += f'\t({xmin:_.2f}, {ymin:_.2f}, {xmax:_.2f}, {ymax:_.2f})'
+        if self.fields is not None:
+            s += '\t' + ', '.join(f[0] for f in self.fields)
+        return s
+
+    def intersects(self, box):
+        xmin, ymin, xmax, ymax = box
+        return self.bbox[0] <= xmax and self.bbox[2] >= xmin and \
+            self.bbox[1] <= ymax and self.bbox[3] >= ymin
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    @classmethod
+    def build(cls, root, path):
+        """Build a class instance from the files of a layer."""
+        shp_path = os.path.join(root, path)
+        stamps = file_stamps(shp_path)
+        with open(shp_path, 'rb') as f:
+            hdr = MainFileHeader.build(f.read(100))
+
+        num_recs = None
+        if stamps[1] is not None:
+            num_recs = max(stamps[1][0] - 100, 0)//8
+
+        fields = None
+        if stamps[2] is not None:
+            base, ext = os.path.splitext(shp_path)
+            with open(f'{base}.dbf', 'rb') as f:
+                _, _, _, dbf_fields = DbfFile.read_header(f)
+            fields = [(d.name, d.type_, d.length, d.decimals)
+                      for d in dbf_fields]
+
+        return cls(path.replace(os.sep, '/'), str(hdr.shape_type),
+                   (hdr.Xmin, hdr.Ymin, hdr.Xmax, hdr.Ymax), num_recs, fields,
+                   stamps)
+
+#-------------------------------------------------------------------------------
+# ShpCatalog
+#-------------------------------------------------------------------------------
+
+class ShpCatalog:
+    """The shapefiles of the tree under root, a list of CatalogEntry."""
+    def __init__(self, root, entries):
+        self.root = root
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        s = ''
+        s += f'{self.root}: {len(self)} shapefiles\n'
+        for e in self.entries:
+            s += f'{e}\n'
+        return s
+
+    @staticmethod
+    def filepath(root):
+        """Path of the catalog of the tree under root."""
+        return os.path.join(root, catalog_name)
+
+    @classmethod
+    def load(cls, root):
+        """Read the catalog of root, None if it's missing or unreadable."""
+        try:
+            with open(cls.filepath(root), encoding='utf-8') as f:
+                obj = json.load(f)
+            if obj['version'] != catalog_version:
+                return None
+            return cls(root, [CatalogEntry.from_dict(d)
+                              for d in obj['entries']])
+        except (OSError, KeyError, TypeError, ValueError):
+            return None
+
+    def save(self):
+        """Write the catalog at the root of the tree, if it allows it."""
+        path = self.filepath(self.root)
+        obj = {'version': catalog_version,
+               'entries': [e.to_dict() for e in self.entries]}
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(obj, f, indent=1)
+        except OSError as e:
+            print(f'Cannot write catalog {path}: {e}')
+
+    @classmethod
+    def scan(cls, root, workers=None):
+        """Catalog the shapefiles under root, reading only the ones that
+        changed since the last scan, with a pool of workers threads, and
+        save the catalog.
+        """
+        old = cls.load(root)
+        known = {} if old is None else {e.path: e for e in old.entries}
+
+        paths = find_shapefiles(root)
+        entries = {}
+        todo = []
+        for path in paths:
+            e = known.get(path.replace(os.sep, '/'))
+            if e is not None and \
+               e.stamps == file_stamps(os.path.join(root, path)):
+                entries[path] = e
+            else:
+                todo.append(path)
+
+        def scan_file(path):
+            try:
+                return CatalogEntry.build(root, path)
+            except (OSError, ShpParser, struct.error, ValueError) as e:
+                print(f'Cannot read {path}: {e}')
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for path, e in zip(todo, pool.map(scan_file, todo)):
+                if e is not None:
+                    entries[path] = e
+
+        catalog = cls(root, [entries[p] for p in paths if p in entries])
+        if old is None or todo or len(catalog) != len(old):
+            catalog.save()
+        return catalog
+
+    def query(self, box=None, shape_types=None):
+        """Entries whose bounding box intersects box, (xmin, ymin, xmax,
+        ymax), all of them if None, and whose shape type is one of the names
+        in shape_types, any if None.
+        """
+        return [e for e in self.entries
+                if (box is None or e.intersects(box)) and
+                (shape_types is None or e.shape_type in shape_types)]
+
+    def open(self, entry):
+        """Open the shapefile of entry, lazily, see ShapeFile."""
+        return build(os.path.join(self.root, entry.path), lazy=True)
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    # Check cmd line args
+    if len(sys.argv) not in (2, 6):
+        print(f'usage: {sys.argv[0]} <root> [<xmin> <ymin> <xmax> <ymax>]')
+        exit(-1)
+
+    catalog = ShpCatalog.scan(sys.argv[1])
+    if len(sys.argv) == 2:
+        print(catalog)
+    else:
+        box = tuple(float(x) for x in sys.argv[2:])
+        for e in catalog.query(box):
+            print(e)
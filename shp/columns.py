@@ -0,0 +1,212 @@
+# mapv/shp/columns.py
+
+"""Shapefile records as columns.
+
+Decoding records one at a time, with struct.unpack and lists of tuples, costs
+several Python calls per point, which dominates the loading of large layers.
+Here the records are decoded all at once, with NumPy, from the memory-mapped
+.shp file and the record offsets given by the .shx file: every field is
+gathered for all the records in one indexing operation, then viewed with its
+little-endian dtype.
+
+The result is a ShpColumns: all the points in one (n, 2) array, the offsets
+of the parts in it, and the offsets of the parts of each record, plus the
+shape type and bounding box of each record, and the Z and M values of the
+points when the shape type has them.
+
+"""
+
+import numpy as np
+from spatial import ranges
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Shape type codes, as stored in the files
+null_code = 0
+point_codes = (1, 11, 21)
+multipoint_codes = (8, 18, 28)
+poly_codes = (3, 5, 13, 15, 23, 25)
+z_codes = (11, 13, 15, 18)
+m_codes = (21, 23, 25, 28)
+
+# M values below this are 'no data', see the specification
+no_data = -1e38
+
+# Offset of the points in the record contents
+points_at = {1: 4, 11: 4, 21: 4, 8: 40, 18: 40, 28: 40}
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def field(data, starts, dtype, count=1):
+    """Gather a field of count values at positions starts of byte array data.
+
+    Return an array of shape (len(starts), count).
+    """
+    size = np.dtype(dtype).itemsize*count
+    return runs(data, starts, np.full(len(starts), size), dtype).reshape(-1,
+                                                                         count)
+
+def runs(data, starts, sizes, dtype, chunk=1 << 22):
+    """Gather runs of values, of sizes bytes, at positions starts of data, as
+    one flat array.
+
+    The positions of the bytes are made for chunk bytes at most at a time,
+    they take 8 times the size of the data.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    ends = np.cumsum(sizes)
+    out = np.empty(ends[-1] if len(ends) > 0 else 0, dtype=np.uint8)
+    i, done = 0, 0
+    while i < len(starts):
+        j = max(i + 1, int(np.searchsorted(ends, done + chunk, side='right')))
+        out[done:ends[j - 1]] = data[ranges(starts[i:j], sizes[i:j])]
+        done, i = ends[j - 1], j
+    return out.view(dtype)
+
+def make_offsets(counts):
+    """Offsets of runs of lengths counts in a flat array, one more element."""
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+def record_boxes(data, offsets, types=None):
+    """Bounding boxes (xmin, ymin, xmax, ymax) of the records at offsets of
+    byte array data, as an (n, 4) array, NaN for null shapes.
+
+    Argument types is the array of their shape type codes, read if None.
+    """
+    content = np.asarray(offsets, dtype=np.int64) + 8
+    if types is None:
+        types = field(data, content, '<i4')[:, 0]
+    boxes = np.full((len(content), 4), np.nan)
+    box = ~np.isin(types, (null_code,) + point_codes)
+    boxes[box] = field(data, content[box] + 4, '<f8', 4)
+    point = np.isin(types, point_codes)
+    boxes[point] = field(data, content[point] + 4, '<f8', 2)[:, [0, 1, 0, 1]]
+    return boxes
+
+#-------------------------------------------------------------------------------
+# ShpColumns
+#-------------------------------------------------------------------------------
+
+class ShpColumns:
+    """Records of a shapefile as arrays.
+
+    Part j is xy[parts[j]:parts[j+1]], and the parts of record i are
+    parts[rec_parts[i]:rec_parts[i+1]]. A point is a record with a single
+    part of a single point, a null shape a record without parts. Boxes are
+    (xmin, ymin, xmax, ymax), NaN for null shapes. Arrays z and m are
+    aligned with xy, NaN where a record has no value; they are None when the
+    shape type has none.
+    """
+    def __init__(self, types, boxes, xy, parts, rec_parts, z=None, m=None):
+        self.types = types  # shape type code of each record
+        self.boxes = boxes
+        self.xy = xy
+        self.parts = parts
+        self.rec_parts = rec_parts
+        self.z = z
+        self.m = m
+
+    def __len__(self):
+        return len(self.types)
+
+    def points(self, i):
+        """Points of record i, as a list of (n, 2) arrays, one per part."""
+        p = self.parts[self.rec_parts[i]:self.rec_parts[i + 1] + 1]
+        return [self.xy[a:b] for a, b in zip(p[:-1], p[1:])]
+
+    def polylines(self):
+        """Parts of the polyline and polygon records, as a flat vertex array
+        and offsets, see raster.LineBatch.
+        """
+        poly = np.isin(self.types, poly_codes)
+        if poly.all():
+            return self.xy, self.parts
+        starts = self.rec_parts[:-1][poly]
+        part_ids = ranges(starts, self.rec_parts[1:][poly] - starts)
+        counts = self.parts[part_ids + 1] - self.parts[part_ids]
+        return (self.xy[ranges(self.parts[part_ids], counts)],
+                make_offsets(counts))
+
+    @classmethod
+    def decode(cls, data, offsets, lengths):
+        """Decode records from the bytes of a .shp file.
+
+        Argument data is a uint8 array of the file contents, typically a
+        memory map, offsets and lengths the positions of the records and the
+        lengths of their contents in bytes, as read from the .shx file.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        content = offsets + 8
+        n = len(offsets)
+        types = field(data, content, '<i4')[:, 0]
+
+        # Number of points and parts, and position of the points, of each
+        # record
+        poly = np.isin(types, poly_codes)
+        multi = np.isin(types, multipoint_codes)
+        point = np.isin(types, point_codes)
+        num_points = np.zeros(n, dtype=np.int64)
+        num_parts = np.zeros(n, dtype=np.int64)
+        at = np.zeros(n, dtype=np.int64)
+        counts = field(data, content[poly] + 36, '<i4', 2)
+        num_parts[poly], num_points[poly] = counts[:, 0], counts[:, 1]
+        at[poly] = 44 + 4*num_parts[poly]
+        num_points[multi] = field(data, content[multi] + 36, '<i4')[:, 0]
+        num_parts[multi] = 1
+        num_parts[point] = 1
+        num_points[point] = 1
+        for code, pos in points_at.items():
+            at[types == code] = pos
+        start = content + at
+
+        xy = runs(data, start, 16*num_points, '<f8').reshape(-1, 2)
+        point_base = make_offsets(num_points)
+
+        # Parts, as offsets in xy; records other than polylines and polygons
+        # have a single part, starting at their first point
+        rec_parts = make_offsets(num_parts)
+        local = np.zeros(rec_parts[-1], dtype=np.int64)
+        local[ranges(rec_parts[:-1][poly], num_parts[poly])] = \
+            runs(data, content[poly] + 44, 4*num_parts[poly], '<i4')
+        parts = np.append(local + np.repeat(point_base[:-1], num_parts),
+                          len(xy))
+
+        boxes = record_boxes(data, offsets, types)
+
+        # Z values follow the points, then M values, each run preceded by
+        # its range; M values are optional in records with Z values, and
+        # those below no_data mean no value
+        end = start + 16*num_points
+        z_start = np.where(point, content + 20, end + 16)
+        z_end = z_start + np.where(point, 8, 8*num_points)
+        m_start = np.where(point, content + 20, end + 16)
+        has_z = np.isin(types, z_codes)
+        m_start[has_z] = np.where(point, z_end, z_end + 16)[has_z]
+        has_m = np.isin(types, m_codes) | \
+            (has_z & (m_start + 8*num_points <= content + lengths))
+
+        def values(has, value_start):
+            if not has.any():
+                return None
+            v = np.full(len(xy), np.nan)
+            v[ranges(point_base[:-1][has], num_points[has])] = \
+                runs(data, value_start[has], 8*num_points[has], '<f8')
+            v[v < no_data] = np.nan
+            return v
+
+        return cls(types, boxes, xy, parts, rec_parts,
+                   values(has_z, z_start), values(has_m, m_start))
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    print('This module is not meant to be executed directly.')
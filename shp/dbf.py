@@ -0,0 +1,245 @@
+# mapv/shp/dbf.py
+
+"""Attribute file (.dbf) parser.
+
+The attributes of the records of a shapefile are in a dBASE file, .dbf: a
+header, the descriptors of the fields, then one fixed-width row per record,
+in the order of the .shp file. Each row starts with a deletion flag, then
+has the fields, as text, padded to their width.
+
+The file is memory-mapped and the rows viewed as a 2-D array of bytes, one
+row per record. A column is decoded only when it is asked for, in one pass
+over its bytes in all the rows, into a NumPy array:
+
+    C (character)        str, without the padding
+    N, F (numeric)       float64, NaN for blank values; int64 for N fields
+                         without decimals, when none is blank
+    D (date)             datetime64[D], NaT for blank or invalid dates
+    L (logical)          bool, True for T, t, Y, y
+
+Other field types, memos for instance, give the raw bytes.
+
+"""
+
+import codecs
+import os
+import sys
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Terminates the field descriptors
+header_end = 0x0D
+
+# Deletion flag of a row
+deleted_flag = ord('*')
+
+# Encoding of the text, unless a .cpg file gives it
+default_encoding = 'latin-1'
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def text(a, width):
+    """View the (n, width) uint8 array a as an array of n stripped byte
+    strings.
+    """
+    s = np.ascontiguousarray(a).view(f'S{width}').ravel()
+    return np.char.strip(s)
+
+def strings(a, width, encoding):
+    """Decode the (n, width) uint8 array a as an array of n stripped str."""
+    if codecs.lookup(encoding).name == 'iso8859-1' or (a < 0x80).all():
+        # The bytes are the code points
+        s = np.ascontiguousarray(a, dtype=np.uint32).view(f'U{width}').ravel()
+        return np.char.strip(s)
+    return np.char.decode(text(a, width), encoding, errors='replace')
+
+def numbers(s):
+    """Convert the array of byte strings s to float64, NaN where blank or
+    invalid.
+    """
+    v = np.full(len(s), np.nan)
+    ok = (s != b'') & (np.char.find(s, b'*') < 0)
+    try:
+        v[ok] = s[ok].astype(np.float64)
+    except ValueError:
+        for i in np.flatnonzero(ok):
+            try:
+                v[i] = float(s[i])
+            except ValueError:
+                pass
+    return v
+
+def dates(a):
+    """Convert the (n, 8) uint8 array a of YYYYMMDD dates to datetime64[D],
+    NaT where blank or invalid.
+    """
+    digits = a.astype(np.int64) - ord('0')
+    ok = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    digits[~ok] = 0
+    year = digits[:, :4] @ [1000, 100, 10, 1]
+    month = digits[:, 4:6] @ [10, 1]
+    day = digits[:, 6:8] @ [10, 1]
+    ok &= (month >= 1) & (month <= 12) & (day >= 1)
+    month[~ok], day[~ok] = 1, 1
+    ym = (year - 1970).astype('datetime64[Y]') + \
+        (month - 1).astype('timedelta64[M]')
+    d = ym.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+
+    # Days past the end of the month
+    ok &= d.astype('datetime64[M]') == ym
+    d[~ok] = np.datetime64('NaT')
+    return d
+
+def file_encoding(filepath):
+    """Encoding of the text of .dbf file filepath, as given by the .cpg file
+    next to it, or default_encoding.
+    """
+    root, ext = os.path.splitext(filepath)
+    try:
+        with open(f'{root}.cpg', encoding='ascii') as f:
+            name = f.read().strip()
+        if name.isdigit():
+            name = f'cp{name}'
+        return codecs.lookup(name).name
+    except (OSError, UnicodeDecodeError, LookupError):
+        return default_encoding
+
+#-------------------------------------------------------------------------------
+# DbfField
+#-------------------------------------------------------------------------------
+
+class DbfField:
+    """A field descriptor, offset is the position of the field in a row."""
+    def __init__(self, name, type_, length, decimals, offset):
+        self.name = name
+        self.type_ = type_
+        self.length = length
+        self.decimals = decimals
+        self.offset = offset
+
+    def __str__(self):
+        return f'{self.name} {self.type_} {self.length}.{self.decimals}'
+
+    @classmethod
+    def build(cls, s, offset):
+        """Build a class instance from the 32 bytes of a descriptor."""
+        name = s[0:11].split(b'\0')[0].decode('latin-1')
+        return cls(name, chr(s[11]), s[16], s[17], offset)
+
+#-------------------------------------------------------------------------------
+# DbfFile
+#-------------------------------------------------------------------------------
+
+class DbfFile:
+    """A .dbf file, its columns are decoded the first time they are used.
+
+    Indexing by field name gives the column, see above; the records marked
+    deleted are kept, so that the rows match the records of the .shp file.
+    """
+    def __init__(self, fields, rows, encoding=default_encoding):
+        self.fields = {f.name: f for f in fields}
+        self.rows = rows  # (n, record length) uint8 array
+        self.encoding = encoding
+        self.decoded = {}  # Field name -> column
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, name):
+        if name not in self.decoded:
+            self.decoded[name] = self.decode(self.fields[name])
+        return self.decoded[name]
+
+    def __str__(self):
+        s = ''
+        s += f'{len(self):_} records\n'
+        for f in self.fields.values():
+            s += f'{f}\n'
+        return s
+
+    @property
+    def names(self):
+        return list(self.fields)
+
+    @property
+    def deleted(self):
+        """Boolean array of the records marked deleted."""
+        return self.rows[:, 0] == deleted_flag
+
+    def columns(self, names):
+        """Dictionary of the columns of the fields names."""
+        return {name: self[name] for name in names}
+
+    def decode(self, field):
+        """Decode the column of a DbfField."""
+        a = self.rows[:, field.offset:field.offset + field.length]
+        if field.type_ == 'D' and field.length == 8:
+            return dates(a)
+        if field.type_ == 'L':
+            return np.isin(a[:, 0], np.frombuffer(b'TtYy', dtype=np.uint8))
+        if field.type_ == 'C':
+            return strings(a, field.length, self.encoding)
+        s = text(a, field.length)
+        if field.type_ in 'NF':
+            v = numbers(s)
+            if field.type_ == 'N' and field.decimals == 0 and \
+               field.length < 19 and not np.isnan(v).any():
+                return v.astype(np.int64)
+            return v
+        return s
+
+    @staticmethod
+    def read_header(f):
+        """Read the header of the file object f, return the number of
+        records, the lengths of the header and of a record, and the list of
+        the fields.
+        """
+        s = f.read(32)
+        num_recs = int.from_bytes(s[4:8], 'little')
+        hdr_len = int.from_bytes(s[8:10], 'little')
+        rec_len = int.from_bytes(s[10:12], 'little')
+
+        # Field descriptors, the first field is after the deletion flag
+        fields = []
+        offset = 1
+        s = f.read(max(hdr_len - 32, 0))
+        for pos in range(0, len(s) - 31, 32):
+            if s[pos] == header_end:
+                break
+            field = DbfField.build(s[pos:pos + 32], offset)
+            fields.append(field)
+            offset += field.length
+        return num_recs, hdr_len, rec_len, fields
+
+    @classmethod
+    def build(cls, filepath):
+        """Build a class instance from a file."""
+        with open(filepath, 'rb') as f:
+            num_recs, hdr_len, rec_len, fields = cls.read_header(f)
+        data = np.memmap(filepath, dtype=np.uint8, mode='r')
+
+        # Files are sometimes cut short
+        num_recs = min(num_recs, (len(data) - hdr_len)//max(rec_len, 1))
+        rows = data[hdr_len:hdr_len + num_recs*rec_len].reshape(num_recs,
+                                                               rec_len)
+        return cls(fields, rows, file_encoding(filepath))
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    # Check cmd line args
+    if len(sys.argv) < 2:
+        print(f'usage: {sys.argv[0]} <filepath> [<field>...]')
+        exit(-1)
+
+    dbf = DbfFile.build(sys.argv[1])
+    print(dbf)
+    for name, column in dbf.columns(sys.argv[2:]).items():
+        print(f'{name}: {column[:10]}')
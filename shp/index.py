@@ -0,0 +1,109 @@
+# mapv/shp/index.py
+
+"""Spatial index of the records of a shapefile.
+
+Every record of a .shp file starts with its bounding box, but finding the
+records in an area means reading all of them. The index is a GridIndex, see
+spatial.py, over the boxes of the records, null shapes excepted. It is built
+the first time a file is queried, reading only the boxes, and written next to
+it, foo.shp.idx for foo.shp, so later opens find it ready.
+
+The index is a NumPy .npz file. It is stale, and ignored, once the .shp file
+is modified.
+
+"""
+
+import os
+import numpy as np
+from spatial import GridIndex
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Appended to the .shp file name
+index_suffix = '.idx'
+
+# Bumped when the layout of the index changes
+index_version = 1
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def file_stamp(filepath):
+    """Version of a file, as far as the index is concerned."""
+    st = os.stat(filepath)
+    return np.array([index_version, st.st_size, st.st_mtime_ns],
+                    dtype=np.int64)
+
+#-------------------------------------------------------------------------------
+# ShpIndex
+#-------------------------------------------------------------------------------
+
+class ShpIndex:
+    """Grid index of the boxes of the records of a shapefile.
+
+    The grid is built over the boxes that are not null, ids maps its
+    features to the record numbers, from 0.
+    """
+    def __init__(self, grid, ids):
+        self.grid = grid
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def filepath(shp_path):
+        """Path of the index of file shp_path."""
+        return shp_path + index_suffix
+
+    @classmethod
+    def build(cls, boxes):
+        """Build the index for the (n, 4) array of the boxes of the records,
+        (xmin, ymin, xmax, ymax), NaN for null shapes.
+        """
+        ids = np.flatnonzero(~np.isnan(boxes).any(axis=1))
+        return cls(GridIndex.build(boxes[ids]), ids)
+
+    @classmethod
+    def load(cls, shp_path):
+        """Read the index of shp_path, None if it's missing or stale."""
+        path = cls.filepath(shp_path)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                if not np.array_equal(npz['stamp'], file_stamp(shp_path)):
+                    return None
+                grid = GridIndex(npz['boxes'], tuple(npz['extent']),
+                                 tuple(int(x) for x in npz['shape']),
+                                 npz['cell_start'], npz['items'])
+                return cls(grid, npz['ids'])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, shp_path):
+        """Write the index next to shp_path, if the directory allows it."""
+        path = self.filepath(shp_path)
+        g = self.grid
+        try:
+            with open(path, 'wb') as f:
+                np.savez(f, stamp=file_stamp(shp_path), ids=self.ids,
+                         boxes=g.boxes, extent=np.array(g.extent),
+                         shape=np.array(g.shape, dtype=np.int64),
+                         cell_start=g.cell_start, items=g.items)
+        except OSError as e:
+            print(f'Cannot write index {path}: {e}')
+
+    def query(self, box):
+        """Sorted numbers of the records whose box intersects box, (xmin,
+        ymin, xmax, ymax).
+        """
+        return self.ids[self.grid.query(box)]
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    print('This module is not meant to be executed directly.')
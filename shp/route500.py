@@ -1,7 +1,8 @@
 # mapv/shp/route500
 
 import os
-from shp import build_header
+import sys
+from shp.catalog import ShpCatalog
 
 #-------------------------------------------------------------------------------
 # I want stdout to be unbuffered, always
@@ -16,50 +17,44 @@ class Unbuffered(object):
     def __getattr__(self, attr):
         return getattr(self.stream, attr)
 
-import sys
 sys.stdout = Unbuffered(sys.stdout)
 
 #-------------------------------------------------------------------------------
-# catégories
+# Globals
 #-------------------------------------------------------------------------------
 
-def catégories():
-    path = (r'C:\x\w\carto\ROUTE500_3-0__SHP_LAMB93_FXX_2019-10-30\ROUTE500'
-            r'\1_DONNEES_LIVRAISON_2019-11-00280\R500_3-0_SHP_LAMB93_FXX-ED191')
-    for f in os.listdir(path):
-        categ_path = os.path.join(path, f)
-        if os.path.isdir(categ_path):
-            print(f'{f}')
-            for f in os.listdir(categ_path):
-                if not f.endswith('.shp'):
-                    continue
-                ss_categ = os.path.splitext(f)[0]
-                print(f'    {ss_categ}')
+path = (r'C:\x\w\carto\ROUTE500_3-0__SHP_LAMB93_FXX_2019-10-30\ROUTE500'
+        r'\1_DONNEES_LIVRAISON_2019-11-00280\R500_3-0_SHP_LAMB93_FXX-ED191')
 
 #-------------------------------------------------------------------------------
-# route_500
+# catégories
 #-------------------------------------------------------------------------------
 
-def route_500():
-    path = (r'C:\x\w\carto\ROUTE500_3-0__SHP_LAMB93_FXX_2019-10-30\ROUTE500'
-            r'\1_DONNEES_LIVRAISON_2019-11-00280\R500_3-0_SHP_LAMB93_FXX-ED191')
-    for f in os.listdir(path):
-        categ_path = os.path.join(path, f)
-        if os.path.isdir(categ_path):
+def catégories(catalog):
+    categ = None
+    for e in catalog.entries:
+        f, ss_categ = os.path.split(os.path.splitext(e.path)[0])
+        if f != categ:
             categ = f
-            for f in os.listdir(categ_path):
-                if not f.endswith('.shp'):
-                    continue
-                ss_categ = os.path.splitext(f)[0]
-                print(f'\n{categ}/{ss_categ} :')
+            print(f'{categ}')
+        print(f'    {ss_categ}')
+
+#-------------------------------------------------------------------------------
+# route_500
+#-------------------------------------------------------------------------------
 
-                shp = build_header(os.path.join(categ_path, f'{ss_categ}.shp'))
-                print(shp)
+def route_500(catalog):
+    for e in catalog.entries:
+        print(f'\n{os.path.splitext(e.path)[0]} :')
+        print(e)
 
 #===============================================================================
 # main
 #===============================================================================
 
 if __name__ == '__main__':
-    catégories()
-    route_500()
\ No newline at end of file
+    # The files are read by ShpCatalog.scan(), only the ones that changed
+    # since the last run
+    catalog = ShpCatalog.scan(sys.argv[1] if len(sys.argv) > 1 else path)
+    catégories(catalog)
+    route_500(catalog)
@@ -4,9 +4,13 @@
 
 import os
 import sys
+import numpy as np
 from .common import ShapeType, ShpParser, MainFileHeader
 import shp.common as c
-from .shx import build_header
+from .columns import ShpColumns, null_code, record_boxes
+from .dbf import DbfFile
+from .index import ShpIndex
+from .shx import read_offsets
 
 first = True
 
@@ -49,7 +53,7 @@ class NullShapeRec(ShpBaseRec):
     @classmethod
     def build(cls, rec_nbr, offset, rec_len, s):
         """Build a class instance from a string."""
-        shape_type = ShapeType.from_int(c.int_lit_end(s[32:36]))
+        shape_type = ShapeType.from_int(c.int_lit_end(s[0:4]))
 
         return cls(rec_nbr, offset, rec_len, shape_type)
 
@@ -186,7 +190,8 @@ class PolyMRec(PolyRec):
     """Represents both PolyLineM's and PolygonM's"""
     def __init__(self, rec_nbr, offset, rec_len, shape_type, box, num_parts,
                  num_points, parts, points, Mmin=None, Mmax=None, Marray=None):
-        super().__init__(rec_nbr, offset, rec_len, shape_type)
+        super().__init__(rec_nbr, offset, rec_len, shape_type, box, num_parts,
+                 num_points, parts, points)
         self.Mmin = Mmin
         self.Mmax = Mmax
         self.Marray = Marray
@@ -247,6 +252,9 @@ class PolyZRec(PolyRec):
         zx = f'{c.fmt_data(self.Zmax)}'
         if len(zx) > 0:
             s += f', Zmax={zx}'        
+        if self.Mmin is None:
+            # No M values
+            return s
         mn = f'{c.fmt_data(self.Mmin)}'
         if len(mn) > 0:
             s += f', Mmin={mn}'
@@ -275,9 +283,12 @@ class PolyZRec(PolyRec):
         obj.Zmin, obj.Zmax = c.dbls_lit_end(s[Y:Y+16], n=2)
         Z = Y+16+8*obj.num_points
         obj.Zarray = c.dbls_lit_end(s[Y+16:Z], n=obj.num_points)
-        obj.Mmin, obj.Mmax = c.dbls_lit_end(s[Z:Z+16], n=2)
-        obj.Marray = c.dbls_lit_end(s[Z+16:Z+16+8*obj.num_points],
-                                    n=obj.num_points)
+
+        # M values are optional
+        if len(s) >= Z+16+8*obj.num_points:
+            obj.Mmin, obj.Mmax = c.dbls_lit_end(s[Z:Z+16], n=2)
+            obj.Marray = c.dbls_lit_end(s[Z+16:Z+16+8*obj.num_points],
+                                        n=obj.num_points)
         return obj
 
 #-------------------------------------------------------------------------------
@@ -285,41 +296,141 @@ class PolyZRec(PolyRec):
 #-------------------------------------------------------------------------------
 
 class ShapeFile:
-    def __init__(self, hdr):
+    """A .shp file, its records are found through the offsets read from the
+    .shx file, and decoded on demand from the memory-mapped .shp file.
+
+    Indexing gives a record, see ShpBaseRec, slicing a list of them, and
+    iterating goes through the records one by one. Attribute columns decodes
+    all the records at once, see ShpColumns, the first time it is used;
+    iter_columns() decodes them by chunks, in constant memory, and take()
+    only some of them, for instance the ones found by query().
+    """
+    def __init__(self, hdr, offsets=None, lengths=None, data=None,
+                 filepath=None):
         self.hdr = hdr
-        self.recs = []
+        self.offsets = offsets  # offsets of the records, from the .shx
+        self.lengths = lengths  # lengths of their contents
+        self.data = data  # contents of the .shp file, a uint8 memory map
+        self.filepath = filepath
+        self._columns = None
+        self._index = None
+        self._attributes = None
+
+    def __len__(self):
+        return 0 if self.offsets is None else len(self.offsets)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError(f'record {key} out of range')
+        offset = int(self.offsets[key])
+        s = self.data[offset:offset + 8 + self.lengths[key]].tobytes()
+        return decode_record(s, offset, self.hdr.shape_type)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
 
     def __str__(self):
         s = ''
         s += f'{self.hdr}\n'
-        for r in self.recs:
-            s += f'{r}\n'
+        if len(self) > 0:
+            cols = self.columns
+        for i in range(len(self)):
+            parts = cols.rec_parts[i + 1] - cols.rec_parts[i]
+            points = cols.parts[cols.rec_parts[i + 1]] - \
+                cols.parts[cols.rec_parts[i]]
+            s += f'{i + 1:>06} {self.offsets[i]:_} {self.lengths[i]}' \
+                f', parts={parts:_}, points={points:_}\n'
         return s
 
+    @property
+    def columns(self):
+        """All the records, as a ShpColumns."""
+        if self._columns is None:
+            self._columns = self.take(slice(None))
+        return self._columns
+
+    def take(self, ids):
+        """Decode the records of numbers ids, from 0, an array or a slice, as
+        a ShpColumns.
+        """
+        cols = ShpColumns.decode(self.data, self.offsets[ids],
+                                 self.lengths[ids])
+        for code in np.unique(cols.types):
+            shape_type = ShapeType.from_int(int(code))
+            if code != null_code and shape_type != self.hdr.shape_type:
+                msg = f'Record has shape type {shape_type}' \
+                    f', should be {self.hdr.shape_type}'
+                raise(ShpParser(msg))
+        return cols
+
+    def iter_columns(self, chunk_size=65536):
+        """Yield the records by chunks of chunk_size, as couples (start,
+        ShpColumns), start being the number of the first record of the chunk.
+        """
+        for start in range(0, len(self), chunk_size):
+            yield start, self.take(slice(start, start + chunk_size))
+
+    def record_boxes(self):
+        """Bounding boxes of the records, see columns.record_boxes()."""
+        if self._columns is not None:
+            return self._columns.boxes
+        return record_boxes(self.data, self.offsets)
+
+    @property
+    def index(self):
+        """Spatial index of the records, a ShpIndex, read from the file next
+        to the .shp file, or built and written there the first time.
+        """
+        if self._index is None and self.filepath is not None:
+            self._index = ShpIndex.load(self.filepath)
+        if self._index is None:
+            self._index = ShpIndex.build(self.record_boxes())
+            if self.filepath is not None:
+                self._index.save(self.filepath)
+        return self._index
+
+    @property
+    def attributes(self):
+        """Attributes of the records, a DbfFile read from the .dbf file next
+        to the .shp file, None if there is none.
+        """
+        if self._attributes is None and self.filepath is not None:
+            root, ext = os.path.splitext(self.filepath)
+            if os.path.exists(f'{root}.dbf'):
+                self._attributes = DbfFile.build(f'{root}.dbf')
+        return self._attributes
+
+    def query(self, box):
+        """Sorted numbers of the records, from 0, whose bounding box
+        intersects box, (xmin, ymin, xmax, ymax).
+        """
+        return self.index.query(box)
+
 #-------------------------------------------------------------------------------
 # Building a ShapeFile from outside data
 #-------------------------------------------------------------------------------
 
-def build_record(f, offset, hdr_shape_type):
-    """Offset is the current offset in the file."""
+def decode_record(s, offset, hdr_shape_type):
+    """Build a record from string s, its header and contents, found at offset
+    in the file.
+    """
     # Record header (length is number of 16-bit words)
-    s = f.read(8)
-    if s == b'':
-        # EOF (note the 'b' above)
-        return None, offset
     rec_nbr = c.int_big_end(s[0:4])
     rec_len = 2*(c.int_big_end(s[4:8]))  # in bytes
-
-    # Read the rest of the record
-    s = f.read(rec_len)
+    s = s[8:8+rec_len]
     shape_type = ShapeType.from_int(c.int_lit_end(s[0:4]))
-    if shape_type != hdr_shape_type:
+    if shape_type not in (hdr_shape_type, ShapeType.NullShape):
         msg = f'Record has shape type {shape_type}, should be {hdr_shape_type}'
         raise(ShpParser(msg))
 
     # Dispatch based on shape type
     if shape_type == ShapeType.NullShape:
-        rec = NullShapeRec.build(rec_nbr, offset, rec_len)
+        rec = NullShapeRec.build(rec_nbr, offset, rec_len, s)
     elif shape_type == ShapeType.Point:
         rec = PointRec.build(rec_nbr, offset, rec_len, s, shape_type)
     elif shape_type == ShapeType.PointM:
@@ -334,44 +445,45 @@ def build_record(f, offset, hdr_shape_type):
         rec = PolyZRec.build(rec_nbr, offset, rec_len, s, shape_type)
     else:
         raise NotImplementedError
-    return rec, offset + 8 + rec_len
-
-def _build(f):
-    # Get the header first
-    shp = _build_header(f)
-
-    # Get the datarecords
-    offset = 100  # main file header size in bytes
-    while True:
-        rec, offset = build_record(f, offset, shp.hdr.shape_type)
-        if rec is None:
-            break
-        shp.recs.append(rec)
-    return shp
+    return rec
 
-def build(filepath):
-    """Build a class instance from a file."""
-    # First, load the .shp file itself
-    with open(filepath, 'rb') as f:
-        shp = _build(f)
+def build_record(f, offset, hdr_shape_type):
+    """Offset is the current offset in the file."""
+    s = f.read(8)
+    if s == b'':
+        # EOF (note the 'b' above)
+        return None, offset
+    rec_len = 2*(c.int_big_end(s[4:8]))  # in bytes
 
-    # Second, get the corresponding index file
-    root, ext = os.path.splitext(filepath)
-    filepath = f'{root}.shx'
-    idx = build_header(filepath)
-
-    # Check the number of records
-    nbr_recs = int((idx.hdr.file_length - 100)/8)
-    # FIXME derive an IndexFileHeader class from MainFileHeader, and add the
-    # nbr_recs property
-    if len(shp.recs) == nbr_recs:
-        # print(f'File has {nbr_recs} records.')
-        pass
-    else:
-        print('Inconsistent number of records:'
-              f' {len(shp.recs)} in .shp, {nbr_recs} in .shx')
+    # Read the rest of the record
+    s += f.read(rec_len)
+    return decode_record(s, offset, hdr_shape_type), offset + 8 + rec_len
+
+def build(filepath, lazy=False):
+    """Build a class instance from a file.
 
-    # We're done
+    The records are found through the corresponding index file, .shx, and
+    decoded all at once from the memory-mapped .shp file, or only when they
+    are used if lazy is true.
+    """
+    root, ext = os.path.splitext(filepath)
+    offsets, lengths = read_offsets(f'{root}.shx')
+    data = np.memmap(filepath, dtype=np.uint8, mode='r')
+    shp = ShapeFile(MainFileHeader.build(bytes(data[:100])), offsets, lengths,
+                    data, filepath)
+
+    # Check that the records are all in the file
+    ends = offsets + 8 + lengths
+    if len(ends) > 0 and ends.max() > len(data):
+        print('Inconsistent index: records end at'
+              f' {ends.max():_} in .shx, file has {len(data):_} bytes')
+        keep = ends <= len(data)
+        offsets, lengths = offsets[keep], lengths[keep]
+        shp.offsets, shp.lengths = offsets, lengths
+
+    if not lazy:
+        # Decode the records now
+        shp.columns
     return shp
 
 def _build_header(f):
@@ -3,6 +3,7 @@
 """Shapefile index file parser."""
 
 import sys
+import numpy as np
 from .common import ShapeType, ShpParser, MainFileHeader
 import shp.common as c
 
@@ -76,6 +77,16 @@ def build(filepath):
     with open(filepath, 'rb') as f:
         return _build(f)
 
+def read_offsets(filepath):
+    """Read the records of a .shx file as arrays.
+
+    Return the offsets of the records in the .shp file, and the lengths of
+    their contents, in bytes, as two int64 arrays.
+    """
+    recs = np.fromfile(filepath, dtype='>i4', offset=100).reshape(-1, 2)
+    recs = 2*recs.astype(np.int64)
+    return recs[:, 0], recs[:, 1]
+
 def _build_header(f):
     hdr = MainFileHeader.build(f.read(100))
     return ShxFile(hdr)
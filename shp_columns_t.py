@@ -0,0 +1,151 @@
+# mapv/shp_columns_t.py
+
+import struct
+import unittest
+
+import numpy as np
+
+from shp.columns import ShpColumns, record_boxes
+
+#-------------------------------------------------------------------------------
+# I want stdout to be unbuffered, always
+#-------------------------------------------------------------------------------
+
+class Unbuffered(object):
+    def __init__(self, stream):
+        self.stream = stream
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+import sys
+sys.stdout = Unbuffered(sys.stdout)
+
+#-------------------------------------------------------------------------------
+# Helper functions
+#-------------------------------------------------------------------------------
+
+def box(points):
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return struct.pack('<4d', min(xs), min(ys), max(xs), max(ys))
+
+def values(v):
+    """A range then the values, as in Z and M runs."""
+    return struct.pack(f'<2d{len(v)}d', min(v), max(v), *v)
+
+def poly(code, parts, z=None, m=None):
+    points = [p for part in parts for p in part]
+    s = struct.pack('<i', code) + box(points)
+    s += struct.pack('<2i', len(parts), len(points))
+    start = 0
+    for part in parts:
+        s += struct.pack('<i', start)
+        start += len(part)
+    s += b''.join(struct.pack('<2d', *p) for p in points)
+    if z is not None:
+        s += values(z)
+    if m is not None:
+        s += values(m)
+    return s
+
+def multipoint(code, points, z=None, m=None):
+    s = struct.pack('<i', code) + box(points)
+    s += struct.pack('<i', len(points))
+    s += b''.join(struct.pack('<2d', *p) for p in points)
+    if z is not None:
+        s += values(z)
+    if m is not None:
+        s += values(m)
+    return s
+
+def shp_data(contents):
+    """Bytes of a .shp file with records contents, and the offsets and
+    lengths of the records, as the .shx file gives them.
+    """
+    s = bytes(100)
+    offsets, lengths = [], []
+    for i, content in enumerate(contents):
+        offsets.append(len(s))
+        lengths.append(len(content))
+        s += struct.pack('>2i', i + 1, len(content)//2) + content
+    return np.frombuffer(s, dtype=np.uint8), offsets, lengths
+
+def decode(contents):
+    return ShpColumns.decode(*shp_data(contents))
+
+#-------------------------------------------------------------------------------
+# Decode
+#-------------------------------------------------------------------------------
+
+class Decode(unittest.TestCase):
+
+    def test_01_polylines(self):
+        c = decode([poly(3, [[(0, 0), (1, 1)], [(2, 2), (3, 2), (3, 3)]]),
+                    poly(3, [[(5, 5), (6, 6)]])])
+        self.assertEqual(2, len(c))
+        self.assertEqual([0, 2, 3], c.rec_parts.tolist())
+        self.assertEqual([0, 2, 5, 7], c.parts.tolist())
+        np.testing.assert_array_equal([[2, 2], [3, 2], [3, 3]],
+                                      c.points(0)[1])
+        np.testing.assert_array_equal([[0, 0, 3, 3], [5, 5, 6, 6]], c.boxes)
+        self.assertIsNone(c.z)
+        self.assertIsNone(c.m)
+
+    def test_02_null(self):
+        contents = [struct.pack('<i', 0), poly(3, [[(0, 0), (1, 1)]])]
+        c = decode(contents)
+        self.assertEqual([0, 0, 1], c.rec_parts.tolist())
+        self.assertEqual([], c.points(0))
+        self.assertTrue(np.isnan(c.boxes[0]).all())
+        data, offsets, _ = shp_data(contents)
+        np.testing.assert_array_equal(c.boxes, record_boxes(data, offsets))
+
+    def test_03_z_and_optional_m(self):
+        c = decode([poly(13, [[(0, 0), (1, 1)]], z=[5, 6], m=[7, 8]),
+                    poly(13, [[(2, 2), (3, 3), (4, 4)]], z=[1, 2, 3])])
+        np.testing.assert_array_equal([5, 6, 1, 2, 3], c.z)
+        np.testing.assert_array_equal([7, 8], c.m[:2])
+        self.assertTrue(np.isnan(c.m[2:]).all())
+
+    def test_04_m_no_data(self):
+        c = decode([poly(23, [[(0, 0), (1, 1)]], m=[-1e39, 4])])
+        self.assertIsNone(c.z)
+        self.assertTrue(np.isnan(c.m[0]))
+        self.assertEqual(4, c.m[1])
+
+    def test_05_points(self):
+        c = decode([struct.pack('<i2d2d', 11, 1, 2, 3, 4),
+                    struct.pack('<i2dd', 21, 5, 6, 7)])
+        np.testing.assert_array_equal([[1, 2], [5, 6]], c.xy)
+        np.testing.assert_array_equal([[1, 2, 1, 2], [5, 6, 5, 6]], c.boxes)
+        self.assertEqual(3, c.z[0])
+        self.assertTrue(np.isnan(c.z[1]))
+        np.testing.assert_array_equal([4, 7], c.m)
+
+    def test_06_multipoint(self):
+        c = decode([multipoint(18, [(0, 0), (1, 2), (3, 1)], z=[1, 2, 3],
+                               m=[4, 5, 6]),
+                    multipoint(8, [(9, 9)])])
+        self.assertEqual([0, 1, 2], c.rec_parts.tolist())
+        self.assertEqual([0, 3, 4], c.parts.tolist())
+        np.testing.assert_array_equal([0, 0, 3, 2], c.boxes[0])
+        np.testing.assert_array_equal([1, 2, 3], c.z[:3])
+        np.testing.assert_array_equal([4, 5, 6], c.m[:3])
+
+    def test_07_polylines_only(self):
+        c = decode([poly(3, [[(0, 0), (1, 1)]]), multipoint(8, [(9, 9)]),
+                    struct.pack('<i', 0), poly(3, [[(2, 2), (3, 3), (4, 4)]])])
+        xy, offsets = c.polylines()
+        self.assertEqual([0, 2, 5], offsets.tolist())
+        np.testing.assert_array_equal([[0, 0], [1, 1], [2, 2], [3, 3], [4, 4]],
+                                      xy)
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
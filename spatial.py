@@ -0,0 +1,146 @@
+# mapv/spatial.py - spatial index over bounding boxes
+
+"""Uniform grid index.
+
+Features are indexed by their bounding box, given as (xmin, ymin, xmax, ymax),
+the same order as the shapefile boxes. The extent of all the boxes is split
+into a grid of cells, each cell holds the ids of the features whose box
+overlaps it. The cell lists are stored in a compressed form, as one array of
+ids sorted by cell plus the start of each cell in that array, so that the
+index is a handful of NumPy arrays whatever the number of features.
+
+"""
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Average number of features per cell, used to choose the grid size
+items_per_cell = 4
+
+# Upper bound on the number of cells along each axis
+max_cells = 1024
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def polyline_boxes(xy, offsets):
+    """Bounding boxes of the polylines of a flat vertex array plus offsets.
+
+    Return an (n, 4) array of (xmin, ymin, xmax, ymax), computed with one
+    reduceat per column. Every polyline must have at least one vertex.
+    """
+    if len(offsets) < 2:
+        return np.empty((0, 4))
+    starts = offsets[:-1]
+    return np.column_stack([np.minimum.reduceat(xy[:, 0], starts),
+                            np.minimum.reduceat(xy[:, 1], starts),
+                            np.maximum.reduceat(xy[:, 0], starts),
+                            np.maximum.reduceat(xy[:, 1], starts)])
+
+def ranges(starts, counts):
+    """Concatenation of the integer ranges [start, start + count)."""
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    first = np.cumsum(counts) - counts
+    return (np.repeat(np.asarray(starts, dtype=np.int64) - first, counts) +
+            np.arange(total))
+
+#-------------------------------------------------------------------------------
+# GridIndex
+#-------------------------------------------------------------------------------
+
+class GridIndex:
+    """Uniform grid over the bounding boxes of a set of features."""
+    def __init__(self, boxes, extent, shape, cell_start, items):
+        self.boxes = boxes  # (n, 4) array, the indexed boxes
+        self.extent = extent  # (xmin, ymin, xmax, ymax) of the grid
+        self.shape = shape  # (nx, ny) number of cells
+        self.cell_start = cell_start  # nx*ny + 1 positions in items
+        self.items = items  # feature ids, sorted by cell
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @classmethod
+    def build(cls, boxes):
+        """Build the index for an (n, 4) array of boxes."""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        n = len(boxes)
+        if n == 0:
+            return cls(boxes, (0.0, 0.0, 1.0, 1.0), (1, 1),
+                       np.zeros(2, dtype=np.int64),
+                       np.empty(0, dtype=np.int64))
+
+        extent = (boxes[:, 0].min(), boxes[:, 1].min(),
+                  boxes[:, 2].max(), boxes[:, 3].max())
+
+        # Roughly square cells, about items_per_cell features in each
+        w = max(extent[2] - extent[0], 1e-12)
+        h = max(extent[3] - extent[1], 1e-12)
+        cells = max(n/items_per_cell, 1)
+        nx = int(np.clip(np.sqrt(cells*w/h), 1, max_cells))
+        ny = int(np.clip(cells/nx, 1, max_cells))
+
+        cx0, cy0, cx1, cy1 = cls._cells(boxes.T, extent, (nx, ny))
+
+        # One (cell, id) couple for every cell overlapped by every box
+        wx = cx1 - cx0 + 1
+        counts = wx*(cy1 - cy0 + 1)
+        ids = np.repeat(np.arange(n), counts)
+        k = ranges(np.zeros(n), counts)
+        cell = (cy0[ids] + k//wx[ids])*nx + cx0[ids] + k % wx[ids]
+
+        order = np.argsort(cell, kind='stable')
+        cell_start = np.searchsorted(cell[order], np.arange(nx*ny + 1))
+        return cls(boxes, extent, (nx, ny), cell_start, ids[order])
+
+    @staticmethod
+    def _cells(box, extent, shape):
+        """Cell ranges covered by box (arrays or scalars), clipped to grid."""
+        xmin, ymin, xmax, ymax = box
+        nx, ny = shape
+        cw = max(extent[2] - extent[0], 1e-12)/nx
+        ch = max(extent[3] - extent[1], 1e-12)/ny
+
+        def cell(v, origin, size, n):
+            c = np.floor((np.asarray(v) - origin)/size).astype(np.int64)
+            return np.clip(c, 0, n - 1)
+
+        return (cell(xmin, extent[0], cw, nx), cell(ymin, extent[1], ch, ny),
+                cell(xmax, extent[0], cw, nx), cell(ymax, extent[1], ch, ny))
+
+    def query(self, box):
+        """Sorted ids of the features whose box intersects box."""
+        xmin, ymin, xmax, ymax = box
+        ex0, ey0, ex1, ey1 = self.extent
+        if len(self) == 0 or xmax < ex0 or xmin > ex1 or ymax < ey0 or \
+           ymin > ey1:
+            return np.empty(0, dtype=np.int64)
+
+        nx, _ = self.shape
+        cx0, cy0, cx1, cy1 = (int(c) for c in self._cells(box, self.extent,
+                                                           self.shape))
+
+        # Cells of a grid row are contiguous in items
+        rows = np.arange(cy0, cy1 + 1)*nx
+        lo = self.cell_start[rows + cx0]
+        hi = self.cell_start[rows + cx1 + 1]
+        ids = np.unique(self.items[ranges(lo, hi - lo)])
+
+        # Exact test, the cells are only an approximation of the boxes
+        b = self.boxes[ids]
+        keep = (b[:, 0] <= xmax) & (b[:, 2] >= xmin) & \
+               (b[:, 1] <= ymax) & (b[:, 3] >= ymin)
+        return ids[keep]
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    print('This module is not meant to be executed directly.')
@@ -0,0 +1,125 @@
+# mapv/tag_filter_t.py
+
+import unittest
+
+import numpy as np
+
+from pbf.osm_pbf import OsmTags, TagFilter
+
+#-------------------------------------------------------------------------------
+# I want stdout to be unbuffered, always
+#-------------------------------------------------------------------------------
+
+class Unbuffered(object):
+    def __init__(self, stream):
+        self.stream = stream
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+import sys
+sys.stdout = Unbuffered(sys.stdout)
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Tags of 5 elements, the fourth one has none
+elements = [
+    {'highway': 'residential', 'name': 'Main'},
+    {'waterway': 'river'},
+    {'waterway': 'ditch', 'highway': 'track'},
+    {},
+    {'building': 'yes', 'waterway': 'stream'},
+]
+
+#-------------------------------------------------------------------------------
+# Helper functions
+#-------------------------------------------------------------------------------
+
+def osm_tags(elements):
+    """OsmTags of a list of tags dictionaries."""
+    strings = ['']
+    code = {'': 0}
+    counts, keys, vals = [], [], []
+    for tags in elements:
+        counts.append(len(tags))
+        for k, v in tags.items():
+            for s in (k, v):
+                if s not in code:
+                    code[s] = len(strings)
+                    strings.append(s)
+            keys.append(code[k])
+            vals.append(code[v])
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return OsmTags(offsets, np.array(keys, dtype=np.int32),
+                   np.array(vals, dtype=np.int32), strings)
+
+#-------------------------------------------------------------------------------
+# Parse
+#-------------------------------------------------------------------------------
+
+class Parse(unittest.TestCase):
+
+    def test_01_terms(self):
+        f = TagFilter.parse('highway=* waterway=river|stream,building')
+        self.assertEqual({'highway': None, 'waterway': {'river', 'stream'},
+                          'building': None}, f.terms)
+
+    def test_02_any_value_wins(self):
+        f = TagFilter.parse('waterway=river waterway=* waterway=stream')
+        self.assertEqual({'waterway': None}, f.terms)
+
+    def test_03_values_merge(self):
+        f = TagFilter.parse('waterway=river waterway=stream|canal')
+        self.assertEqual({'waterway': {'river', 'stream', 'canal'}}, f.terms)
+
+    def test_04_canonical(self):
+        a = TagFilter.parse('waterway=stream|river, highway')
+        b = TagFilter.parse('highway=* waterway=river waterway=stream')
+        self.assertEqual(repr(a), repr(b))
+        self.assertEqual('highway=* waterway=river|stream', repr(a))
+
+    def test_05_make(self):
+        f = TagFilter.parse('highway')
+        self.assertIs(f, TagFilter.make(f))
+        self.assertIsNone(TagFilter.make(None))
+        self.assertEqual({'highway': None},
+                         TagFilter.make({'highway': None}).terms)
+
+#-------------------------------------------------------------------------------
+# Match
+#-------------------------------------------------------------------------------
+
+class Match(unittest.TestCase):
+
+    def test_01_match(self):
+        f = TagFilter.parse('highway waterway=river|stream')
+        self.assertEqual([True, True, True, False, True],
+                         [f.match(tags) for tags in elements])
+
+    def test_02_values(self):
+        f = TagFilter.parse('waterway=ditch')
+        self.assertEqual([False, False, True, False, False],
+                         [f.match(tags) for tags in elements])
+
+    def test_03_select_as_match(self):
+        tags = osm_tags(elements)
+        for expr in ('highway', 'waterway=river|stream', 'name=Main',
+                     'building=no', 'railway', 'waterway=ditch highway=track'):
+            f = TagFilter.parse(expr)
+            self.assertEqual([f.match(t) for t in elements],
+                             f.select(tags).tolist(), expr)
+
+    def test_04_select_empty(self):
+        tags = osm_tags([])
+        self.assertEqual(0, len(TagFilter.parse('highway').select(tags)))
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
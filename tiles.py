@@ -0,0 +1,140 @@
+# mapv/tiles.py - parallel tile rasterization
+
+"""Rasterizing a frame as a set of tiles, in parallel.
+
+The frame is split into square screen tiles. Each tile rasterizes only the
+polylines whose bounding box intersects it, as given by the spatial index of
+each LineBatch, and paints them directly into its own part of the layer, so
+that stitching the tiles together costs nothing. Tiles never overlap, so they
+can be handed to a thread pool without any locking: the coverage mask and the
+destination are shared, but each tile only touches its own rectangle of them.
+The segments of a tile are clipped to it before being rasterized.
+
+A thread pool is enough here because the work of a tile is done in NumPy
+calls over large arrays, which release the GIL. There is a single pool, shared
+by the renderers of all the windows, so that none is left running when a
+window is destroyed.
+
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from clip import clip_segments
+from compose import paint
+from raster import rasterize_segments
+
+#-------------------------------------------------------------------------------
+# Globals
+#-------------------------------------------------------------------------------
+
+# Thread pool of the tile renderers, see tile_pool()
+pool = None
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def tile_pool():
+    """The thread pool shared by all the tile renderers, created on first
+    use, with one thread per CPU.
+    """
+    global pool
+    if pool is None:
+        pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+    return pool
+
+def box_union(b1, b2):
+    """Union of two (left, upper, right, lower) boxes, either can be None."""
+    if b1 is None:
+        return b2
+    if b2 is None:
+        return b1
+    return (min(b1[0], b2[0]), min(b1[1], b2[1]),
+            max(b1[2], b2[2]), max(b1[3], b2[3]))
+
+def box_intersection(b1, b2):
+    """Intersection of two (left, upper, right, lower) boxes, or None."""
+    if b1 is None or b2 is None:
+        return None
+    box = (max(b1[0], b2[0]), max(b1[1], b2[1]),
+           min(b1[2], b2[2]), min(b1[3], b2[3]))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return None
+    return box
+
+#-------------------------------------------------------------------------------
+# TileRenderer
+#-------------------------------------------------------------------------------
+
+class TileRenderer:
+    """Split the frame into tiles, and rasterize them in a thread pool."""
+    def __init__(self, tile_size=256):
+        self.tile_size = tile_size
+        self.pool = tile_pool()
+
+    def tiles(self, rect):
+        """Tiles covering rect, all of them (left, upper, right, lower)."""
+        left, upper, right, lower = rect
+        t = self.tile_size
+        return [(x, y, min(x + t, right), min(y + t, lower))
+                for y in range(upper, lower, t)
+                for x in range(left, right, t)]
+
+    def draw(self, dst, cov, groups, to_map, antialias=False, rect=None):
+        """Rasterize groups of line batches into dst, tile by tile.
+
+        Argument groups is a list of (color, width, items) triples, in drawing
+        order, where items is a list of (batch, xy) couples: a LineBatch and
+        its vertices in window coordinates (only the vertices of the visible
+        polylines are needed). Function to_map converts a window rectangle to
+        a map box, to query the batches' spatial indexes.
+        Argument rect limits drawing to a part of dst, None is all of it.
+
+        Return the bounding box of the painted pixels, or None.
+        """
+        if rect is None:
+            h, w = cov.shape
+            rect = 0, 0, w, h
+
+        def draw_tile(tile):
+            return self.draw_tile(dst, cov, tile, groups, to_map, antialias)
+
+        box = None
+        for b in self.pool.map(draw_tile, self.tiles(rect)):
+            box = box_union(box, b)
+        return box
+
+    @staticmethod
+    def draw_tile(dst, cov, tile, groups, to_map, antialias):
+        """Rasterize and paint a single tile, see draw()."""
+        x0, y0, x1, y1 = tile
+        cov = cov[y0:y1, x0:x1]
+        dst = dst[y0:y1, x0:x1]
+        box = None
+        for color, width, items in groups:
+            # Lines reach width/2 beyond their bounding box
+            m = width/2 + 1
+            query = to_map(x0 - m, y0 - m, x1 + m, y1 + m)
+            segs = [b.segments(xy, b.index.query(query)) for b, xy in items]
+            if len(segs) == 0:
+                continue
+            segs = clip_segments(np.concatenate(segs),
+                                 (x0 - m, y0 - m, x1 + m, y1 + m))
+            rasterize_segments(cov, segs, width, antialias, origin=(x0, y0))
+            ys, xs = paint(dst, cov, color)
+            if len(ys) == 0:
+                continue
+            cov[ys, xs] = 0
+            box = box_union(box, (x0 + int(xs.min()), y0 + int(ys.min()),
+                                  x0 + int(xs.max()) + 1,
+                                  y0 + int(ys.max()) + 1))
+        return box
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    print('This module is not meant to be executed directly.')
@@ -11,7 +11,7 @@ from model_dlg3 import Dlg3Model
 from model_shp import Shapefile
 from model_usgs import UsgsModel
 from model_osm import Osm
-from panel import MainPanel
+from panel import MainPanel, dlg_layers
 from storage import mapname_filepaths, get_dir, set_dir
 from summary import SummaryDialog
 from usgs import Usgs
@@ -95,11 +95,13 @@ class DlgFrame(wx.Frame):
             if self.win.model is None or self.win.model.kind != 'Shapefile':
                 self.win.model = Shapefile()
             self.win.model.open(os.path.join(dir, file))
+            self.show_layers()
             self.win.update_view()
         d.Destroy()
 
     def on_open_osm(self, _):
-        wildcard = 'OSM Files (*.pbf)|*.pbf|All files (*.*)|*.*'
+        wildcard = 'OSM Files (*.pbf;*.o5m;*.osm;*.osm.bz2;*.osm.gz)' \
+            '|*.pbf;*.o5m;*.osm;*.osm.bz2;*.osm.gz|All files (*.*)|*.*'
         d = wx.FileDialog(self, message='Open an OSM file', defaultDir=get_dir(),
                           defaultFile='', wildcard=wildcard, style=wx.FD_OPEN)
         if d.ShowModal() == wx.ID_OK:
@@ -110,6 +112,7 @@ class DlgFrame(wx.Frame):
             if self.win.model is None or self.win.model.kind != 'Osm':
                 self.win.model = Osm()
             self.win.model.open(os.path.join(dir, file))
+            self.show_layers()
             self.win.update_view()
         d.Destroy()
 
@@ -128,6 +131,7 @@ class DlgFrame(wx.Frame):
             # controller.
             if self.win.model is None or self.win.model.kind != 'Dlg3':
                 self.win.model = Dlg3Model()
+                self.show_layers()
             filepath = os.path.join(dir, file)
             try:
                 mapname, category, filename = self.win.model.open(filepath)
@@ -152,12 +156,14 @@ class DlgFrame(wx.Frame):
         self.GetStatusBar().PushStatusText(s)
         if self.win.model is None or self.win.model.kind == 'Usgs':
             self.win.model = Dlg3Model()
+            self.show_layers()
         self.win.model.open_mapname(mapname)
         self.win.update_view()
             
     def on_clear(self, _):
         # FIXME clear line and area text boxes in the controls panel
         self.win.clear()
+        self.show_layers()
         self.panel.pnl.clear()
         self.showing_usgs = None
         self.win.update_view()
@@ -189,6 +195,27 @@ class DlgFrame(wx.Frame):
             c = data.GetColour()
             # print(f'Color: {c}')
 
+    def show_layer_style(self, _):
+        model = self.win.model
+        if model is None or model.kind != 'Shapefile' or not model.layers:
+            self.GetStatusBar().PushStatusText('No shapefile layer')
+            return
+        names = [layer.name for layer in model.layers]
+        with wx.SingleChoiceDialog(self, 'Layer', 'Layer style', names) as d:
+            if d.ShowModal() != wx.ID_OK:
+                return
+            layer = model.layers[d.GetSelection()]
+        data = wx.ColourData()
+        data.SetColour(wx.Colour(layer.color))
+        with wx.ColourDialog(self, data) as d:
+            if d.ShowModal() != wx.ID_OK:
+                return
+            c = d.GetColourData().GetColour()
+        width = wx.GetNumberFromUser('Line width, in pixels', 'Width',
+                                     'Layer style', layer.width, 1, 20, self)
+        self.on_style_layer(layer.name, c.GetAsString(wx.C2S_HTML_SYNTAX),
+                            width if width > 0 else None)
+
     def on_about(self, _):
         s = 'Mapv is a viewer for USGS DLG-3 cartographic data.'
         d = wx.MessageDialog(self, s, 'About Mapv')
@@ -220,6 +247,29 @@ class DlgFrame(wx.Frame):
         # changed, so we call update_view() as usual.
         self.win.update_view(layering=True)
 
+    def on_style_layer(self, code, color=None, width=None):
+        self.win.style_layer(code, color, width)
+        # The layer is drawn again in its new style, the others are only
+        # composited
+        self.win.update_view(layering=True)
+
+    def show_layers(self):
+        """Show the checkboxes of the layers of the model: the layers of a
+        shapefile model, the DLG-3 categories otherwise.
+
+        The boxes are checked as the layers are visible, the DLG-3 categories
+        keep their visibility when the model changes.
+        """
+        model = self.win.model
+        if model is not None and model.kind == 'Shapefile':
+            self.panel.pnl.set_layers(
+                {layer.name: layer.name for layer in model.layers},
+                {layer.name for layer in model.layers if layer.visible})
+        else:
+            self.panel.pnl.set_layers(
+                dlg_layers,
+                {layer.code for layer in self.win.layers if layer.visible})
+
     def create_menus(self):
         fm = wx.Menu()
         mi = fm.Append(wx.ID_ANY, '&Open file', 'Open a DLG-3 file')
@@ -252,6 +302,9 @@ class DlgFrame(wx.Frame):
         self.Bind(wx.EVT_MENU, self.show_summary, mi)
         mi = fm.Append(wx.ID_ANY, 'Colors', 'Color picker')
         self.Bind(wx.EVT_MENU, self.show_colors, mi)
+        mi = fm.Append(wx.ID_ANY, 'Layer style',
+                       'Color and line width of a shapefile layer')
+        self.Bind(wx.EVT_MENU, self.show_layer_style, mi)
         mi = fm.Append(wx.ID_ANY, '&About', 'Yet another map viewer')
         self.Bind(wx.EVT_MENU, self.on_about, mi)
         fm.AppendSeparator()